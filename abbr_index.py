@@ -0,0 +1,230 @@
+import heapq
+import itertools
+
+from pinyin_trie import SEPARATORS
+
+# 缩写 / 首字母索引：按音节逐层建立的前缀树，每层既可用完整音节、也可用声母 (首字母或 zh/ch/sh) 走到子节点
+#   szdt   -> 守株待兔 (全部用声母)
+#   szd    -> 守株待兔 (部分缩写，取子树中得分最高的词补全)
+#   shouzd -> 守株待兔 (完整音节与声母混用)
+#   zgr    -> 中国人   (没有整词时由多个词拼接)
+# 词的得分与 HMM 一致 (初始概率 + 逐字转移)，拼接时再加上两词之间的转移分数。
+# 查询只沿输入走前缀树，代价与输入长度和每层分支数有关，与词表大小无关。
+
+ABBR_INITIALS = ("zh", "ch", "sh")
+MAX_READINGS = 8     # 多音字组合过多时只取前几种读音
+SUBTREE_TOP = 5      # 每个节点保留的子树最优词数
+ABBR_BEAM = 10       # 拼接时每个位置保留的组合数；固定值，排序不随调用方要的条数变化
+
+
+def _abbr_keys(syllable):
+    keys = [syllable[0]]
+    if syllable[:2] in ABBR_INITIALS: keys.append(syllable[:2])
+    return keys
+
+
+class _Node:
+    __slots__ = ("full", "abbr", "words", "best")
+
+    def __init__(self):
+        self.full = {}   # 完整音节 -> 子节点
+        self.abbr = {}   # 声母 -> [子节点]
+        self.words = []  # 恰好在此结束的词 [(得分, 词)]，降序
+        self.best = []   # 子树中得分最高的词 [(得分, 词)]，降序
+
+
+class AbbrIndex:
+    def __init__(self, store, trie):
+        self.store = store
+        self.trie = trie
+        self.root = _Node()
+        self.size = 0
+        self.nodes = 1
+
+    @classmethod
+    def build(cls, store, trie, emit_p, words):
+        """
+        :param emit_p: 拼音 -> 汉字列表，反查出每个字的读音
+        :param words: 可迭代的词表 (单字由 emit_p 自动加入)
+        """
+        index = cls(store, trie)
+        readings = {}
+        for py, chars in emit_p.items():
+            for c in chars:
+                readings.setdefault(c, []).append(py)
+        ids = store.char_ids
+        seen = set()
+        for word in itertools.chain(readings, words):
+            if word in seen or not all(c in ids and c in readings for c in word): continue
+            seen.add(word)
+            score = index.word_score(word)
+            for syllables in itertools.islice(itertools.product(*(readings[c] for c in word)), MAX_READINGS):
+                index.add(syllables, word, score)
+        index._finish(index.root)
+        return index
+
+    def word_score(self, word):
+        store = self.store
+        ids = [store.char_ids[c] for c in word]
+        score = store.start_score(ids[0])
+        for prev, curr in zip(ids, ids[1:]):
+            score += store.score(prev, curr)
+        return score
+
+    def add(self, syllables, word, score):
+        node = self.root
+        for py in syllables:
+            child = node.full.get(py)
+            if child is None:
+                child = node.full[py] = _Node()
+                self.nodes += 1
+                for key in _abbr_keys(py):
+                    node.abbr.setdefault(key, []).append(child)
+            node = child
+        node.words.append((score, word))
+        self.size += 1
+
+    def _finish(self, node):
+        """ 自底向上排序并汇总子树最优词 """
+        node.words.sort(key=lambda x: -x[0])
+        pool = list(node.words)
+        for child in node.full.values():
+            self._finish(child)
+            pool.extend(child.best)
+        best, seen = [], set()
+        for item in sorted(pool, key=lambda x: -x[0]):
+            if item[1] in seen: continue
+            seen.add(item[1])
+            best.append(item)
+            if len(best) >= SUBTREE_TOP: break
+        node.best = best
+
+    def _walk(self, text, start):
+        """
+        从 text[start] 出发沿前缀树能走到的所有 (终点, 节点)
+        :return: (结果, 遍历读到的最远位置)；读到了 text 末尾时为 None (输入变长后结果可能不同)
+        """
+        reached = []
+        stack = [(start, self.root)]
+        visited = set()
+        n = len(text)
+        span = max(self.trie.max_len, 2)
+        reach = start
+        while stack:
+            i, node = stack.pop()
+            if (i, id(node)) in visited: continue
+            visited.add((i, id(node)))
+            if node is not self.root: reached.append((i, node))
+            if reach is not None: reach = None if i + span > n else max(reach, i + span)
+            if i >= n: continue
+            if text[i] in SEPARATORS:
+                stack.append((i + 1, node))
+                continue
+            for end, py in self.trie.match(text, i):
+                child = node.full.get(py)
+                if child is not None: stack.append((end, child))
+            for size in (1, 2):
+                for child in node.abbr.get(text[i:i + size], ()) if i + size <= n else ():
+                    stack.append((i + size, child))
+        return reached, reach
+
+    def lookup(self, text, top_k=5):
+        """
+        返回前 top_k 个 [(得分, 词)]：整词命中 > 部分缩写补全 > 多词拼接，各自按得分排序
+        拼接的搜索宽度固定为 ABBR_BEAM，lookup(text, k) 总是 lookup(text, K) (K > k) 的前 k 项
+        """
+        return AbbrLookup(self).update(text).results(top_k)
+
+
+class AbbrLookup:
+    """
+    可续接的缩写查询 (由 DecodeSession 持有)：拼接从左往右做，heads[j] 是覆盖 text[:j] 的前 ABBR_BEAM 种组合，
+    只依赖 text[:j]。输入只在末尾变化时保留公共前缀上的结果，只重走读到过变化部分的起点，逐键输入不再每次从头算
+    """
+    def __init__(self, index):
+        self.index = index
+        self.reset()
+
+    def reset(self):
+        self.version = self.index.store.user_version
+        self.text = ""
+        self.heads = [[(0.0, "")]]
+        self.reach = []    # reach[i]: 从 i 出发的遍历读到的最远位置，None 为读到了末尾
+        self.first = []    # 从 0 出发走到的 (终点, 节点)，整词与部分缩写从这里取
+
+    def update(self, text):
+        text = text.lower()
+        # 拼接分数用到转移分数，用户词库学到新搭配后重算
+        if self.index.store.user_version != self.version: self.reset()
+        old, n = self.text, len(text)
+        common = 0
+        limit = min(len(old), n)
+        while common < limit and old[common] == text[common]:
+            common += 1
+
+        del self.heads[common + 1:]
+        self.heads.extend([] for _ in range(n - common))
+        redo = [i for i, r in enumerate(self.reach[:common]) if r is None or r > common]
+        del self.reach[common:]
+        self.reach.extend(range(common, n))
+        self.text = text
+        # 先重走受影响的旧起点 (只补 common 之后的终点)，再依次处理新位置；处理到 j 时 heads[j] 已收齐
+        for i in redo:
+            self._expand(i, common)
+        for i in range(common, n):
+            if i > 0: self.heads[i] = self._prune(self.heads[i])
+            self._expand(i, i)
+        if n > common: self.heads[n] = self._prune(self.heads[n])
+        return self
+
+    def _expand(self, i, lo):
+        """ 把 heads[i] 接上从 i 出发的词，加到终点大于 lo 的 heads 里 """
+        prefixes = self.heads[i]
+        if not prefixes: return
+        index = self.index
+        reached, self.reach[i] = index._walk(self.text, i)
+        if i == 0: self.first = reached
+        store = index.store
+        ids, start_score, score = store.char_ids, store.start_score, store.score
+        beam = ABBR_BEAM
+        # 按终点归并：声母会同时走到很多音节节点，先各取前几个词再合并，避免组合数成倍增长
+        by_end = {}
+        for end, node in reached:
+            if end > lo and node.words: by_end.setdefault(end, []).extend(node.words[:beam])
+        for end, words in by_end.items():
+            out = self.heads[end]
+            for s, word in heapq.nlargest(beam, words, key=lambda x: x[0]):
+                first = ids[word[0]]
+                for ps, prefix in prefixes:
+                    if not prefix:
+                        out.append((s, word))
+                    else:
+                        out.append((ps + s - start_score(first) + score(ids[prefix[-1]], first), prefix + word))
+
+    @staticmethod
+    def _prune(combos):
+        combos.sort(key=lambda x: -x[0])
+        kept, texts = [], set()
+        for item in combos:
+            if item[1] in texts: continue
+            texts.add(item[1])
+            kept.append(item)
+            if len(kept) >= ABBR_BEAM: break
+        return kept
+
+    def results(self, top_k=5):
+        n = len(self.text)
+        if not n: return []
+        exact, partial = [], []
+        for end, node in self.first:
+            if end == n:
+                exact.extend(node.words)
+                partial.extend(node.best)
+        results, seen = [], set()
+        for group in (exact, partial, self.heads[n]):
+            for item in sorted(group, key=lambda x: -x[0]):
+                if item[1] in seen: continue
+                seen.add(item[1])
+                results.append(item)
+                if len(results) >= top_k: return results
+        return results
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import contextlib
+from collections import deque
+from multiprocessing import Pool
+
+from main import HMM_Model
+from fuzzy import ALL_RULES
+from pruning import PROFILES, DEFAULT_PROFILE
+
+# 批量转换：拼音文件 (每行一句) -> 汉字文件
+# 按块分发给进程池，同时在途的块数有上限，多 GB 的输入也只占常量内存；结果按输入顺序写出。
+# 各进程从同一个 model.cache 映射加载模型，数组段在进程间共享只读页。
+
+CHUNK_LINES = 512
+
+_model = None
+_search = "beam"
+
+
+def _init_worker(data_dir, search, fuzzy=(), pruning=DEFAULT_PROFILE):
+    global _model, _search
+    _model = HMM_Model(cache_capacity=0, kb_dir=None)
+    # 加载日志走 stderr，不混进标准输出的转换结果
+    with contextlib.redirect_stdout(sys.stderr):
+        _model.load_from_dir(data_dir)
+    if fuzzy: _model.set_fuzzy(fuzzy)
+    _model.set_pruning(pruning)
+    _search = search
+
+
+def _convert_chunk(lines):
+    out = []
+    for line in lines:
+        line = line.strip()
+        res = _model.get_top_candidates(line, top_k=1, search=_search) if line else []
+        out.append(res[0] if res else "")
+    return out
+
+
+def _chunks(stream, size):
+    while True:
+        chunk = list(itertools.islice(stream, size))
+        if not chunk: return
+        yield chunk
+
+
+def convert_stream(lines, data_dir, workers=None, search="beam", chunk_lines=CHUNK_LINES, fuzzy=(),
+                   pruning=DEFAULT_PROFILE):
+    """ 按输入顺序逐行产出转换结果 """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(data_dir, search, fuzzy, pruning)
+        for chunk in _chunks(lines, chunk_lines):
+            yield from _convert_chunk(chunk)
+        return
+
+    with Pool(workers, initializer=_init_worker, initargs=(data_dir, search, fuzzy, pruning)) as pool:
+        inflight = deque()
+        for chunk in _chunks(lines, chunk_lines):
+            inflight.append(pool.apply_async(_convert_chunk, (chunk,)))
+            if len(inflight) >= workers * 4:
+                yield from inflight.popleft().get()
+        while inflight:
+            yield from inflight.popleft().get()
+
+
+def main(argv=None):
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    parser = argparse.ArgumentParser(description="拼音 -> 汉字 批量转换")
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，每行一句拼音 (- 表示标准输入)")
+    parser.add_argument("output", nargs="?", default="-", help="输出文件 (- 表示标准输出)")
+    parser.add_argument("-r", "--reference", help="标准答案文件，给出句准确率与字准确率")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    parser.add_argument("-d", "--data", default=default_data, help="语料目录")
+    parser.add_argument("--search", choices=["beam", "exact"], default="beam")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--fuzzy", nargs="?", const="all", default="",
+                        help="启用模糊音，可指定规则如 z/zh,n/l (不带值表示全部)")
+    parser.add_argument("--pruning", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="Beam Search 剪枝档位 (默认 %(default)s)")
+    args = parser.parse_args(argv)
+    fuzzy = ALL_RULES if args.fuzzy == "all" else tuple(r for r in args.fuzzy.split(",") if r)
+    unknown = set(fuzzy) - set(ALL_RULES)
+    if unknown: parser.error(f"未知的模糊音规则: {','.join(sorted(unknown))}")
+
+    # 先在主进程里确保缓存是新的，避免各子进程同时重建
+    with contextlib.redirect_stdout(sys.stderr):
+        HMM_Model(cache_capacity=0, kb_dir=None).load_from_dir(args.data)
+
+    fin = sys.stdin if args.input == "-" else open(args.input, 'r', encoding=args.encoding)
+    fout = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    fref = open(args.reference, 'r', encoding=args.encoding) if args.reference else None
+
+    total = sent_ok = char_ok = char_total = 0
+    t0 = time.perf_counter()
+    try:
+        for result in convert_stream(fin, args.data, args.jobs, args.search, fuzzy=fuzzy, pruning=args.pruning):
+            fout.write(result + "\n")
+            total += 1
+            if fref is not None:
+                ref = fref.readline().strip()
+                sent_ok += result == ref
+                char_ok += sum(a == b for a, b in zip(result, ref))
+                char_total += len(ref)
+    finally:
+        for f in (fin, fout, fref):
+            if f is not None and f not in (sys.stdin, sys.stdout): f.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"共 {total} 行, 用时 {elapsed:.2f}s, {total / elapsed if elapsed else 0:.1f} 行/秒", file=sys.stderr)
+    if fref is not None and total:
+        print(f"句准确率: {sent_ok / total:.2%} | 字准确率: {char_ok / max(char_total, 1):.2%}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from bigram_store import BACKOFF_PENALTY
+from pruning import cap_emissions
+
+# NumPy 批量 Beam Search
+# 每一步把 (beam × 候选字) 的得分矩阵一次算完，转移分数从 CSR 表整体查出；
+# 路径用回溯指针记录，最后才拼接成字符串。
+# start_state/step/merge/results 拆开暴露，供增量解码会话在音节 DAG 上推进。
+# 排序规则与 heapq.nlargest(key=score) 完全一致：分数降序，同分时先生成者优先。
+# 剪枝档位 (pruning.py) 在构造时生效：截断后的发射表预先切好，阈值剪枝在每次取 top-k 后做。
+
+
+def _stable_topk(scores, k):
+    """ 返回前 k 大的下标，分数降序、同分按下标升序 (等价于稳定排序) """
+    n = scores.shape[0]
+    if n <= k:
+        idx = np.arange(n)
+    else:
+        part = np.argpartition(-scores, k - 1)[:k]
+        kth = scores[part].min()
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - above.shape[0]]
+        idx = np.concatenate((above, ties))
+    order = np.lexsort((idx, -scores[idx]))
+    return idx[order]
+
+
+class _Merge:
+    """ 合并节点：新 beam 的第 b 项来自 sources[src[b]] 的第 local[b] 项 """
+    __slots__ = ("src", "local", "sources")
+
+    def __init__(self, src, local, sources):
+        self.src = src
+        self.local = local
+        self.sources = sources
+
+
+class _Prefix:
+    """ 回溯链的起点：第 b 项开头的字 ID 直接给出 (流式解码提交前缀后重建) """
+    __slots__ = ("paths",)
+
+    def __init__(self, paths):
+        self.paths = paths
+
+
+class NumpyBeamDecoder:
+    def __init__(self, store, fuzzy=None, ngram=None, pruning=None):
+        self.store = store
+        self.fuzzy = fuzzy
+        self.ngram = ngram
+        self.pruning = pruning
+        self.threshold = pruning.threshold if pruning is not None else None
+        self.min_keep = pruning.min_keep if pruning is not None else 0
+        n = len(store)
+        self.start = np.frombuffer(store.start, dtype=np.float64)
+        offsets = np.frombuffer(store.offsets, dtype=np.int32)
+        succ = np.frombuffer(store.succ, dtype=np.int32).astype(np.int64)
+        # CSR 各行按前驱、行内按后继升序排列，所以 prev*n+succ 整体有序，可一次 searchsorted
+        prev = np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets))
+        # 末尾放一个哨兵，searchsorted 的结果因此总是有效下标
+        self.keys = np.append(prev * n + succ, np.iinfo(np.int64).max)
+        self.logp = np.append(np.frombuffer(store.logp, dtype=np.float32).astype(np.float64), 0.0)
+        self.backoff = self.start - BACKOFF_PENALTY
+        emit_ids = fuzzy.emit_ids if fuzzy is not None else store.emit_ids
+        self.emit_ids = {py: np.frombuffer(ids, dtype=np.int32).astype(np.int64) for py, ids in emit_ids.items()}
+        # 模糊音写法的逐候选扣分
+        self.emit_pen = {py: np.array(pen) for py, pen in fuzzy.emit_pen.items()} if fuzzy is not None else {}
+        # Beam 展开与精确 k-best (kbest.py) 用的发射表，按剪枝档位截断；emit_ids 保持完整
+        self.beam_ids, self.beam_pen = self.emit_ids, self.emit_pen
+        if pruning is not None and pruning.emit_top:
+            src = fuzzy if fuzzy is not None else store
+            self.beam_ids, self.beam_pen = dict(self.emit_ids), dict(self.emit_pen)
+            for py, keep in cap_emissions(src.emit_ids, src.emit_order, pruning.emit_top).items():
+                sel = np.array(keep, dtype=np.int64)
+                self.beam_ids[py] = self.emit_ids[py][sel]
+                if py in self.emit_pen: self.beam_pen[py] = self.emit_pen[py][sel]
+        self._user_version = None
+        self._user_src = None
+        self._user_lock = threading.Lock()
+        if ngram is not None: self._init_ngram(ngram)
+
+    def _init_ngram(self, ngram):
+        """ 三元表同样展开成 上下文下标*n+后继 的整体有序键，码表在查询时再取 """
+        n = len(self.store)
+        sentinel = np.iinfo(np.int64).max
+        offsets = np.frombuffer(ngram.offsets, dtype=np.int32)
+        ctx = np.repeat(np.arange(offsets.shape[0] - 1, dtype=np.int64), np.diff(offsets))
+        self.ctx_keys = np.append(np.frombuffer(ngram.ctx_keys, dtype=np.int64), sentinel)
+        bow_book = np.frombuffer(ngram.bow_book, dtype=np.float32).astype(np.float64)
+        self.ctx_bow = bow_book[np.frombuffer(ngram.ctx_bow, dtype=np.uint8)]
+        self.tri_keys = np.append(ctx * n + np.frombuffer(ngram.succ, dtype=np.int32), sentinel)
+        self.tri_codes = np.append(np.frombuffer(ngram.codes, dtype=np.uint8), np.uint8(0))
+        self.codebook = np.frombuffer(ngram.codebook, dtype=np.float32).astype(np.float64)
+
+    def _tables(self):
+        """
+        返回 (keys, logp, start)；有用户词库时是叠加后的副本
+        叠加层并入同一张有序表，每步仍只做一次 searchsorted；叠加层变化 (用户选词) 后重建一次
+        """
+        store = self.store
+        if not store.user_trans and not store.user_start: return self.keys, self.logp, self.start
+        if self._user_version != store.user_version:
+            with self._user_lock:
+                self._refresh_user(store)
+        return self._user_keys, self._user_logp, self._user_start
+
+    def _refresh_user(self, store):
+        """ 按叠加层的变化重建副本；模型服务的多个解码线程可能同时来到这里，由调用方加锁 """
+        if self._user_version != store.user_version:
+            version = store.user_version
+            if self._user_src is not store.user_trans:
+                # 重新 bind 过：整体重建。先取快照，GUI 线程可能在解码线程读取时继续学习
+                self._user_src = store.user_trans
+                self._user_pos = len(store.user_log)
+                self._user_keys, self._user_logp = self._merge(self.keys, self.logp.copy(), list(store.user_trans.items()))
+                start = self.start.copy()
+                for cid, score in list(store.user_start.items()):
+                    start[cid] = score
+                self._user_start = start
+            else:
+                # 学习只改动少数几项，按变更记录增量合并
+                changes = store.user_log[self._user_pos:]
+                self._user_pos += len(changes)
+                trans = {k: store.user_trans[k] for kind, k in changes if kind == 't'}
+                for kind, k in changes:
+                    if kind == 's': self._user_start[k] = store.user_start[k]
+                self._user_keys, self._user_logp = self._merge(self._user_keys, self._user_logp, list(trans.items()))
+            self._user_version = version
+
+    @staticmethod
+    def _merge(keys, logp, items):
+        """ 把 [(键, 分数)] 并入有序表：已有的键原地改写 logp，新键一次性插入 """
+        if not items: return keys, logp
+        ukeys = np.fromiter((k for k, v in items), dtype=np.int64, count=len(items))
+        uvals = np.fromiter((v for k, v in items), dtype=np.float64, count=len(items))
+        order = np.argsort(ukeys)
+        ukeys, uvals = ukeys[order], uvals[order]
+        # 表末尾有哨兵，pos 总是有效下标，新键也总是插在哨兵之前
+        pos = np.searchsorted(keys, ukeys)
+        exists = keys[pos] == ukeys
+        logp[pos[exists]] = uvals[exists]
+        new = ~exists
+        if new.any():
+            keys = np.insert(keys, pos[new], ukeys[new])
+            logp = np.insert(logp, pos[new], uvals[new])
+        return keys, logp
+
+    def trans_block(self, prev_ids, curr_ids):
+        """ 取出 len(prev) × len(curr) 的转移分数块 (缺失项回退) """
+        n = len(self.store)
+        keys, logp, _ = self._tables()
+        query = prev_ids[:, None] * n + curr_ids[None, :]
+        pos = np.searchsorted(keys, query)
+        hit = keys[pos] == query
+        return np.where(hit, logp[pos], self.backoff[curr_ids][None, :])
+
+    def trigram_block(self, prev2_ids, prev_ids, curr_ids):
+        """ 在二元分数块上按 (前两字) 上下文修正：见过的三元组取其分数，其余加上下文的回退权重 """
+        block = self.trans_block(prev_ids, curr_ids)
+        n = len(self.store)
+        # 句首第二个字的 prev2 为 -1，键为负数，不会命中
+        ctx = prev2_ids * n + prev_ids
+        ci = np.searchsorted(self.ctx_keys, ctx)
+        rows = np.flatnonzero(self.ctx_keys[ci] == ctx)
+        if not rows.shape[0]: return block
+        ci = ci[rows]
+        query = ci[:, None] * n + curr_ids[None, :]
+        pos = np.searchsorted(self.tri_keys, query)
+        hit = self.tri_keys[pos] == query
+        block[rows] = np.where(hit, self.codebook[self.tri_codes[pos]], block[rows] + self.ctx_bow[ci][:, None])
+        return block
+
+    def _cut(self, scores, sel):
+        """ 阈值剪枝：sel 已按得分降序，去掉比最优低 threshold 以上的项 (至少保留 min_keep 项) """
+        if self.threshold is None or sel.shape[0] <= self.min_keep: return sel
+        top = scores[sel]
+        return sel[:max(self.min_keep, np.count_nonzero(top >= top[0] - self.threshold))]
+
+    # 解码状态: (scores, last_ids, node, prev_ids)，node 是回溯链 (back, ids, parent)
+    # prev_ids 是各路径的倒数第二个字 (句首为 -1)，供三元模型使用
+    # 状态不可变，可被增量会话缓存并在退格时直接复用
+    def start_state(self, py, beam_width=30):
+        first = self.beam_ids.get(py)
+        if first is None or not first.shape[0]: return None
+        scores = self._tables()[2][first]
+        pen = self.beam_pen.get(py)
+        if pen is not None: scores = scores - pen
+        sel = self._cut(scores, _stable_topk(scores, beam_width))
+        ids = first[sel]
+        return (scores[sel], ids, (None, ids, None), np.full(ids.shape[0], -1, dtype=np.int64))
+
+    def step(self, state, py, beam_width=30):
+        cand = self.beam_ids.get(py)
+        if state is None or cand is None or not cand.shape[0]: return state
+        scores, last_ids, node, prev_ids = state
+        if self.ngram is not None:
+            block = self.trigram_block(prev_ids, last_ids, cand)
+        else:
+            block = self.trans_block(last_ids, cand)
+        pen = self.beam_pen.get(py)
+        if pen is not None: block -= pen[None, :]
+        total = (scores[:, None] + block).ravel()
+        flat = self._cut(total, _stable_topk(total, beam_width))
+        back, col = np.divmod(flat, cand.shape[0])
+        ids = cand[col]
+        return (total[flat], ids, (back, ids, node), last_ids[back])
+
+    def merge(self, states, beam_width=30):
+        """ 合并到达同一位置的多个状态 (音节 DAG 中不同切分方式) """
+        states = [s for s in states if s is not None]
+        if not states: return None
+        if len(states) == 1: return states[0]
+        sizes = [s[0].shape[0] for s in states]
+        scores = np.concatenate([s[0] for s in states])
+        ids = np.concatenate([s[1] for s in states])
+        prev = np.concatenate([s[3] for s in states])
+        src = np.repeat(np.arange(len(states)), sizes)
+        local = np.concatenate([np.arange(n) for n in sizes])
+        sel = self._cut(scores, _stable_topk(scores, beam_width))
+        return (scores[sel], ids[sel], _Merge(src[sel], local[sel], [s[2] for s in states]), prev[sel])
+
+    def _id_paths(self, state, rows):
+        """ 回溯出第 rows 项的字 ID 序列 """
+        paths = []
+        for b in rows:
+            path = []
+            node = state[2]
+            while node is not None:
+                if isinstance(node, _Merge):
+                    k = node.src[b]
+                    b = node.local[b]
+                    node = node.sources[k]
+                    continue
+                if isinstance(node, _Prefix):
+                    path.extend(reversed(node.paths[b]))
+                    break
+                back, ids, node = node
+                path.append(ids[b])
+                if back is not None: b = back[b]
+            path.reverse()
+            paths.append(path)
+        return paths
+
+    def results(self, state, top_k=5):
+        if state is None: return []
+        chars = self.store.chars
+        return ["".join(chars[i] for i in path) for path in self._id_paths(state, range(min(top_k, state[0].shape[0])))]
+
+    # ---------- 流式解码 (stream.py) 用 ----------
+    def survivors(self, state):
+        """
+        仍可能成为最终最优路径的项：末两字相同的项以后的得分增量完全相同，只有其中得分最高的一项有机会
+        beam 已按得分降序 (同分先者在前)，每组取第一次出现的那项
+        """
+        if state is None: return []
+        _, rows = np.unique(np.stack((state[1], state[3])), axis=1, return_index=True)
+        chars = self.store.chars
+        return ["".join(chars[i] for i in path) for path in self._id_paths(state, np.sort(rows))]
+
+    def rebase(self, state, cut, keep=0):
+        """ 去掉各项路径开头的 cut 个字 (至少保留 keep 个)；回溯链换成 _Prefix 起点，之前的节点随之释放 """
+        if state is None: return None
+        paths = self._id_paths(state, range(state[0].shape[0]))
+        node = _Prefix([path[max(0, min(cut, len(path) - keep)):] for path in paths])
+        return (state[0], state[1], node, state[3])
+
+    def prune(self, state, prefix):
+        """ 只保留路径以 prefix 开头的项；没有剩下时返回 None """
+        if state is None: return None
+        ids = self.store.char_ids
+        target = [ids[c] for c in prefix]
+        n = len(target)
+        rows = [b for b, path in enumerate(self._id_paths(state, range(state[0].shape[0]))) if path[:n] == target]
+        if not rows: return None
+        sel = np.array(rows)
+        return (state[0][sel], state[1][sel], _Merge(np.zeros(len(rows), dtype=np.int64), sel, [state[2]]), state[3][sel])
+
+    def search(self, pinyin_list, top_k=5, beam_width=30):
+        if not pinyin_list: return []
+        state = self.start_state(pinyin_list[0], beam_width)
+        for py in pinyin_list[1:]:
+            state = self.step(state, py, beam_width)
+        return self.results(state, top_k)
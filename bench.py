@@ -0,0 +1,447 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import itertools
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from main import HMM_Model
+from knowledge import KnowledgeBase
+from session import DecodeSession
+from pruning import PROFILES
+import model_server
+
+# 基准测试：解码器、切分器与知识库查询 (无界面，可在 CI 中运行)
+#
+#   python bench.py -o result.json                       跑全部用例并保存结果
+#   python bench.py --baseline result.json --threshold 0.2   与旧结果比较，变慢超过 20% 时返回非零
+#   python bench.py --server -c 1,16,128 --depth 1,8         共享模型服务在多客户端并发下的 QPS
+#   python bench.py --pruning                                 只比较各剪枝档位的延迟与 top-1 一致率
+#
+# 语料由 data/ 下的文件和固定随机种子生成，同一份数据每次得到相同的输入。
+
+SEED = 20240101
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+IDIOM_ABBRS = ["szdt", "yyds", "hhhh", "wzdl", "ymsk", "bkss", "zgr", "xcsj", "ysyd", "yzwq"]
+PRUNING_CORPORA = ("short_words", "sentence_10", "sentence_30", "sentence_60", "ambiguous")
+AMBIGUOUS = ["xian", "fangan", "pingan", "jiangan", "tianan", "shangai", "xinan", "yanan",
+             "kaiguan", "danganshi", "yuanyuan", "jianangu", "changan", "mingan", "fanganlianxi"]
+
+
+def _quiet():
+    """ 屏蔽加载日志，只输出测试结果 """
+    return contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+
+def peak_rss_mb():
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 为 KB，macOS 为字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _readings(data_dir, pinyin_set):
+    """ CharFreq.txt 第 5 列给出每个字的常用读音 """
+    read = {}
+    with open(os.path.join(data_dir, "CharFreq.txt"), 'r', encoding='gb18030') as f:
+        for line in f:
+            if line.startswith('/*'): continue
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 5 or not parts[4]: continue
+            py = re.sub(r'\d', '', parts[4].split('/')[0]).lower().replace('u:', 'v')
+            if py in pinyin_set: read[parts[1]] = py
+    return read
+
+
+def _frequent_words(data_dir, read, limit=3000):
+    words = []
+    with open(os.path.join(data_dir, "Bigram.txt"), 'r', encoding='gb18030') as f:
+        for line in f:
+            if line.startswith('/*'): continue
+            parts = line.split('\t')
+            if len(parts) >= 3 and len(parts[1]) == 2 and all(c in read for c in parts[1]):
+                words.append(parts[1])
+                if len(words) >= limit: break
+    return words
+
+
+def build_corpora(model, data_dir=DATA_DIR):
+    """ 返回 {名称: [拼音输入]} """
+    rnd = random.Random(SEED)
+    read = _readings(data_dir, model.pinyin_set)
+    words = _frequent_words(data_dir, read)
+
+    def sentence(syllables):
+        chars = ""
+        while len(chars) < syllables:
+            chars += rnd.choice(words)
+        return "".join(read[c] for c in chars[:syllables])
+
+    return {
+        "short_words": ["".join(read[c] for c in w) for w in rnd.sample(words, 200)],
+        "idiom_abbr": IDIOM_ABBRS * 10,
+        "sentence_10": [sentence(10) for _ in range(60)],
+        "sentence_30": [sentence(30) for _ in range(30)],
+        "sentence_60": [sentence(60) for _ in range(15)],
+        "ambiguous": AMBIGUOUS * 4,
+    }
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def measure(fn, inputs, repeat=1):
+    """ 逐个输入计时，返回毫秒级分位数与吞吐 """
+    lat = []
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for x in inputs:
+            t = time.perf_counter()
+            fn(x)
+            lat.append(time.perf_counter() - t)
+    total = time.perf_counter() - t0
+    lat.sort()
+    return {
+        "n": len(lat),
+        "p50_ms": _percentile(lat, 50) * 1000,
+        "p95_ms": _percentile(lat, 95) * 1000,
+        "p99_ms": _percentile(lat, 99) * 1000,
+        "throughput_per_s": len(lat) / total if total else 0.0,
+    }
+
+
+def bench_load(data_dir=DATA_DIR):
+    res = {}
+    with _quiet():
+        m = HMM_Model(cache_capacity=0, kb_dir=None)
+        t = time.perf_counter()
+        m.load_data(*(os.path.join(data_dir, f) for f in ("pinyin.txt", "CharFreq.txt", "Bigram.txt", "Trigram.txt")))
+        res["hmm_parse_s"] = time.perf_counter() - t
+
+        kb = KnowledgeBase()
+        t = time.perf_counter()
+        kb.load_data(data_dir)
+        res["kb_parse_s"] = time.perf_counter() - t
+
+        # 候选缓存会掩盖重复输入的真实开销，基准测试中关闭
+        m = HMM_Model(cache_capacity=0, kb_dir=None)
+        m.load_from_dir(data_dir)  # 确保缓存是新的
+        m = HMM_Model(cache_capacity=0, kb_dir=None)
+        t = time.perf_counter()
+        m.load_from_dir(data_dir)
+        res["cached_load_s"] = time.perf_counter() - t
+        # 从新建模型到拿到第一批候选 (释义此时尚未解析)，再到第一次查到释义
+        first = HMM_Model(cache_capacity=0, kb_dir=None)
+        t = time.perf_counter()
+        first.load_from_dir(data_dir)
+        first.get_top_candidates("nihao")
+        res["first_candidate_s"] = time.perf_counter() - t
+        first.kb.get_definition("你好")
+        res["first_definition_s"] = time.perf_counter() - t
+        # 非音节输入会查缩写：界面的候选流不等缩写索引，批量接口等它建好
+        first = HMM_Model(cache_capacity=0, kb_dir=None)
+        t = time.perf_counter()
+        first.load_from_dir(data_dir)
+        list(itertools.islice(first.iter_candidates("z"), 6))
+        res["first_candidate_abbr_s"] = time.perf_counter() - t
+        first.get_top_candidates("z")
+        res["first_abbr_index_s"] = time.perf_counter() - t
+    return res, m
+
+
+def bench_pruning(model, corpora, cases, repeat=1):
+    """
+    各剪枝档位的 Beam 解码延迟 (写入 cases) 与 top-1 一致率：最优候选与精确 k-best 第一名相同的比例
+    只测 HMM 解码本身，不含用户词库与知识库的查表结果
+    """
+    saved = model.pruning
+    agreement = {}
+    try:
+        # 精确 k-best 也受档位影响，参照结果在 exact 档位下计算
+        model.set_pruning("exact")
+        reference = {name: [tuple(itertools.islice(model.iter_exact(x), 1)) for x in corpora[name]]
+                     for name in PRUNING_CORPORA}
+        for profile in PROFILES:
+            model.set_pruning(profile)
+            decode = lambda x: model._hmm_candidates(x, 5)
+            agreement[profile] = {}
+            for name in PRUNING_CORPORA:
+                cases[f"prune_{profile}/{name}"] = measure(decode, corpora[name], repeat)
+                same = sum(decode(x)[:1] == ref for x, ref in zip(corpora[name], reference[name]))
+                agreement[profile][name] = same / len(corpora[name])
+    finally:
+        model.set_pruning(saved)
+    return agreement
+
+
+def run_pruning(data_dir=DATA_DIR, repeat=1):
+    with _quiet():
+        model = HMM_Model(cache_capacity=0, kb_dir=None)
+        model.load_from_dir(data_dir)
+    corpora = build_corpora(model, data_dir)
+    cases = {}
+    agreement = bench_pruning(model, corpora, cases, repeat)
+    meta = {"python": platform.python_version(), "seed": SEED, "pruning": agreement,
+            "profiles": {name: repr(p) for name, p in PROFILES.items()}}
+    return {"meta": meta, "cases": cases, "peak_rss_mb": peak_rss_mb()}
+
+
+def run(data_dir=DATA_DIR, repeat=1):
+    results = {"meta": {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": SEED,
+    }}
+    load, model = bench_load(data_dir)
+    results["load"] = load
+    corpora = build_corpora(model, data_dir)
+    results["meta"]["corpora"] = {k: len(v) for k, v in corpora.items()}
+
+    cases = {}
+    sentences = corpora["sentence_10"] + corpora["sentence_30"] + corpora["sentence_60"]
+    cases["segment/greedy"] = measure(model.split_pinyin, sentences, repeat)
+    cases["segment/trie_dag"] = measure(model.trie.build_dag, sentences, repeat)
+
+    for search in ("beam", "exact"):
+        for name, inputs in corpora.items():
+            fn = lambda x, s=search: model.get_top_candidates(x, top_k=5, search=s)
+            cases[f"decode_{search}/{name}"] = measure(fn, inputs, repeat)
+
+    results["meta"]["pruning"] = bench_pruning(model, corpora, cases, repeat)
+
+    # 有三元模型时，同样的输入再用纯二元模型跑一遍作对照
+    if model.ngram is not None:
+        results["meta"]["ngram"] = {"entries": len(model.ngram), "bytes": model.ngram.nbytes()}
+        model.set_ngram(False)
+        for name in ("sentence_10", "sentence_30", "sentence_60"):
+            fn = lambda x: model.get_top_candidates(x, top_k=5)
+            cases[f"decode_beam_bigram/{name}"] = measure(fn, corpora[name], repeat)
+        model.set_ngram(True)
+
+    # 逐键输入：同一会话里依次输入每个前缀
+    def typing(text):
+        session = DecodeSession(model)
+        for i in range(1, len(text) + 1):
+            model.get_top_candidates(text[:i], top_k=5, session=session)
+    cases["typing_session/sentence_10"] = measure(typing, corpora["sentence_10"][:20], repeat)
+
+    kb = model.kb
+    keys = list(corpora["short_words"]) + corpora["idiom_abbr"]
+    cases["kb/idiom"] = measure(kb.get_idiom, keys, repeat)
+    cases["kb/emoji"] = measure(kb.get_emoji, keys, repeat)
+    index = model.get_abbr_index()
+    cases["kb/abbr_index"] = measure(index.lookup, corpora["idiom_abbr"], repeat)
+    riddles = list(kb.xiehouyu_dict)[:500]
+    cases["kb/xiehouyu"] = measure(kb.get_xiehouyu, riddles, repeat)
+    cases["kb/definition"] = measure(kb.get_definition, riddles, repeat)
+
+    # 歇后语增量匹配：谜面切成 1~4 字的片段、夹在其他文字中间逐段上屏
+    t = time.perf_counter()
+    automaton = kb.riddle_automaton()
+    results["meta"]["kb_bytes"] = kb.nbytes()
+    results["meta"]["riddles"] = {"riddles": len(automaton), "states": len(automaton.fail),
+                                  "bytes": automaton.nbytes(), "build_ms": (time.perf_counter() - t) * 1000}
+    rnd = random.Random(SEED)
+    pieces = []
+    for riddle in riddles:
+        text = riddle + "".join(rnd.choice(riddle) for _ in range(rnd.randint(0, 6)))
+        i = 0
+        while i < len(text):
+            n = rnd.randint(1, 4)
+            pieces.append(text[i:i + n])
+            i += n
+    scanner = kb.riddle_scanner()
+    cases["kb/riddle_feed"] = measure(scanner.feed, pieces, repeat)
+
+    results["cases"] = cases
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def _server_requests(model, data_dir):
+    """ 模拟 GUI 的请求：每次按键查候选首屏、用户词库、成语、Emoji，上屏后查联想与释义 """
+    corpora = build_corpora(model, data_dir)
+    riddles = list(model.kb.xiehouyu_dict)[:200]
+    requests = []
+    for i, text in enumerate(corpora["short_words"] + corpora["sentence_10"]):
+        requests += [["cand", text, 6], ["lookup", text], ["idiom", text], ["emoji", text]]
+        requests += [["assoc", riddles[i % len(riddles)][-2:], 20], ["def", riddles[i % len(riddles)]]]
+    return [model_server.encode(r) for r in requests]
+
+
+async def _load_client(address, requests, offset, depth, deadline, lat):
+    """ 一个客户端：每次连续发出 depth 个请求 (流水线)，读回全部响应后再发下一批 """
+    family, addr = model_server.parse_address(address)
+    if family == model_server.socket.AF_UNIX:
+        reader, writer = await asyncio.open_unix_connection(addr)
+    else:
+        reader, writer = await asyncio.open_connection(*addr)
+    i = offset
+    while time.perf_counter() < deadline:
+        batch = [requests[(i + k) % len(requests)] for k in range(depth)]
+        i += depth
+        t = time.perf_counter()
+        writer.write(b"".join(batch))
+        for _ in batch:
+            if not await reader.readline(): raise ConnectionError("模型服务已断开")
+            lat.append(time.perf_counter() - t)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _load(address, requests, clients, depth, duration):
+    lat = []
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+    step = max(1, len(requests) // clients)
+    await asyncio.gather(*(_load_client(address, requests, c * step, depth, deadline, lat) for c in range(clients)))
+    return lat, time.perf_counter() - t0
+
+
+def _wait_server(address, proc, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None: raise RuntimeError("模型服务启动失败")
+        try:
+            model_server.ModelClient(address).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("等待模型服务启动超时")
+
+
+def bench_server(data_dir=DATA_DIR, clients=(1, 16, 128), depths=(1, 8), duration=3.0):
+    """
+    在子进程中启动共享模型服务，测量不同并发客户端数与流水线深度下的 QPS 与延迟
+    另测同一批请求在进程内直接处理 (不经套接字) 的吞吐，作为上限参照
+    """
+    with _quiet():
+        model = HMM_Model(kb_dir=None)
+        model.load_from_dir(data_dir)
+    requests = _server_requests(model, data_dir)
+
+    server = model_server.ModelServer(model)
+    conn = model_server._Connection(server)
+    lines = [line.rstrip(b"\n") for line in requests]
+    for line in lines: server.handle(conn, line)  # 与服务端一样先预热
+    t = time.perf_counter()
+    for line in lines: server.handle(conn, line)
+    results = {"meta": {"requests": len(requests), "duration_s": duration,
+                        "in_process_qps": len(requests) / (time.perf_counter() - t)}, "cases": {}}
+
+    tmp = tempfile.mkdtemp()
+    address = os.path.join(tmp, "bench.sock") if hasattr(model_server.socket, "AF_UNIX") else "127.0.0.1:47399"
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py")
+    proc = subprocess.Popen([sys.executable, script, "-a", address, "-d", data_dir,
+                             "--user-dict", os.path.join(tmp, "user_dict.txt")], stdout=subprocess.DEVNULL)
+    try:
+        _wait_server(address, proc)
+        # 先跑一遍，让服务端的候选缓存与逐键会话进入稳定状态
+        asyncio.run(_load(address, requests, 1, 16, 1.0))
+        for n in clients:
+            for depth in depths:
+                lat, elapsed = asyncio.run(_load(address, requests, n, depth, duration))
+                lat.sort()
+                results["cases"][f"server/c{n}_d{depth}"] = {
+                    "n": len(lat),
+                    "p50_ms": _percentile(lat, 50) * 1000,
+                    "p95_ms": _percentile(lat, 95) * 1000,
+                    "p99_ms": _percentile(lat, 99) * 1000,
+                    "throughput_per_s": len(lat) / elapsed,
+                }
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def compare(current, baseline, threshold=0.2, metric="p95_ms", min_delta_ms=0.05):
+    """
+    返回变慢超过阈值的用例 [(名称, 旧值, 新值)]
+    绝对差小于 min_delta_ms 的不计，微秒级用例的计时抖动不算回退
+    """
+    regressions = []
+    for name, stats in current["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old or old.get(metric, 0) <= 0: continue
+        if stats[metric] > old[metric] * (1 + threshold) and stats[metric] - old[metric] >= min_delta_ms:
+            regressions.append((name, old[metric], stats[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="输入法基准测试")
+    parser.add_argument("-o", "--output", help="把结果写入 JSON 文件")
+    parser.add_argument("-d", "--data", default=DATA_DIR)
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数")
+    parser.add_argument("--baseline", help="作为比较基准的旧结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的变慢比例 (默认 0.2)")
+    parser.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms"])
+    parser.add_argument("--min-delta", type=float, default=0.05, help="忽略小于该值的绝对差 (毫秒)")
+    parser.add_argument("--server", action="store_true", help="改为测量共享模型服务的 QPS")
+    parser.add_argument("-c", "--clients", default="1,16,128", help="并发客户端数，逗号分隔")
+    parser.add_argument("--depth", default="1,8", help="每个客户端的流水线深度，逗号分隔")
+    parser.add_argument("--duration", type=float, default=3.0, help="每组测量的秒数")
+    parser.add_argument("--pruning", action="store_true", help="只比较各剪枝档位")
+    args = parser.parse_args(argv)
+
+    if args.server:
+        results = bench_server(args.data, [int(x) for x in args.clients.split(",")],
+                               [int(x) for x in args.depth.split(",")], args.duration)
+        print(f"进程内直接处理: {results['meta']['in_process_qps']:.0f} 次/秒")
+    elif args.pruning:
+        results = run_pruning(args.data, args.repeat)
+    else:
+        results = run(args.data, args.repeat)
+        print(f"加载: 解析 HMM {results['load']['hmm_parse_s'] * 1000:.1f} ms | "
+              f"解析知识库 {results['load']['kb_parse_s'] * 1000:.1f} ms | "
+              f"缓存加载 {results['load']['cached_load_s'] * 1000:.1f} ms | "
+              f"首批候选 {results['load']['first_candidate_s'] * 1000:.1f} ms | "
+              f"首次释义 {results['load']['first_definition_s'] * 1000:.1f} ms | "
+              f"首批候选 (z) {results['load']['first_candidate_abbr_s'] * 1000:.1f} ms | "
+              f"缩写索引就绪 {results['load']['first_abbr_index_s'] * 1000:.1f} ms")
+    print(f"{'用例':<34}{'p50':>9}{'p95':>9}{'p99':>9}{'次/秒':>11}")
+    for name, s in results["cases"].items():
+        print(f"{name:<34}{s['p50_ms']:>9.3f}{s['p95_ms']:>9.3f}{s['p99_ms']:>9.3f}{s['throughput_per_s']:>11.0f}")
+    agreement = results["meta"].get("pruning")
+    if agreement:
+        print("top-1 与精确 k-best 一致率:")
+        for profile, rates in agreement.items():
+            print(f"  {profile:<10}" + "".join(f"{name} {rate:.1%}  " for name, rate in rates.items()))
+    if results.get("peak_rss_mb") is not None:
+        print(f"峰值内存: {results['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.metric, args.min_delta)
+        for name, old, new in regressions:
+            print(f"[回退] {name}: {args.metric} {old:.3f} -> {new:.3f} ms")
+        if regressions:
+            return 1
+        print("未发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+from array import array
+from bisect import bisect_left
+
+from pruning import rank_emissions
+
+# 转移概率的紧凑存储：汉字映射为连续整数 ID，二元表按 CSR (压缩稀疏行) 排列
+#   offsets[p] .. offsets[p+1]  是前驱 p 的行区间
+#   succ[...]                   行内按 ID 升序排列的后继字
+#   logp[...]                   对应的对数概率 (float32)
+#   assoc[...]                  同一行区间内的后继按概率降序重排，联想时直接取前 k 个
+BACKOFF_PENALTY = 8.0
+
+
+def rank_rows(offsets, succ, scores):
+    """ 把 CSR 每行的后继按分数降序 (同分保持原有的 ID 升序) 重排，返回与 succ 等长的数组 """
+    ranked = array('i')
+    for row in range(len(offsets) - 1):
+        lo, hi = offsets[row], offsets[row + 1]
+        ranked.extend(succ[i] for i in sorted(range(lo, hi), key=lambda i: -scores[i]))
+    return ranked
+
+
+class BigramStore:
+    def __init__(self, min_prob=-100.0):
+        self.min_prob = min_prob
+        self.chars = []          # ID -> 汉字
+        self.char_ids = {}       # 汉字 -> ID
+        self.start = array('d')  # ID -> 初始对数概率 (缺失为 min_prob)
+        self.offsets = array('i', [0])
+        self.succ = array('i')
+        self.logp = array('f')
+        self.assoc = array('i')
+        self.emit_ids = {}       # 拼音 -> 候选字 ID 数组 (保持 pinyin.txt 中的顺序)
+        self.emit_order = {}     # 拼音 -> emit_ids 的下标，按初始概率降序 (加载时排好)
+        # 用户词库叠加层 (user_dict.UserDict.bind 填充)，值已取 max(原分数, 用户分数)
+        self.user_trans = {}     # 前驱ID * 字数 + 后继ID -> 对数概率
+        self.user_start = {}     # ID -> 初始对数概率
+        self.user_version = 0    # 叠加层每次变化时递增，供解码器/会话判断缓存是否失效
+        self.user_log = []       # bind 之后的变更 [('t', 键) / ('s', ID)]，NumPy 解码器据此增量合并
+
+    def __len__(self):
+        return len(self.chars)
+
+    def intern(self, char):
+        cid = self.char_ids.get(char)
+        if cid is None:
+            cid = len(self.chars)
+            self.char_ids[char] = cid
+            self.chars.append(char)
+        return cid
+
+    @classmethod
+    def build(cls, emit_p, start_p, trans_p, min_prob=-100.0):
+        """ 由 load_data 解析出的字典构建 """
+        store = cls(min_prob)
+        for pinyin, chars in emit_p.items():
+            store.emit_ids[pinyin] = array('i', [store.intern(c) for c in chars])
+        for char in start_p:
+            store.intern(char)
+        for prev, row in trans_p.items():
+            store.intern(prev)
+            for curr in row:
+                store.intern(curr)
+
+        store.start = array('d', [start_p.get(c, min_prob) for c in store.chars])
+        for cid, char in enumerate(store.chars):
+            row = trans_p.get(char)
+            if row:
+                items = sorted((store.char_ids[c], p) for c, p in row.items())
+                store.succ.extend(i for i, _ in items)
+                store.logp.extend(p for _, p in items)
+            store.offsets.append(len(store.succ))
+        store.assoc = rank_rows(store.offsets, store.succ, store.logp)
+        store.emit_order = rank_emissions(store.emit_ids, store.start)
+        return store
+
+    def lookup(self, prev_id, curr_id):
+        """ 行内二分查找；不存在返回 None """
+        lo, hi = self.offsets[prev_id], self.offsets[prev_id + 1]
+        if lo == hi: return None
+        i = bisect_left(self.succ, curr_id, lo, hi)
+        if i < hi and self.succ[i] == curr_id:
+            return self.logp[i]
+        return None
+
+    def score(self, prev_id, curr_id):
+        """ 二元概率，缺失时回退到一元概率并施加惩罚 """
+        if self.user_trans:
+            p = self.user_trans.get(prev_id * len(self.chars) + curr_id)
+            if p is not None: return p
+        p = self.lookup(prev_id, curr_id)
+        if p is not None: return p
+        return self.start[curr_id] - BACKOFF_PENALTY
+
+    def words(self):
+        """ 二元表中出现过的全部双字词 """
+        chars = self.chars
+        for prev in range(len(chars)):
+            for k in range(self.offsets[prev], self.offsets[prev + 1]):
+                yield chars[prev] + chars[self.succ[k]]
+
+    def start_score(self, cid):
+        if self.user_start: return self.user_start.get(cid, self.start[cid])
+        return self.start[cid]
+
+    def associations(self, prev_id, top_k=5):
+        """ 概率最高的 top_k 个后继 ID (同分按 ID 升序) """
+        lo = self.offsets[prev_id]
+        return self.assoc[lo:min(lo + top_k, self.offsets[prev_id + 1])].tolist()
+
+    def successors(self, prev_id):
+        """ 返回 (后继ID, 对数概率) 列表 """
+        lo, hi = self.offsets[prev_id], self.offsets[prev_id + 1]
+        return list(zip(self.succ[lo:hi], self.logp[lo:hi]))
+
+    # 供模型缓存使用：小对象走 marshal，大数组按原始字节单独存放以便直接映射
+    ARRAY_FIELDS = (("start", 'd'), ("offsets", 'i'), ("succ", 'i'), ("logp", 'f'), ("assoc", 'i'))
+
+    def to_payload(self):
+        meta = {
+            "min_prob": self.min_prob,
+            "chars": "".join(self.chars),
+            "emit_ids": {py: ids.tobytes() for py, ids in self.emit_ids.items()},
+        }
+        arrays = {name: getattr(self, name) for name, _ in self.ARRAY_FIELDS}
+        return meta, arrays
+
+    @classmethod
+    def from_payload(cls, meta, buffers):
+        """
+        :param buffers: 名称 -> bytes 或 memoryview；memoryview 会被直接引用而不复制
+        """
+        store = cls(meta["min_prob"])
+        store.chars = list(meta["chars"])
+        store.char_ids = {c: i for i, c in enumerate(store.chars)}
+        for py, raw in meta["emit_ids"].items():
+            ids = array('i')
+            ids.frombytes(raw)
+            store.emit_ids[py] = ids
+        for name, code in cls.ARRAY_FIELDS:
+            raw = buffers[name]
+            if isinstance(raw, memoryview):
+                setattr(store, name, raw.cast(code))
+            else:
+                arr = array(code)
+                arr.frombytes(raw)
+                setattr(store, name, arr)
+        store.emit_order = rank_emissions(store.emit_ids, store.start)
+        return store
@@ -0,0 +1,93 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# 候选结果 LRU 缓存
+# 键带命名空间，例如 ('hmm', 音节元组, top_k, beam宽度, 用户词库版本)、('idiom', 缩写)、('emoji', 拼音)
+# 模型或词典变化时调用 clear() 使其失效；clear() 同时把代数加一，
+# 解码线程在 clear() 之前开始算的结果带着旧代数 put() 进来时直接丢弃，不会以新键身份留在缓存里
+_MISSING = object()
+
+
+def _sizeof(obj):
+    """ 粗略估算键/值占用的字节数 (容器本身 + 直接包含的元素) """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(_sizeof(x) for x in obj)
+    return size
+
+
+class CandidateCache:
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self._data = OrderedDict()   # key -> (value, 估算字节数)
+        self._lock = threading.Lock()  # GUI 主线程和解码线程都会访问
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.memory_bytes = 0
+        self.generation = 0   # clear() 的次数，计算前取一次，put() 时对不上就丢弃
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, generation=None):
+        """ generation 为开始计算前取的 self.generation；期间被 clear() 过则不缓存 """
+        if self.capacity <= 0: return
+        size = _sizeof(key) + _sizeof(value)
+        with self._lock:
+            if generation is not None and generation != self.generation: return
+            old = self._data.pop(key, None)
+            if old is not None: self.memory_bytes -= old[1]
+            self._data[key] = (value, size)
+            self.memory_bytes += size
+            while len(self._data) > self.capacity:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.memory_bytes -= old_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """ 未命中时调用 compute() 并缓存结果 (None 也会被缓存) """
+        generation = self.generation
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value, generation)
+        return value
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while len(self._data) > max(capacity, 0):
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.memory_bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        """ 模型或词典变化时调用；统计计数保留 """
+        with self._lock:
+            self._data.clear()
+            self.memory_bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "capacity": self.capacity,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "memory_bytes": self.memory_bytes,
+        }
@@ -0,0 +1,64 @@
+from array import array
+
+from pinyin_trie import PinyinTrie
+from pruning import rank_emissions
+
+# 模糊音：z/zh、c/ch、s/sh、n/l、an/ang、en/eng、in/ing
+# 启用后，每种 "写法" (可能本身不是合法音节，例如 cuang) 对应若干真实音节，
+# 每替换一处扣 penalty 分。写法 -> 候选字 的并集与扣分在构建时一次算好，
+# 解码时与普通音节一样查表，额外代价只是候选字变多。
+
+INITIAL_RULES = {"z/zh": ("z", "zh"), "c/ch": ("c", "ch"), "s/sh": ("s", "sh"), "n/l": ("n", "l")}
+FINAL_RULES = {"an/ang": ("an", "ang"), "en/eng": ("en", "eng"), "in/ing": ("in", "ing")}
+ALL_RULES = tuple(INITIAL_RULES) + tuple(FINAL_RULES)
+FUZZY_PENALTY = 3.0
+
+
+def _variants(syllable, rules, table, at_start):
+    out = []
+    for name in rules:
+        pair = table.get(name)
+        if pair is None: continue
+        # 先试较长的一边：zhang 按 zh 替换为 zang，而不是按 z 替换
+        for old, new in sorted((pair, pair[::-1]), key=lambda p: -len(p[0])):
+            if at_start and syllable.startswith(old):
+                out.append(new + syllable[len(old):])
+                break
+            if not at_start and syllable.endswith(old):
+                out.append(syllable[:-len(old)] + new)
+                break
+    return out
+
+
+def expand(syllables, rules=ALL_RULES):
+    """ 返回 {写法: {真实音节: 替换次数}}，包含每个音节自身 (0 次) """
+    table = {}
+    for syllable in syllables:
+        heads = [(syllable, 0)] + [(v, 1) for v in _variants(syllable, rules, INITIAL_RULES, True)]
+        for head, k in heads:
+            for spelling, n in [(head, k)] + [(v, k + 1) for v in _variants(head, rules, FINAL_RULES, False)]:
+                targets = table.setdefault(spelling, {})
+                if n < targets.get(syllable, n + 1): targets[syllable] = n
+    return table
+
+
+class FuzzyTable:
+    """ 某个 BigramStore 在一组规则下的模糊发射表 """
+    def __init__(self, store, rules=ALL_RULES, penalty=FUZZY_PENALTY):
+        self.store = store
+        self.rules = tuple(rules)
+        self.penalty = penalty
+        self.emit_ids = {}  # 写法 -> 候选字 ID (精确音节的字在前，保持原顺序)
+        self.emit_pen = {}  # 写法 -> 各候选的扣分，只为含模糊替换的写法保存
+        table = expand(store.emit_ids, self.rules)
+        for spelling, targets in table.items():
+            best = {}
+            for syllable, k in sorted(targets.items(), key=lambda x: x[1]):
+                for cid in store.emit_ids[syllable]:
+                    if cid not in best: best[cid] = k * penalty
+            if not best: continue
+            self.emit_ids[spelling] = array('i', best.keys())
+            if any(best.values()): self.emit_pen[spelling] = list(best.values())
+        # 写法 -> emit_ids 的下标，按 (初始概率 - 扣分) 降序
+        self.emit_order = rank_emissions(self.emit_ids, store.start, self.emit_pen)
+        self.trie = PinyinTrie(self.emit_ids)
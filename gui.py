@@ -1,56 +1,160 @@
 import sys
 import os
+import time
+import itertools
+import threading
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QTextEdit, QLineEdit, QLabel, QFrame, QPushButton)
-from PyQt5.QtCore import Qt, pyqtSignal, QThread
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, QTimer
 from PyQt5.QtGui import QFont
 
 # 引入后端
 from main import HMM_Model
+from session import DecodeSession
+from model_server import RemoteModel, default_address
+from riddle_automaton import last_match
 
 # 尝试引入语音模块
 try:
-    from voice import VoiceRecognizer
-    VOICE_AVAILABLE = True
+    from voice import SR_AVAILABLE, VoicePipeline, MicrophoneSource, GoogleBackend
+    VOICE_AVAILABLE = SR_AVAILABLE
 except ImportError:
     VOICE_AVAILABLE = False
+if not VOICE_AVAILABLE:
     print("提示: 未检测到 voice.py 或 SpeechRecognition 库，语音功能已禁用。")
 
-# 语音工作线程
+# 语音工作线程：录音与识别在 VoicePipeline 里并行，这里只按顺序把结果转成信号
 class VoiceThread(QThread):
     text_received = pyqtSignal(str)
     status_changed = pyqtSignal(str)
     
     def __init__(self):
         super().__init__()
-        self._is_running = False
+        self._pipeline = None
+        self._stopped = False
 
     def run(self):
         if not VOICE_AVAILABLE:
             self.status_changed.emit("模块缺失")
             return
         
-        self._is_running = True
-        recognizer = VoiceRecognizer()
-        
-        while self._is_running:
-            try:
-                success, text = recognizer.listen_and_convert()
-            except Exception:
-                success, text = False, ""
-
-            if not self._is_running: break 
-            
-            if success:
-                self.text_received.emit(text)
-            elif "超时" not in text and "无法识别" not in text:
+        self._pipeline = VoicePipeline(MicrophoneSource(), GoogleBackend).start()
+        if self._stopped: self._pipeline.stop()
+        for result in self._pipeline.results(timeout=0.5):
+            if result.success:
+                self.text_received.emit(result.text)
+            elif "超时" not in result.text and "无法识别" not in result.text:
                 # 忽略正常的静音超时，只报严重错误
-                self.status_changed.emit(f"状态: {text}")
+                self.status_changed.emit(f"状态: {result.text}")
 
     def stop(self):
         """ 设置停止标记，但不再阻塞等待 """
-        self._is_running = False
-        # 线程会在当前的 listen 结束后自动自然死亡
+        self._stopped = True
+        if self._pipeline is not None: self._pipeline.stop()
+        # 采集线程在当前这段录完后自然结束，未交付的识别结果丢弃
+
+# 解码工作线程：HMM 解码不在主线程上运行
+class DecodeThread(QThread):
+    # (代号, 新候选, 候选流是否已取完)
+    result_ready = pyqtSignal(int, list, bool)
+    # (词, 释义)
+    definition_ready = pyqtSignal(str, str)
+    # (回调, 结果)：post() 提交的任务完成
+    task_done = pyqtSignal(object, object)
+
+    def __init__(self, model, page_size=5):
+        super().__init__()
+        self.model = model
+        self.page_size = page_size
+        # 会话与候选流只在本线程内使用，无需加锁 (共享模型服务时会话在服务端)
+        self.session = DecodeSession(model) if isinstance(model, HMM_Model) else None
+        self._stream = None
+        self._stream_gen = -1
+        self._cond = threading.Condition()
+        self._pending = None   # 最新的新输入 (代号, 文本)
+        self._more = None      # 翻页请求 (代号, 条数)
+        self._definition = None  # 最新的释义请求 (词)
+        self._tasks = deque()    # post() 提交的任务 (job, 回调)，按顺序全部执行
+        self._is_running = True
+
+    def submit(self, generation, text):
+        """ 只保留最新一次请求，尚未开始的旧请求直接被覆盖 """
+        with self._cond:
+            self._pending = (generation, text)
+            self._more = None
+            self._cond.notify()
+
+    def request_more(self, generation, count):
+        """ 翻页时从当前候选流里再取 count 个 """
+        with self._cond:
+            self._more = (generation, count)
+            self._cond.notify()
+
+    def request_definition(self, word):
+        """ 悬停候选时查释义 (使用共享模型服务时是一次网络往返)，同样只保留最新一次 """
+        with self._cond:
+            self._definition = word
+            self._cond.notify()
+
+    def post(self, job, callback):
+        """ 在本线程执行 job()，结果经 task_done 回到主线程交给 callback；任务不会被覆盖，按提交顺序执行 """
+        with self._cond:
+            self._tasks.append((job, callback))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while (self._pending is None and self._more is None and self._definition is None
+                       and not self._tasks and self._is_running):
+                    self._cond.wait()
+                if not self._is_running: break
+                task = self._tasks.popleft() if self._tasks else None
+            if task is not None:
+                # 上屏后的学习、谜面与联想排在下一次解码之前
+                job, callback = task
+                try:
+                    self.task_done.emit(callback, job())
+                except Exception as e:
+                    print(f"Task Error: {e}")
+                continue
+            with self._cond:
+                if self._pending is not None:
+                    generation, text = self._pending
+                    self._pending = None
+                    # 首屏多取一个，用来判断是否还有下一页
+                    self._stream = self.model.iter_candidates(text, session=self.session)
+                    self._stream_gen = generation
+                    count = self.page_size + 1
+                elif self._more is not None:
+                    generation, count = self._more
+                    self._more = None
+                    if generation != self._stream_gen: continue
+                elif self._definition is not None:
+                    word, self._definition = self._definition, None
+                    generation = None
+                else:
+                    continue
+            if generation is None:
+                try:
+                    defn = self.model.kb.get_definition(word)
+                except Exception as e:
+                    print(f"Definition Error: {e}")
+                    defn = ""
+                self.definition_ready.emit(word, defn)
+                continue
+            try:
+                res = list(itertools.islice(self._stream, count))
+            except Exception as e:
+                print(f"Decode Error: {e}")
+                res = []
+            self.result_ready.emit(generation, res, len(res) < count)
+
+    def stop(self):
+        with self._cond:
+            self._is_running = False
+            self._cond.notify()
 
 # 候选词标签
 class ClickableLabel(QLabel):
@@ -77,16 +181,43 @@ class ClickableLabel(QLabel):
 
 # 主窗口
 class InputMethodWindow(QWidget):
-    def __init__(self):
+    def __init__(self, server_address=None):
         super().__init__()
+        self.server_address = server_address  # 非空时使用共享模型服务 (model_server.py)
         self.candidates = []   
         self.page_index = 0    
         self.PAGE_SIZE = 5
         self.is_voice_active = False 
         self.voice_thread = None     
         
+        # 后台解码：每次输入变化递增代号，过期结果直接丢弃
+        self.DEBOUNCE_MS = 30
+        self.decode_thread = None
+        self.decode_gen = 0
+        self.definition_word = None  # 正在等释义的候选，鼠标移走后到达的释义丢弃
+        self.decode_pending = False
+        self.stream_exhausted = True
+        self.page_pending = False
+        self.pending_select = None
+        self.pending_text = ""
+        self.input_time = 0.0
+        self.last_latency = 0.0   # 最近一次 输入->候选上屏 延迟 (秒)
+        self.max_latency = 0.0    # 最坏情况
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.timeout.connect(self.dispatch_decode)
+        # 歇后语谜面的增量匹配：记录上次喂到的光标位置
+        self.RIDDLE_CONTEXT = 64
+        self.riddles = None
+        self.riddle_pos = 0
+        
         self.init_model() 
         self.init_ui()    
+        # 释义只在悬停时用到，缩写索引要读完整的词表，窗口显示后再在后台准备
+        QTimer.singleShot(0, self.preload_definitions)
+
+    def preload_definitions(self):
+        if hasattr(self, 'model') and isinstance(self.model, HMM_Model): self.model.preload()
         
     def init_ui(self):
         self.setWindowTitle("Python HMM 输入法 (丝滑语音版)")
@@ -186,27 +317,37 @@ class InputMethodWindow(QWidget):
                 if os.path.isdir(alt_data):
                     data_dir = alt_data
                     hmm_dir = data_dir
-                
-            self.model = HMM_Model()
-            
-            pinyin_path = os.path.join(hmm_dir, "pinyin.txt")
-            if not os.path.exists(pinyin_path): pinyin_path = "pinyin.txt"
-            
-            self.model.load_data(
-                pinyin_path,
-                os.path.join(hmm_dir, "CharFreq.txt"),
-                os.path.join(hmm_dir, "Bigram.txt")
-            )
+
+            if self.server_address:
+                try:
+                    self.model = RemoteModel(self.server_address)
+                    self.decode_thread = DecodeThread(self.model)
+                    self.decode_thread.result_ready.connect(self.on_decode_result)
+                    self.decode_thread.definition_ready.connect(self.on_definition)
+                    self.decode_thread.task_done.connect(self.on_task_done)
+                    self.decode_thread.start()
+                    return
+                except OSError as e:
+                    print(f"[Warn] 连接模型服务 {self.server_address} 失败 ({e})，改为本地加载")
+
+            self.model = HMM_Model(kb_dir=None)
             
-            if hasattr(self.model, 'kb'):
-                self.model.kb.load_data(data_dir)
+            # HMM 语料与知识库一起加载，命中编译缓存时跳过文本解析
+            self.model.load_from_dir(hmm_dir)
+            # 用户选择过的候选会被记住，下次排在前面
+            self.model.load_user_dict(os.path.join(data_dir, "user_dict.txt"))
+            self.decode_thread = DecodeThread(self.model)
+            self.decode_thread.result_ready.connect(self.on_decode_result)
+            self.decode_thread.definition_ready.connect(self.on_definition)
+            self.decode_thread.task_done.connect(self.on_task_done)
+            self.decode_thread.start()
                 
         except Exception as e:
             print(f"Init Error: {e}")
 
     def update_status_text(self):
         if hasattr(self, 'model') and hasattr(self.model, 'kb'):
-            c = len(self.model.kb.emoji_dict)
+            c = self.model.info()["emoji"] if isinstance(self.model, RemoteModel) else len(self.model.kb.emoji_dict)
             voice_status = "✅" if VOICE_AVAILABLE else "❌"
             self.status_label.setText(f"系统就绪 | Emoji: {c} | 语音: {voice_status}")
             self.status_label.setStyleSheet("color: green")
@@ -256,9 +397,21 @@ class InputMethodWindow(QWidget):
             self.voice_thread = None
 
     def on_voice_text(self, text):
+        start = self.text_editor.textCursor().position()
         self.text_editor.insertPlainText(text)
+        generation = self.decode_gen
+        self.run_model(self.feed_riddles(start, text), lambda riddle: self.show_riddle(generation, riddle))
         self.status_label.setText("识别成功，继续监听...")
 
+    def show_riddle(self, generation, riddle):
+        """ 显示谜面的答案；期间又有了新输入时不再覆盖候选栏 """
+        if not riddle or generation != self.decode_gen: return
+        self.candidates = [riddle[1]]
+        self.page_index = 0
+        self.update_ui()
+        self.definition_word = None
+        self.info_text.setText(f"【歇后语补全】\n{riddle[1]}")
+
     def on_voice_status(self, msg):
         self.status_label.setText(f"🎙️ {msg}")
 
@@ -274,18 +427,24 @@ class InputMethodWindow(QWidget):
             return
         if text in ['1', '2', '3', '4', '5']:
             idx = int(text) - 1
-            self.select_candidate_by_ui_index(idx)
+            self.select_or_defer(idx)
             return 
         if key == Qt.Key_Return:
             if event.modifiers() & Qt.ControlModifier: 
                 self.text_editor.insertPlainText(self.pinyin_input.text())
                 self.pinyin_input.clear()
-            elif self.candidates:
-                self.select_candidate_by_ui_index(0)
+            elif self.candidates or self.decode_pending:
+                self.select_or_defer(0)
             return
         QLineEdit.keyPressEvent(self.pinyin_input, event)
 
     def next_page(self):
+        # 下一页还没取到时，向工作线程按需要更多候选
+        need = (self.page_index + 2) * self.PAGE_SIZE + 1
+        if len(self.candidates) < need and not self.stream_exhausted and not self.decode_pending:
+            self.page_pending = True
+            self.decode_thread.request_more(self.decode_gen, need - len(self.candidates))
+            return
         max_page = (len(self.candidates) - 1) // self.PAGE_SIZE
         if self.page_index < max_page:
             self.page_index += 1
@@ -300,48 +459,149 @@ class InputMethodWindow(QWidget):
         text = text.strip()
         self.candidates = []
         self.page_index = 0 
+        self.decode_gen += 1
+        self.decode_pending = False
+        self.stream_exhausted = True
+        self.page_pending = False
+        self.pending_select = None
+        self.debounce_timer.stop()
         
         if not text:
             self.clear_ui()
             return
         
-        idiom = self.model.kb.get_idiom(text.replace(" ", ""))
-        if idiom: self.candidates.append(idiom)
+        idiom = None
+        if isinstance(self.model, HMM_Model):
+            # 本地模型：用户词库 / 成语 / Emoji 是查表命中，立即显示
+            self.candidates.extend(self.model.user_dict.lookup(text))
+            idiom = self.model.kb.get_idiom(text.replace(" ", ""))
+            if idiom and idiom not in self.candidates: self.candidates.append(idiom)
+
+            emoji = self.model.kb.get_emoji(text.replace(" ", ""))
+            if emoji and emoji not in self.candidates:
+                self.candidates.append(emoji)
+        # 共享模型服务时查表也是网络往返，交给工作线程，它们排在候选流最前面，和 HMM 结果一起送回
+
+        if not idiom and self.decode_thread:
+            # HMM 解码交给工作线程，连续输入时去抖
+            self.decode_pending = True
+            self.input_time = time.perf_counter()
+            self.pending_text = text
+            self.debounce_timer.start(self.DEBOUNCE_MS)
         
-        emoji = self.model.kb.get_emoji(text.replace(" ", ""))
-        if emoji and emoji not in self.candidates:
-            self.candidates.append(emoji)
-            
-        if not idiom:
-            res = self.model.get_top_candidates(text, top_k=50) 
-            for w in res:
-                if w not in self.candidates:
-                    self.candidates.append(w)
+        self.update_ui()
+
+    def dispatch_decode(self):
+        if self.decode_pending:
+            self.decode_thread.submit(self.decode_gen, self.pending_text)
+
+    def on_decode_result(self, generation, res, exhausted):
+        if generation != self.decode_gen: return  # 输入已变化，结果过期
+        self.stream_exhausted = exhausted
+        # 候选流开头的查表结果可能已在主线程显示过，去重后追加
+        for w in res:
+            if w not in self.candidates:
+                self.candidates.append(w)
         
+        if self.page_pending:
+            # 翻页请求的结果
+            self.page_pending = False
+            max_page = (len(self.candidates) - 1) // self.PAGE_SIZE
+            if self.page_index < max_page:
+                self.page_index += 1
+            self.update_ui()
+            return
+        
+        self.decode_pending = False
         self.update_ui()
+        
+        self.last_latency = time.perf_counter() - self.input_time
+        self.max_latency = max(self.max_latency, self.last_latency)
+        self.status_label.setToolTip(
+            f"输入→候选延迟: 最近 {self.last_latency * 1000:.1f} ms | 最大 {self.max_latency * 1000:.1f} ms")
+        
+        if self.pending_select is not None:
+            idx, self.pending_select = self.pending_select, None
+            self.select_candidate_by_ui_index(idx)
+
+    def select_or_defer(self, ui_idx):
+        """ 候选还在后台计算时先记下按键，结果到达后再上屏 """
+        real_idx = self.page_index * self.PAGE_SIZE + ui_idx
+        if self.decode_pending and real_idx >= len(self.candidates):
+            self.pending_select = ui_idx
+            return
+        self.select_candidate_by_ui_index(ui_idx)
 
     def select_candidate_by_ui_index(self, ui_idx):
         real_idx = self.page_index * self.PAGE_SIZE + ui_idx
         if real_idx < len(self.candidates):
             word = self.candidates[real_idx]
+            start = self.text_editor.textCursor().position()
             self.text_editor.insertPlainText(word)
+            riddle = self.feed_riddles(start, word)
+            pinyin = self.pinyin_input.text().strip()
+            # 以光标前的两个字为联想上下文 (单字上屏时也能用上前一个字)
+            cursor = self.text_editor.textCursor().position()
+            context = self.text_editor.toPlainText()[max(0, cursor - 2):cursor] or word
             self.pinyin_input.clear()
             self.candidates = []
             self.page_index = 0
-            
-            xhy = self.model.get_xiehouyu_answer(word)
-            if xhy:
-                self.candidates = [xhy]
-                self.update_ui()
-                self.info_text.setText(f"【歇后语补全】\n{xhy}")
-            else:
-                last = word[-1]
-                assoc = self.model.get_associations(last, top_k=20)
-                if assoc:
-                    self.candidates = assoc
-                    self.update_ui()
-                else:
-                    self.clear_ui()
+
+            def after_commit():
+                if pinyin: self.model.learn(pinyin, word)  # 联想候选 (输入为空) 不学习
+                # 谜面可能分几次上屏，也可能嵌在一句话里，输完的那一刻给出答案 (取最后输完的，同一位置最长的优先)
+                found = riddle()
+                return found, None if found else self.model.get_associations(context, top_k=20)
+            generation = self.decode_gen
+            self.run_model(after_commit, lambda res: self.show_after_commit(generation, *res))
+
+    def show_after_commit(self, generation, riddle, assoc):
+        if generation != self.decode_gen: return  # 已经开始输入下一个词
+        if riddle:
+            self.show_riddle(generation, riddle)
+        elif assoc:
+            self.candidates = assoc
+            self.update_ui()
+        else:
+            self.clear_ui()
+
+    def run_model(self, job, callback):
+        """
+        共享模型服务时 job() 里的调用 (学习、联想、谜面) 都是网络往返，交给工作线程按顺序执行，
+        结果回到主线程再调用 callback；本地模型直接执行
+        """
+        if isinstance(self.model, RemoteModel) and self.decode_thread:
+            self.decode_thread.post(job, callback)
+        else:
+            callback(job())
+
+    def on_task_done(self, callback, result):
+        callback(result)
+
+    def feed_riddles(self, start, text):
+        """
+        准备把从 start 处上屏的文字喂给谜面匹配器，返回 job()，调用后得到最后输完的谜面 (谜面, 答案) 或 None
+        光标不在上次喂到的位置 (中间手动编辑过) 时，先用光标前的文字重建匹配状态
+        界面上的文字在这里 (主线程) 取好，job() 可以交给工作线程，匹配器只在 job() 里使用
+        """
+        if not hasattr(self, 'model'): return lambda: None
+        scanner = self.riddles
+        if scanner is None:
+            # 自动机在窗口显示后由 preload() 在后台构建，建好之前不匹配，界面线程不等它
+            scanner = self.riddles = self.model.riddle_scanner(wait=False)
+            if scanner is None: return lambda: None
+            self.riddle_pos = -1  # 新建的匹配器先用光标前的文字补上状态
+        context = None
+        if start != self.riddle_pos:
+            context = self.text_editor.toPlainText()[max(0, start - self.RIDDLE_CONTEXT):start]
+        self.riddle_pos = self.text_editor.textCursor().position()
+
+        def job():
+            if context is not None:
+                scanner.reset()
+                scanner.feed(context)
+            return last_match(scanner.feed(text))
+        return job
 
     def update_ui(self):
         start = self.page_index * self.PAGE_SIZE
@@ -359,7 +619,10 @@ class InputMethodWindow(QWidget):
                 lbl.setVisible(False)
         
         total_pages = (len(self.candidates) + self.PAGE_SIZE - 1) // self.PAGE_SIZE
-        if total_pages > 1:
+        if not self.stream_exhausted:
+            # 候选流还没取完，总页数未知
+            self.page_label.setText(f"{self.page_index + 1}/{total_pages}+")
+        elif total_pages > 1:
             self.page_label.setText(f"{self.page_index + 1}/{total_pages}")
         else:
             self.page_label.setText("")
@@ -371,22 +634,42 @@ class InputMethodWindow(QWidget):
         real_idx = self.page_index * self.PAGE_SIZE + ui_idx
         if real_idx < len(self.candidates):
             w = self.candidates[real_idx]
-            defn = self.model.kb.get_definition(w)
-            if w == "守株待兔" and len(defn) < 50:
-                 defn += "\n\n【测试文本】\n" + "测试滚动条 " * 20
-            self.info_text.setText(f"【{w}】\n{defn}")
+            if self.decode_thread:
+                self.definition_word = w
+                self.decode_thread.request_definition(w)
+
+    def on_definition(self, w, defn):
+        if w != self.definition_word: return
+        if w == "守株待兔" and len(defn) < 50:
+             defn += "\n\n【测试文本】\n" + "测试滚动条 " * 20
+        self.info_text.setText(f"【{w}】\n{defn}")
 
     def clear_ui(self):
+        self.definition_word = None
         for lbl in self.candidate_labels:
             lbl.setText("")
         self.page_label.setText("")
         self.info_text.setText("")
 
+    def closeEvent(self, event):
+        if self.decode_thread:
+            self.decode_thread.stop()
+            self.decode_thread.wait()
+        if hasattr(self, 'model'):
+            if isinstance(self.model, RemoteModel): self.model.close()
+            else: self.model.user_dict.close()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     app = QApplication(sys.argv)
     app.setFont(QFont("微软雅黑", 10))
     
-    win = InputMethodWindow()
+    # --server [地址]：使用共享模型服务，不在本进程加载语料
+    server = None
+    if "--server" in sys.argv:
+        i = sys.argv.index("--server")
+        server = sys.argv[i + 1] if i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("-") else default_address()
+    win = InputMethodWindow(server)
     win.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,148 @@
+import heapq
+import itertools
+
+from beam_numpy import NUMPY_AVAILABLE
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+# 精确 k-best 解码：Viterbi 前向 + 反向 A* 惰性枚举
+#
+# 前向：V[j][c] 是覆盖 text[:j]、以字 c 结尾的最优前缀得分 (在 DecodeSession 的音节 DAG 上计算)。
+#       DecodeSession.viterbi 缓存每个位置的结果，逐键输入时同样只补算尾部。
+# 反向：从末尾出发向前扩展后缀，优先级 = 后缀得分 + V (即经过该点的最优完整路径得分)，
+#       V 是精确值，所以候选严格按得分从高到低产出；只在调用方继续取时才往下搜索。
+# 剪枝档位 (pruning.py) 的 emit_top 与 threshold 同样作用于这里：每个音节只展开前 emit_top 个字，
+# 每个位置丢弃比最优低 threshold 以上的字 (至少保留 min_keep 个)；反向只经过留下的字，
+# 所以产出的仍是剪枝后格子上严格按得分排序的结果。beam_width 只用于 Beam Search。
+
+def _prune(best, threshold, min_keep):
+    """ 阈值剪枝：丢弃比最优低 threshold 以上的字，至少保留得分最高的 min_keep 个 """
+    if threshold is None or len(best) <= min_keep: return best
+    floor = max(best.values()) - threshold
+    if min_keep: floor = min(floor, heapq.nlargest(min_keep, best.values())[-1])
+    return {c: s for c, s in best.items() if s >= floor}
+
+
+def _forward(model, session):
+    """ 把 session.viterbi 补算到当前输入末尾 """
+    initial = session.INITIAL
+    store = model.bigram
+    start_score = store.start_score
+    emit_ids, emit_pen = model.emission()
+    np_decoder = model.get_decoder(use_numpy=True) if NUMPY_AVAILABLE else None
+    threshold, min_keep = model.pruning.threshold, model.pruning.min_keep
+    V = session.viterbi
+
+    for j in range(len(V), len(session.text) + 1):
+        if session.skips[j] is None:
+            V.append(None)
+            continue
+        best = {}
+        for i, py in session.incoming[j]:
+            prev = V[i]
+            if prev is None: continue
+            if py is None:
+                if prev is initial:
+                    best = initial
+                    break
+                for c, s in prev.items():
+                    if s > best.get(c, float('-inf')): best[c] = s
+                continue
+            cand = emit_ids.get(py)
+            if not cand: continue
+            pen = emit_pen.get(py) or itertools.repeat(0.0)  # 模糊音扣分
+            if prev is initial:
+                for c, p in zip(cand, pen):
+                    s = start_score(c) - p
+                    if s > best.get(c, float('-inf')): best[c] = s
+            elif np_decoder is not None:
+                prev_ids = np.fromiter(prev.keys(), dtype=np.int64, count=len(prev))
+                prev_scores = np.fromiter(prev.values(), dtype=np.float64, count=len(prev))
+                cand_ids = np_decoder.beam_ids[py]
+                block = np_decoder.trans_block(prev_ids, cand_ids)
+                if py in emit_pen: block -= np_decoder.beam_pen[py][None, :]
+                col = (prev_scores[:, None] + block).max(axis=0)
+                for c, s in zip(cand_ids.tolist(), col.tolist()):
+                    if s > best.get(c, float('-inf')): best[c] = s
+            else:
+                score = store.score
+                for c, p in zip(cand, pen):
+                    s = max(ps + (score(pc, c) - p) for pc, ps in prev.items())
+                    if s > best.get(c, float('-inf')): best[c] = s
+        if best is not initial: best = _prune(best, threshold, min_keep)
+        V.append(best if best else None)
+
+
+def iter_exact(model, session):
+    """
+    按得分从高到低逐个产出 (得分, 候选串)，同一字串只产出一次
+    session 需已 update() 到当前输入
+    """
+    _forward(model, session)
+    if model.metrics is not None: model.metrics.lap("forward")
+    initial = session.INITIAL
+    V = session.viterbi
+    n = len(session.text)
+    end = V[n]
+    if end is None or end is initial: return
+
+    store = model.bigram
+    chars, start_score, score = store.chars, store.start_score, store.score
+    emit_ids, emit_pen = model.emission()
+    emit_maps = {}
+
+    def penalty(py, c):
+        """ c 不是 py 的候选时返回 None，否则返回模糊音扣分 """
+        m = emit_maps.get(py)
+        if m is None:
+            ids = emit_ids.get(py, ())
+            m = emit_maps[py] = dict(zip(ids, emit_pen.get(py) or itertools.repeat(0.0)))
+        return m.get(c)
+
+    # 子节点: (f, g, 位置, 字, 后缀链, 是否完整)；兄弟按 f 降序排列，只把最优的放进堆，弹出时再放下一个
+    def expand(j, c, g, suffix):
+        kids = []
+        for i, py in session.incoming[j]:
+            prev = V[i]
+            if prev is None: continue
+            if py is None:
+                if prev is not initial and c in prev:
+                    kids.append((g + prev[c], g, i, c, suffix, False))
+                continue
+            p = penalty(py, c)
+            if p is None: continue
+            tail = (c, suffix)
+            if prev is initial:
+                s = g + (start_score(c) - p)
+                kids.append((s, s, i, c, tail, True))
+            else:
+                for pc, ps in prev.items():
+                    ng = g + (score(pc, c) - p)
+                    kids.append((ng + ps, ng, i, pc, tail, False))
+        kids.sort(key=lambda k: -k[0])
+        return kids
+
+    tie = itertools.count()
+    heap = []
+    roots = sorted(((s, 0.0, n, c, None, False) for c, s in end.items()), key=lambda k: -k[0])
+    heapq.heappush(heap, (-roots[0][0], next(tie), roots, 0))
+    seen = set()
+
+    while heap:
+        _, _, kids, idx = heapq.heappop(heap)
+        if idx + 1 < len(kids):
+            heapq.heappush(heap, (-kids[idx + 1][0], next(tie), kids, idx + 1))
+        f, g, j, c, suffix, complete = kids[idx]
+        if complete:
+            out = []
+            while suffix is not None:
+                cid, suffix = suffix
+                out.append(chars[cid])
+            text = "".join(out)
+            if text not in seen:
+                seen.add(text)
+                yield f, text
+            continue
+        children = expand(j, c, g, suffix)
+        if children:
+            heapq.heappush(heap, (-children[0][0], next(tie), children, 0))
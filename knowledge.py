@@ -1,89 +1,284 @@
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from packed_dict import PackedDict, PoolBuilder, StringPool
+from riddle_automaton import IGNORED, RiddleAutomaton
+
+# 知识库：成语 / 歇后语 / Emoji 在候选路径上查表，加载时即解析；
+# 释义 (definition_dict) 只在悬停候选时用到，推迟到第一次访问或 preload() 的后台线程里解析。
+# 各 JSON 文件在线程池中并行读取解析，合并时保持原来的先后覆盖规则。
+# 歇后语谜面的匹配自动机 (riddle_automaton.py) 同样在第一次用到或 preload() 时构建。
+# 各词典解析完后打包成 PackedDict (packed_dict.py)，共用一个去重的字符串池；
+# 释义只存原文和格式编号，"[歇后语] " 等前缀在查询时才拼上。
+
+# (文件名, 类型)，顺序即释义的覆盖顺序
+SOURCES = [("idiom.json", "成语"), ("xiehouyu.json", "歇后语"), ("ci.json", "词语"),
+           ("word.json", "汉字"), ("emoji.json", "Emoji")]
+# 只提供释义的来源，整个文件都推迟解析
+LAZY_TYPES = {"词语", "汉字"}
+
+# 释义的格式编号 -> 模板 (0 为原样输出)；多字段的原文以制表符分隔
+DEF_FORMATS = ("{}", "[成语] {}", "[歇后语] {}", "[解释] {}", "[字典] 部首:{} | 笔画:{}", "[表情] 拼音: {}")
+DEF_KINDS = {"成语": 1, "歇后语": 2, "词语": 3, "汉字": 4, "Emoji": 5}
+PHRASE_KINDS = {DEF_KINDS["成语"], DEF_KINDS["词语"]}  # 计入缩写索引词表的释义
+# 模型缓存中的词典 (属性名)
+TABLES = ("idiom_dict", "xiehouyu_dict", "emoji_dict", "definition_dict")
+
+
+def _parse(path, type_name):
+    """ 解析一个 JSON 文件，返回 (查表项, 释义项)；释义项为 [(词, 格式编号, 原文, 是否覆盖已有)] """
+    table, defs = {}, []
+    kind = DEF_KINDS[type_name]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if type_name == "成语":
+        for item in data:
+            abbr = item.get('abbreviation', '')
+            word = item.get('word', '')
+            expl = item.get('explanation', '')
+            if abbr and word: table[abbr] = word
+            if word and expl: defs.append((word, kind, expl, True))
+
+    elif type_name == "歇后语":
+        for item in data:
+            riddle = item.get('riddle', '')
+            answer = item.get('answer', '')
+            if riddle:
+                clean_riddle = riddle.replace('，', '').replace(',', '')
+                table[clean_riddle] = answer
+                defs.append((riddle, kind, answer, True))
+
+    elif type_name == "词语":
+        for item in data:
+            ci = item.get('ci', '')
+            expl = item.get('explanation', '')
+            if ci and expl: defs.append((ci, kind, expl, False))
+
+    elif type_name == "汉字":
+        for item in data:
+            word = item.get('word', '')
+            strokes = item.get('strokes', '')
+            radicals = item.get('radicals', '')
+            if word: defs.append((word, kind, f"{radicals}\t{strokes}", True))
+
+    # Emoji 解析逻辑
+    elif type_name == "Emoji":
+        for item in data:
+            py = item.get('pinyin', '')
+            emoji = item.get('emoji', '')
+            if py and emoji:
+                table[py] = emoji
+                # 给表情加个简单的解释，防止报错
+                defs.append((emoji, kind, py, True))
+    return table, defs
+
+
+def _parse_safe(root_dir, filename, type_name):
+    path = os.path.join(root_dir, filename)
+    if not os.path.exists(path): return None
+    try:
+        return _parse(path, type_name)
+    except Exception as e:
+        print(f"[Warn] 加载 {filename} 失败: {e}")
+        return None
+
+
+def _merge_definitions(parts):
+    """ parts 按 SOURCES 顺序排列；“词语”不覆盖已有的解释。返回 {词: (格式编号, 原文)} """
+    definitions = {}
+    for part in parts:
+        if part is None: continue
+        for word, kind, raw, override in part:
+            if override or word not in definitions: definitions[word] = (kind, raw)
+    return definitions
+
+
+def _repack(table, builder):
+    """ 把任意词典 (dict 或其他池里的 PackedDict) 打包进 builder 的池 """
+    if isinstance(table, PackedDict):
+        return PackedDict.build(dict(table.raw_items()), builder, table.formats)
+    return PackedDict.build(dict(table), builder)
+
 
 class KnowledgeBase:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.idiom_dict = {}      # szdt -> 守株待兔
         self.xiehouyu_dict = {}   # 谜面 -> 谜底
-        self.definition_dict = {} # 词/字 -> 解释
         self.emoji_dict = {}      # haha -> 😂 (新增!)
-        
+        self.cache = cache        # 可选的 CandidateCache，与 HMM 候选共用
+        self._definitions = {}    # 词/字 -> 解释，见 definition_dict
+        self._loader = None       # 尚未解析的释义：返回释义表的函数
+        self._riddles = None      # (建表所用的 xiehouyu_dict, 谜面自动机)
+        self._lock = threading.Lock()         # 释义表
+        self._riddle_lock = threading.Lock()  # 谜面自动机，与释义表分开，互不等待
+        self._riddle_thread = None
+
+    # ---------- 释义 (按需解析) ----------
+    @property
+    def definition_dict(self):
+        if self._loader is not None: self._resolve()
+        return self._definitions
+
+    @definition_dict.setter
+    def definition_dict(self, value):
+        with self._lock:
+            self._definitions = value
+            self._loader = None
+
+    def set_definition_loader(self, loader):
+        """ 释义表改为第一次访问时调用 loader() 得到 """
+        with self._lock:
+            self._definitions = {}
+            self._loader = loader
+
+    def _resolve(self):
+        with self._lock:
+            if self._loader is None: return
+            loader = self._loader
+            self._definitions = loader()
+            self._loader = None
+
+    def preload(self):
+        """ 在后台线程解析释义表、构建谜面自动机 (界面首次绘制后调用)，之后的查询不再等待 """
+        self._build_riddles_async()
+        threading.Thread(target=self._resolve, daemon=True).start()
+
+    # ---------- 加载 ----------
     def load_data(self, root_dir):
-        """ 加载所有 JSON 数据 """
+        """ 并行加载所有 JSON 数据；只提供释义的词语/汉字表推迟到第一次查释义时解析 """
         print(f"正在加载特色语料库: {root_dir} ...")
-        
-        # 依次加载各类数据
-        self._load_json(root_dir, "idiom.json", "成语")
-        self._load_json(root_dir, "xiehouyu.json", "歇后语")
-        self._load_json(root_dir, "ci.json", "词语")
-        self._load_json(root_dir, "word.json", "汉字")
-        self._load_json(root_dir, "emoji.json", "Emoji") # <--- 新增
 
-        print(f"知识库加载完毕: 成语 {len(self.idiom_dict)} | Emoji {len(self.emoji_dict)}")
+        eager = [(name, t) for name, t in SOURCES if t not in LAZY_TYPES]
+        with ThreadPoolExecutor(len(eager)) as pool:
+            parsed = dict(zip(eager, pool.map(lambda s: _parse_safe(root_dir, *s), eager)))
+
+        tables = {"成语": {}, "歇后语": {}, "Emoji": {}}
+        for (name, type_name), result in parsed.items():
+            if result is not None: tables[type_name].update(result[0])
+        builder = PoolBuilder()
+        self.idiom_dict, self.xiehouyu_dict, self.emoji_dict = (
+            PackedDict.build(tables[t], builder) for t in ("成语", "歇后语", "Emoji"))
+        strings = builder.finish()
+        del tables
+
+        def load_definitions():
+            lazy = [s for s in SOURCES if s[1] in LAZY_TYPES]
+            with ThreadPoolExecutor(len(lazy)) as pool:
+                parsed.update(zip(lazy, pool.map(lambda s: _parse_safe(root_dir, *s), lazy)))
+            merged = _merge_definitions(parsed[s][1] if parsed[s] is not None else None for s in SOURCES)
+            parsed.clear()
+            # 与查表词典共用字符串池，歇后语答案、成语、Emoji 等文本不再重复存放
+            builder = PoolBuilder(strings)
+            definitions = PackedDict.build(merged, builder, DEF_FORMATS)
+            builder.finish()
+            return definitions
+        self.set_definition_loader(load_definitions)
 
-    def _load_json(self, root_dir, filename, type_name):
-        path = os.path.join(root_dir, filename)
-        if not os.path.exists(path): return
-
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                if type_name == "成语":
-                    for item in data:
-                        abbr = item.get('abbreviation', '')
-                        word = item.get('word', '')
-                        expl = item.get('explanation', '')
-                        if abbr and word: self.idiom_dict[abbr] = word
-                        if word and expl: self.definition_dict[word] = f"[成语] {expl}"
-
-                elif type_name == "歇后语":
-                    for item in data:
-                        riddle = item.get('riddle', '')
-                        answer = item.get('answer', '')
-                        if riddle:
-                            clean_riddle = riddle.replace('，', '').replace(',', '')
-                            self.xiehouyu_dict[clean_riddle] = answer
-                            self.definition_dict[riddle] = f"[歇后语] {answer}"
-
-                elif type_name == "词语":
-                    for item in data:
-                        ci = item.get('ci', '')
-                        expl = item.get('explanation', '')
-                        if ci and expl and ci not in self.definition_dict:
-                            self.definition_dict[ci] = f"[解释] {expl}"
-
-                elif type_name == "汉字":
-                    for item in data:
-                        word = item.get('word', '')
-                        strokes = item.get('strokes', '')
-                        radicals = item.get('radicals', '')
-                        if word: self.definition_dict[word] = f"[字典] 部首:{radicals} | 笔画:{strokes}"
-                
-                # Emoji 解析逻辑 
-                elif type_name == "Emoji":
-                    for item in data:
-                        py = item.get('pinyin', '')
-                        emoji = item.get('emoji', '')
-                        if py and emoji:
-                            self.emoji_dict[py] = emoji
-                            # 给表情加个简单的解释，防止报错
-                            self.definition_dict[emoji] = f"[表情] 拼音: {py}"
-
-        except Exception as e:
-            print(f"[Warn] 加载 {filename} 失败: {e}")
+        if self.cache is not None: self.cache.clear()
+        print(f"知识库加载完毕: 成语 {len(self.idiom_dict)} | Emoji {len(self.emoji_dict)}")
 
+    # ---------- 查询 ----------
     def get_idiom(self, abbr):
-        return self.idiom_dict.get(abbr)
+        if self.cache is None: return self.idiom_dict.get(abbr)
+        return self.cache.get_or_compute(('idiom', abbr), lambda: self.idiom_dict.get(abbr))
+
+    def phrases(self):
+        """ 成语与词语词表 (供缩写索引使用) """
+        yield from self.idiom_dict.values()
+        definitions = self.definition_dict
+        if isinstance(definitions, PackedDict) and definitions.kinds is not None:
+            yield from definitions.keys_of_kind(PHRASE_KINDS)
+            return
+        for word, expl in definitions.items():
+            if expl.startswith("[解释]") or expl.startswith("[成语]"): yield word
 
     def get_xiehouyu(self, text):
-        if text in self.xiehouyu_dict: return self.xiehouyu_dict[text]
-        return None
+        """ 以 text 结尾的最长谜面的答案 (text 本身就是谜面时即为其答案) """
+        answer = self.xiehouyu_dict.get(text)
+        if answer is not None: return answer
+        ac = self.riddle_automaton()
+        state = 0
+        for ch in text[-ac.max_len * 2:]:  # 只需看结尾部分 (逗号不计入谜面长度)
+            if ch not in IGNORED: state = ac.step(state, ch)
+        found = ac.matches_at(state)
+        return ac.values[found[0]] if found else None
+
+    def riddle_automaton(self, wait=True):
+        """
+        全部谜面的 Aho-Corasick 自动机，歇后语表重新加载后重建
+        wait=False 时 (界面线程) 自动机未就绪就转到后台构建并返回 None
+        """
+        riddles = self._riddles
+        if riddles is not None and riddles[0] is self.xiehouyu_dict: return riddles[1]
+        if not wait:
+            self._build_riddles_async()
+            return None
+        with self._riddle_lock:
+            riddles = self._riddles
+            if riddles is None or riddles[0] is not self.xiehouyu_dict:
+                table = self.xiehouyu_dict
+                riddles = self._riddles = (table, RiddleAutomaton.build(table))
+        return riddles[1]
+
+    def _build_riddles_async(self):
+        if self._riddle_thread is not None and self._riddle_thread.is_alive(): return
+        self._riddle_thread = threading.Thread(target=self.riddle_automaton, daemon=True)
+        self._riddle_thread.start()
+
+    def riddle_scanner(self, wait=True):
+        """ 增量匹配器：逐段喂入上屏的文字，谜面输完时返回 [(结束位置, 谜面, 答案)]；wait=False 且未就绪时为 None """
+        automaton = self.riddle_automaton(wait)
+        return automaton.scanner() if automaton is not None else None
 
     def get_definition(self, text):
         if "——" in text: text = text.split("——")[0].strip()
         return self.definition_dict.get(text, "暂无详细收录")
 
+    def nbytes(self):
+        """ 各词典的存储字节数：{"strings": 共享字符串池, 词典名: 编号数组}；未打包的词典不计 """
+        sizes, pools = {}, {}
+        for name in TABLES:
+            table = getattr(self, name)
+            if not isinstance(table, PackedDict): continue
+            pools[id(table.pool)] = table.pool.nbytes()
+            sizes[name] = table.nbytes()
+        sizes["strings"] = sum(pools.values())
+        return sizes
+
+    # ---------- 模型缓存 (model_cache.py) 用 ----------
+    def to_payload(self):
+        """ 返回 (元数据, 名称 -> 数组)；各词典不在同一个字符串池里时 (被整体替换过) 先重新打包 """
+        tables = {name: getattr(self, name) for name in TABLES}
+        pools = {id(t.pool) if isinstance(t, PackedDict) else None for t in tables.values()}
+        if len(pools) != 1 or None in pools:
+            builder = PoolBuilder()
+            tables = {name: _repack(t, builder) for name, t in tables.items()}
+            builder.finish()
+        strings = next(iter(tables.values())).pool
+        arrays = {"pool.blob": memoryview(strings.blob), "pool.offsets": strings.offsets}
+        for name, table in tables.items():
+            arrays.update((f"{name}.{field}", arr) for field, arr in table.to_arrays().items())
+        meta = {"formats": {name: list(t.formats) if t.formats else None for name, t in tables.items()}}
+        return meta, arrays
+
+    def load_payload(self, meta, buffers):
+        """ buffers: 名称 -> memoryview，词典直接在映射内存上查询，不解码 """
+        offsets = buffers["pool.offsets"]
+        strings = StringPool(buffers["pool.blob"], offsets.cast('I') if isinstance(offsets, memoryview) else offsets)
+        for name in TABLES:
+            formats = meta["formats"][name]
+            fields = {k[len(name) + 1:]: v for k, v in buffers.items() if k.startswith(name + ".")}
+            table = PackedDict.from_arrays(strings, fields, tuple(formats) if formats else None)
+            if name == "definition_dict":
+                self.definition_dict = table
+            else:
+                setattr(self, name, table)
+        if self.cache is not None: self.cache.clear()
+
     # 新增接口
     def get_emoji(self, pinyin):
-        return self.emoji_dict.get(pinyin)
\ No newline at end of file
+        if self.cache is None: return self.emoji_dict.get(pinyin)
+        return self.cache.get_or_compute(('emoji', pinyin), lambda: self.emoji_dict.get(pinyin))
@@ -1,25 +1,175 @@
 import os
 import math
 import heapq
+import itertools
+import threading
 from knowledge import KnowledgeBase
+import model_cache
+from bigram_store import BigramStore
+from beam_numpy import NUMPY_AVAILABLE, NumpyBeamDecoder
+from candidate_cache import CandidateCache
+from pinyin_trie import PinyinTrie
+from session import DecodeSession
+from metrics import Metrics
+from user_dict import UserDict
+from abbr_index import AbbrIndex, AbbrLookup
+from fuzzy import FuzzyTable, ALL_RULES, FUZZY_PENALTY
+from pruning import PROFILES, DEFAULT_PROFILE, cap_emissions
+from ngram_store import NgramStore
+from stream import STREAM_WINDOW, StreamSession, decode_stream
+import kbest
+
+class PyBeamDecoder:
+    """
+    纯 Python 的 Beam Search，接口与 beam_numpy.NumpyBeamDecoder 一致
+    解码状态是 (score, path, last_id) 列表
+    """
+    def __init__(self, store, fuzzy=None, ngram=None, pruning=None):
+        self.store = store
+        self.fuzzy = fuzzy
+        self.ngram = ngram  # 可选的三元模型 (ngram_store.NgramStore)
+        self.pruning = pruning  # 剪枝档位 (pruning.PruneProfile)，None 为不剪枝
+        self.threshold = pruning.threshold if pruning is not None else None
+        self.min_keep = pruning.min_keep if pruning is not None else 0
+        # 发射表：拼音 -> 候选字 ID；启用模糊音时换成模糊表，emit_pen 给出各候选的扣分
+        src = fuzzy if fuzzy is not None else store
+        self.emit_ids = src.emit_ids
+        self.emit_pen = fuzzy.emit_pen if fuzzy is not None else {}
+        if pruning is not None and pruning.emit_top:
+            # 每个音节只展开排名靠前的字
+            self.emit_ids, self.emit_pen = dict(self.emit_ids), dict(self.emit_pen)
+            for py, keep in cap_emissions(src.emit_ids, src.emit_order, pruning.emit_top).items():
+                ids, pen = src.emit_ids[py], self.emit_pen.get(py)
+                self.emit_ids[py] = [ids[k] for k in keep]
+                if pen: self.emit_pen[py] = [pen[k] for k in keep]
+
+    def start_state(self, py, beam_width=30):
+        store = self.store
+        chars, start_score = store.chars, store.start_score
+        pen = self.emit_pen.get(py)
+        # 路径记录末字 ID，打分直接走整数接口
+        current_paths = []
+        for k, cid in enumerate(self.emit_ids.get(py, ())):
+            score = start_score(cid) - pen[k] if pen else start_score(cid)
+            current_paths.append( (score, chars[cid], cid) )
+        return self._cut(heapq.nlargest(beam_width, current_paths, key=lambda x: x[0]))
+
+    def step(self, state, py, beam_width=30):
+        next_ids = self.emit_ids.get(py)
+        if not next_ids: return state
+        chars, char_ids, score_fn = self.store.chars, self.store.char_ids, self.store.score
+        ngram = self.ngram
+        pen = self.emit_pen.get(py)
+        new_paths = []
+        for prev_score, prev_path, prev_id in state:
+            if ngram is not None and len(prev_path) > 1:
+                tri = ngram.scorer(char_ids[prev_path[-2]], prev_id)
+                new_paths.extend((prev_score + (tri(curr_id) - p), prev_path + chars[curr_id], curr_id)
+                                 for curr_id, p in zip(next_ids, pen or itertools.repeat(0.0)))
+                continue
+            if pen:
+                for curr_id, p in zip(next_ids, pen):
+                    new_paths.append( (prev_score + (score_fn(prev_id, curr_id) - p), prev_path + chars[curr_id], curr_id) )
+                continue
+            for curr_id in next_ids:
+                new_score = prev_score + score_fn(prev_id, curr_id)
+                new_path = prev_path + chars[curr_id]
+                new_paths.append( (new_score, new_path, curr_id) )
+        return self._cut(heapq.nlargest(beam_width, new_paths, key=lambda x: x[0]))
+
+    def merge(self, states, beam_width=30):
+        """ 合并到达同一位置的多个状态 (音节 DAG 中不同切分方式) """
+        paths = [p for state in states if state for p in state]
+        return self._cut(heapq.nlargest(beam_width, paths, key=lambda x: x[0]))
+
+    def _cut(self, paths):
+        """ 阈值剪枝：paths 已按得分降序，去掉比最优低 threshold 以上的路径 (至少保留 min_keep 条) """
+        if self.threshold is None or len(paths) <= self.min_keep: return paths
+        floor = paths[0][0] - self.threshold
+        return paths[:self.min_keep] + [p for p in paths[self.min_keep:] if p[0] >= floor]
+
+    def results(self, state, top_k=5):
+        return [path for score, path, last_char in state[:top_k]]
+
+    # ---------- 流式解码 (stream.py) 用 ----------
+    def survivors(self, state):
+        """ 仍可能成为最终最优路径的项：末两字相同的项中只有得分最高的一项 (状态已按得分降序) """
+        if not state: return []
+        seen, paths = set(), []
+        for score, path, cid in state:
+            key = (cid, path[-2:-1])
+            if key in seen: continue
+            seen.add(key)
+            paths.append(path)
+        return paths
+
+    def rebase(self, state, cut, keep=0):
+        """ 去掉各路径开头的 cut 个字 (至少保留 keep 个，三元模型要用倒数第二个字) """
+        if not state: return state
+        return [(score, path[max(0, min(cut, len(path) - keep)):], cid) for score, path, cid in state]
+
+    def prune(self, state, prefix):
+        """ 只保留以 prefix 开头的路径；没有剩下时返回 None """
+        if not state: return None
+        return [item for item in state if item[1].startswith(prefix)] or None
+
+    def search(self, pinyin_list, top_k=5, beam_width=30):
+        if not pinyin_list: return []
+        state = self.start_state(pinyin_list[0], beam_width)
+        for py in pinyin_list[1:]:
+            state = self.step(state, py, beam_width)
+        return self.results(state, top_k)
+
 
 class HMM_Model:
-    def __init__(self):
+    def __init__(self, cache_capacity=2048, kb_dir=r".\data"):
+        """
+        :param kb_dir: 构造时就加载知识库的目录 (成语、emoji、歇后语等可直接查询)；
+                       之后会调用 load_from_dir() 的调用方传 None，知识库只随语料加载一次
+        """
         self.start_p = {}  
-        self.trans_p = {}  
         self.emit_p = {}   
+        self.bigram = BigramStore()  # 转移概率 (整数ID + CSR)
+        self.ngram = None            # 可选的三元模型，data 目录下有 Trigram.txt 时加载
+        self.use_ngram = True
         self.pinyin_set = set() 
+        self.trie = PinyinTrie()
+        self._abbr_index = None  # 缩写索引，首次用到时或 preload() 的后台线程里构建
+        self._abbr_lock = threading.Lock()
+        # 惰性构建的模糊表与解码器：模型服务的几个解码线程同时用到时只建一次，规则与表成对切换
+        self._lock = threading.RLock()
+        self._abbr_thread = None
+        # 模糊音规则 (默认关闭)，见 set_fuzzy()
+        self.fuzzy_rules = ()
+        self.fuzzy_penalty = FUZZY_PENALTY
+        self._fuzzy = None
         self.min_prob = -100.0 
+        # 剪枝档位 fast / balanced / exact (见 pruning.py)，beam_width 随档位设置
+        self.pruning = PROFILES[DEFAULT_PROFILE]
+        self.beam_width = self.pruning.beam_width
+        # 超过该长度 (字母数) 的输入走流式解码，只给出最优整句，见 stream.py
+        self.stream_threshold = 200
+        # 有 NumPy 时默认使用批量解码，纯 Python 版本作为后备
+        self.use_numpy = NUMPY_AVAILABLE
+        self._np_decoder = None
+        self._py_decoder = None
         
-        # 初始化知识库
-        self.kb = KnowledgeBase()
+        # 候选缓存 (HMM 结果与知识库查表共用)，模型或词典变化时清空
+        self.cache = CandidateCache(cache_capacity)
+        # 热路径埋点，默认关闭 (None)，见 enable_metrics()
+        self.metrics = None
+        # 用户词库 (默认只在内存中学习)，见 load_user_dict()
+        self.user_dict = UserDict()
+        
+        # 初始化知识库；load_from_dir() 会重新加载 (命中编译缓存时不再解析 JSON)
+        self.kb = KnowledgeBase(cache=self.cache)
         # 指定的路径
-        self.plus_data_path = r".\data"
-        if os.path.exists(self.plus_data_path):
-            self.kb.load_data(self.plus_data_path)
+        self.plus_data_path = kb_dir
+        if kb_dir and os.path.exists(kb_dir):
+            self.kb.load_data(kb_dir)
 
-    def load_data(self, pinyin_file, char_file, bigram_file):
-        """ 加载 HMM 语料 """
+    def load_data(self, pinyin_file, char_file, bigram_file, trigram_file=None):
+        """ 加载 HMM 语料 (trigram_file 可选) """
         print("正在加载 HMM 语料...")
         if not os.path.exists(pinyin_file):
             print(f"[Error] 找不到文件: {pinyin_file}")
@@ -48,6 +198,7 @@ class HMM_Model:
         for char, freq in char_count.items():
             self.start_p[char] = math.log(freq / total_count) if total_count else self.min_prob
 
+        trans_p = {}
         if os.path.exists(bigram_file):
             with open(bigram_file, 'r', encoding='gb18030') as f:
                 for line in f:
@@ -57,11 +208,129 @@ class HMM_Model:
                     word, freq = parts[1], int(parts[2])
                     if len(word) != 2: continue
                     prev, curr = word[0], word[1]
-                    if prev not in self.trans_p: self.trans_p[prev] = {}
+                    if prev not in trans_p: trans_p[prev] = {}
                     if prev in char_count and char_count[prev] > 0:
-                        self.trans_p[prev][curr] = math.log(freq / char_count[prev])
+                        trans_p[prev][curr] = math.log(freq / char_count[prev])
+
+        self.bigram = BigramStore.build(self.emit_p, self.start_p, trans_p, self.min_prob)
+        self.trie = PinyinTrie(self.pinyin_set)
+        self._abbr_index = None
+        self.user_dict.bind(self.bigram)
+        self.ngram = None
+        if trigram_file and os.path.exists(trigram_file): self.load_ngram(trigram_file)
+        self.cache.clear()
         print("HMM 语料加载完成！")
 
+    def load_ngram(self, path, discount=None):
+        """ 在当前二元模型之上加载三元组计数文件 (格式同 Bigram.txt) """
+        self.ngram = NgramStore.load(path, self.bigram, discount)
+        self.cache.clear()
+        print(f"三元模型: {len(self.ngram)} 条, {self.ngram.nbytes() / 1024:.0f} KB")
+
+    def set_ngram(self, enabled=True):
+        """ 开关三元模型 (已加载时)；关闭后与纯二元模型的结果完全一致 """
+        self.use_ngram = enabled
+        self.cache.clear()
+
+    def get_ngram(self):
+        if not self.use_ngram or self.ngram is None or self.ngram.store is not self.bigram: return None
+        return self.ngram
+
+    def load_from_dir(self, data_dir, use_cache=True):
+        """
+        加载 data 目录下的全部语料 (HMM + 知识库)
+        优先读取编译缓存 model.cache，源文件变化时自动重建
+        """
+        if use_cache and model_cache.read_cache(self, data_dir):
+            self._abbr_index = None
+            self.user_dict.bind(self.bigram)
+            self.cache.clear()
+            print("已从模型缓存加载")
+            return
+
+        # 指纹在解析之前取：加载期间被改动的源文件下次启动会被发现
+        sources = model_cache.source_fingerprint(data_dir) if use_cache else None
+        self.load_data(
+            os.path.join(data_dir, "pinyin.txt"),
+            os.path.join(data_dir, "CharFreq.txt"),
+            os.path.join(data_dir, "Bigram.txt"),
+            os.path.join(data_dir, "Trigram.txt")
+        )
+        self.kb.load_data(data_dir)
+        self._abbr_index = None
+
+        if use_cache and self.emit_p:
+            try:
+                model_cache.write_cache(self, data_dir, sources=sources)
+            except OSError as e:
+                print(f"[Warn] 写入模型缓存失败: {e}")
+
+    def load_user_dict(self, path):
+        """ 加载 (或新建) 持久化的用户词库，之后的选择会写入 path """
+        self.user_dict.close()
+        self.user_dict = UserDict(path)
+        self.user_dict.bind(self.bigram)
+        self.cache.clear()
+        print(f"用户词库: {len(self.user_dict)} 条")
+
+    def learn(self, pinyin_input, word):
+        """ 用户选择了 word 作为 pinyin_input 的结果 """
+        if not isinstance(pinyin_input, str): pinyin_input = "'".join(pinyin_input)
+        if self.user_dict.learn(pinyin_input, word):
+            # 分数变了，缓存的候选全部作废；解码线程稍后放进来的旧结果带着旧代数，会被缓存丢弃
+            self.cache.clear()
+
+    def preload(self):
+        """ 在后台解析释义表、构建谜面自动机与缩写索引 (界面首次绘制后调用) """
+        self.kb.preload()
+        self._build_abbr_async()
+
+    def get_abbr_index(self, wait=True):
+        """
+        缩写索引 (成语、词语与二元表中的词)，模型或知识库重新加载后重建
+        构建要读完整的释义表，wait=False 时索引未就绪就转到后台构建并返回 None
+        """
+        index = self._abbr_index
+        if index is not None and index.store is self.bigram: return index
+        if not wait:
+            self._build_abbr_async()
+            return None
+        with self._abbr_lock:
+            index = self._abbr_index
+            if index is None or index.store is not self.bigram:
+                words = itertools.chain(self.kb.phrases(), self.bigram.words())
+                index = self._abbr_index = AbbrIndex.build(self.bigram, self.trie, self.emit_p, words)
+        return index
+
+    def _build_abbr_async(self):
+        if self._abbr_thread is not None and self._abbr_thread.is_alive(): return
+        self._abbr_thread = threading.Thread(target=self.get_abbr_index, daemon=True)
+        self._abbr_thread.start()
+
+    def get_abbreviations(self, text, top_k=5, wait=True, session=None):
+        """
+        首字母 / 部分缩写 / 完整音节与声母混用的输入 (szd, shouzd, zgr)
+        输入能完整切分为音节时不查，交给 HMM；走流式解码的超长输入也不查 (不会是缩写)
+        wait=False 时索引还在后台构建就先不给缩写结果 (也不缓存)，不让首个按键等释义表解析
+        给出 session 时从上一次输入的公共前缀续算，逐键输入不必每次从头拼接
+        """
+        generation = self.cache.generation
+        text = text.replace(" ", "").lower()
+        if not text or not text.isascii() or self._is_long(text) or self.lattice_trie().covers(text): return ()
+        key = ('abbr', text, top_k)
+        words = self.cache.get(key)
+        if words is not None: return words
+        index = self.get_abbr_index(wait)
+        if index is None: return ()
+        if session is None:
+            found = index.lookup(text, top_k)
+        else:
+            if session.abbr is None or session.abbr.index is not index: session.abbr = AbbrLookup(index)
+            found = session.abbr.update(text).results(top_k)
+        words = tuple(word for score, word in found)
+        self.cache.put(key, words, generation)
+        return words
+
     def split_pinyin(self, text):
         res = []
         i = 0
@@ -81,41 +350,108 @@ class HMM_Model:
         return res
 
     def get_trans_score(self, prev_char, curr_char):
-        if prev_char in self.trans_p and curr_char in self.trans_p[prev_char]:
-            return self.trans_p[prev_char][curr_char]
+        ids = self.bigram.char_ids
+        if prev_char in ids and curr_char in ids:
+            p = self.bigram.lookup(ids[prev_char], ids[curr_char])
+            if p is not None: return p
+        if self.metrics is not None: self.metrics.count("trans_fallbacks")
         return self.start_p.get(curr_char, self.min_prob) - 8.0 
 
-    def beam_search(self, pinyin_list, top_k=5):
-        if not pinyin_list: return []
-        BEAM_WIDTH = 30 
-        first_py = pinyin_list[0]
-        first_chars = self.emit_p.get(first_py, [])
-        
-        current_paths = []
-        for char in first_chars:
-            score = self.start_p.get(char, self.min_prob)
-            current_paths.append( (score, char, char) )
-        current_paths = heapq.nlargest(BEAM_WIDTH, current_paths, key=lambda x: x[0])
-
-        for i in range(1, len(pinyin_list)):
-            next_py = pinyin_list[i]
-            next_chars = self.emit_p.get(next_py, [])
-            if not next_chars: continue 
-            new_paths = []
-            for prev_score, prev_path, prev_char in current_paths:
-                for curr_char in next_chars:
-                    trans = self.get_trans_score(prev_char, curr_char)
-                    new_score = prev_score + trans
-                    new_path = prev_path + curr_char
-                    new_paths.append( (new_score, new_path, curr_char) )
-            current_paths = heapq.nlargest(BEAM_WIDTH, new_paths, key=lambda x: x[0])
-
-        return [path for score, path, last_char in current_paths[:top_k]]
-
-    def get_top_candidates(self, pinyin_input, top_k=5):
-        """
-        获取候选词：成语速录 > HMM计算
+    def enable_metrics(self, log_interval=None):
+        """
+        开启热路径埋点，返回 Metrics 对象
+        metrics.stats() 查看统计，metrics.profile_next(n) 对接下来 n 次调用做 cProfile
+        """
+        if self.metrics is None:
+            self.metrics = Metrics(log_interval)
+        else:
+            self.metrics.log_interval = log_interval
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def set_fuzzy(self, rules=ALL_RULES, penalty=FUZZY_PENALTY):
+        """
+        启用模糊音，例如 set_fuzzy(["z/zh", "n/l"])；传入空序列关闭
+        :param penalty: 每替换一处扣的对数概率
+        """
+        unknown = set(rules) - set(ALL_RULES)
+        if unknown: raise ValueError(f"未知的模糊音规则: {sorted(unknown)}")
+        with self._lock:
+            self.fuzzy_rules = tuple(rules)
+            self.fuzzy_penalty = penalty
+            self._fuzzy = None
+        self.cache.clear()
+
+    def get_fuzzy(self):
+        """ 当前规则下的模糊发射表，未启用时为 None """
+        if not self.fuzzy_rules: return None
+        fuzzy = self._fuzzy
+        if fuzzy is not None and fuzzy.store is self.bigram: return fuzzy
+        with self._lock:
+            if not self.fuzzy_rules: return None
+            if self._fuzzy is None or self._fuzzy.store is not self.bigram:
+                self._fuzzy = FuzzyTable(self.bigram, self.fuzzy_rules, self.fuzzy_penalty)
+            return self._fuzzy
+
+    def set_pruning(self, profile=DEFAULT_PROFILE):
+        """ 切换剪枝档位："fast" / "balanced" / "exact" 或 pruning.PruneProfile """
+        if isinstance(profile, str): profile = PROFILES[profile]
+        self.pruning = profile
+        self.beam_width = profile.beam_width
+        self.cache.clear()
+
+    def lattice_trie(self):
+        """ 切分音节 DAG 用的字典树：启用模糊音时包含所有模糊写法 """
+        fuzzy = self.get_fuzzy()
+        return fuzzy.trie if fuzzy is not None else self.trie
+
+    def emission(self):
+        """ (拼音 -> 候选字 ID, 拼音 -> 各候选扣分)，与 Beam Search 一样按剪枝档位的 emit_top 截断 """
+        if self.pruning.emit_top:
+            decoder = self.get_decoder(use_numpy=False)
+            return decoder.emit_ids, decoder.emit_pen
+        fuzzy = self.get_fuzzy()
+        if fuzzy is not None: return fuzzy.emit_ids, fuzzy.emit_pen
+        return self.bigram.emit_ids, {}
+
+    def get_decoder(self, use_numpy=None):
+        """ 返回当前使用的 Beam 解码器 (NumPy 批量版或纯 Python 版)，开启埋点时返回其包装 """
+        if use_numpy is None: use_numpy = self.use_numpy
+        with self._lock:
+            fuzzy = self.get_fuzzy()
+            ngram = self.get_ngram()
+            pruning = self.pruning
+            if use_numpy and NUMPY_AVAILABLE:
+                # 解码器缓存的是当前 BigramStore 的数组视图，模型重新加载、模糊音规则、三元模型或剪枝档位变化后重建
+                d = self._np_decoder
+                if d is None or d.store is not self.bigram or d.fuzzy is not fuzzy or d.ngram is not ngram or d.pruning is not pruning:
+                    self._np_decoder = NumpyBeamDecoder(self.bigram, fuzzy, ngram, pruning)
+                decoder = self._np_decoder
+            else:
+                d = self._py_decoder
+                if d is None or d.store is not self.bigram or d.fuzzy is not fuzzy or d.ngram is not ngram or d.pruning is not pruning:
+                    self._py_decoder = PyBeamDecoder(self.bigram, fuzzy, ngram, pruning)
+                decoder = self._py_decoder
+        if self.metrics is not None: return self.metrics.wrap_decoder(decoder)
+        return decoder
+
+    def beam_search(self, pinyin_list, top_k=5, use_numpy=None):
+        return self.get_decoder(use_numpy).search(pinyin_list, top_k, self.beam_width)
+
+    def beam_search_py(self, pinyin_list, top_k=5):
+        """ 纯 Python 实现，无 NumPy 时使用 """
+        return PyBeamDecoder(self.bigram, pruning=self.pruning).search(pinyin_list, top_k, self.beam_width)
+
+    def get_top_candidates(self, pinyin_input, top_k=5, session=None, search="beam"):
         """
+        获取候选词：用户词库 > 成语速录 > 缩写索引 > HMM计算
+        :param session: 可选的 DecodeSession，逐键输入时复用上一次的解码前缀
+        :param search: "beam" 定宽 Beam Search；"exact" 精确 k-best (不受 beam 宽度限制，启用三元模型时改走 Beam Search)
+        """
+        m = self.metrics
+        if m is not None: m.begin()
         final_results = []
         
         # 检查成语速录 (Feature: szdt -> 守株待兔)
@@ -126,40 +462,212 @@ class HMM_Model:
         elif isinstance(pinyin_input, str):
             raw_input = pinyin_input.replace(" ", "")
             
+        # 用户学过的词直接命中，排在最前
+        final_results.extend(self.user_dict.lookup(raw_input))
         idiom_match = self.kb.get_idiom(raw_input)
-        if idiom_match:
+        if idiom_match and idiom_match not in final_results:
             final_results.append(idiom_match)
+        # 缩写输入 HMM 只能丢掉认不出的字母，索引结果排在它前面
+        for word in self.get_abbreviations(raw_input, top_k, session=session):
+            if word not in final_results: final_results.append(word)
+        if m is not None: m.lap("knowledge")
 
         # 运行 HMM 
+        hmm_res = self._hmm_candidates(pinyin_input, top_k, session, search)
+            
+        # 合并结果，去重
+        for res in hmm_res:
+            if res not in final_results:
+                final_results.append(res)
+
+        if m is not None:
+            m.lap("dedupe")
+            m.end()
+        return final_results[:top_k]
+
+    def _hmm_candidates(self, pinyin_input, top_k, session=None, search="beam"):
+        """
+        字符串输入在音节 DAG 上联合解码，由概率而不是贪心决定切分
+        已切分好的音节列表直接走 Beam Search
+        """
+        m = self.metrics
+        # 在读模型状态之前取缓存代数：解码期间模糊音、剪枝档位、三元模型或词库变化 (都会 clear())，结果不会被缓存
+        generation = self.cache.generation
+        version = self.bigram.user_version
+        if self._is_long(pinyin_input):
+            key = ('stream', pinyin_input, self.beam_width, version)
+            hmm_res = self.cache.get(key)
+            if hmm_res is None:
+                if session is None:
+                    hmm_res = ("".join(decode_stream(self, [pinyin_input])),)
+                else:
+                    # 逐键输入：会话里保留流式解码状态，每次只喂入新追加的字母
+                    if session.stream is None: session.stream = StreamSession(self)
+                    hmm_res = (session.stream.update(pinyin_input),)
+                self.cache.put(key, hmm_res, generation)
+            if m is not None: m.lap("decode")
+            return hmm_res
+
+        if self._search_mode(search) == "exact":
+            key = ('exact', pinyin_input if isinstance(pinyin_input, str) else tuple(pinyin_input), top_k, version)
+            hmm_res = self.cache.get(key)
+            if hmm_res is None:
+                hmm_res = tuple(itertools.islice(self.iter_exact(pinyin_input, session), top_k))
+                self.cache.put(key, hmm_res, generation)
+            elif m is not None:
+                m.count("cache_hits")
+            if m is not None: m.lap("decode")
+            return hmm_res
+
         if isinstance(pinyin_input, str):
-            if ' ' in pinyin_input:
-                py_list = pinyin_input.split()
-            else:
-                py_list = self.split_pinyin(pinyin_input)
+            lattice = session if session is not None else DecodeSession(self)
+            text = lattice.update(pinyin_input)
+            if m is not None: m.lap("segment")
+            if not text: return ()
+            key = ('hmm', text, top_k, self.beam_width, version)
+        else:
+            if not pinyin_input: return ()
+            key = ('hmm', tuple(pinyin_input), top_k, self.beam_width, version)
+
+        hmm_res = self.cache.get(key)
+        if hmm_res is not None:
+            if m is not None: m.count("cache_hits")
+            return hmm_res
+
+        if isinstance(pinyin_input, str):
+            single = lattice.single_syllable()
+            hmm_res = self._single_syllable(single, top_k) if single else lattice.candidates(top_k)
+        elif len(pinyin_input) == 1:
+            hmm_res = self._single_syllable(pinyin_input[0], top_k)
         else:
-            py_list = pinyin_input
+            hmm_res = self.beam_search(pinyin_input, top_k)
+        hmm_res = tuple(hmm_res)
+        if m is not None: m.lap("decode")
+        self.cache.put(key, hmm_res, generation)
+        return hmm_res
 
-        if py_list:
-            if len(py_list) == 1:
-                chars = self.emit_p.get(py_list[0], [])
-                sorted_chars = sorted(chars, key=lambda c: self.start_p.get(c, self.min_prob), reverse=True)
-                hmm_res = sorted_chars[:top_k]
+    def iter_candidates(self, pinyin_input, session=None, search="exact"):
+        """
+        惰性候选流：用户词库 > 成语 > Emoji > 缩写 > HMM，边产出边去重
+        search="exact" 时 HMM 部分按得分逐个枚举，调用方不继续取用就不会计算后面的候选
+        缩写索引尚未建好时先跳过缩写 (交给后台构建)，首个按键不等释义表解析
+        开启埋点时一次调用从第一次取候选计到产出第一个 HMM 候选 (或候选流结束) 为止
+        """
+        m = self.metrics
+        if m is not None: m.begin()
+        timing = m is not None
+        try:
+            if isinstance(pinyin_input, str):
+                raw_input = pinyin_input.replace(" ", "")
             else:
-                hmm_res = self.beam_search(py_list, top_k)
-            
-            # 合并结果，去重
-            for res in hmm_res:
-                if res not in final_results:
-                    final_results.append(res)
+                raw_input = "".join(pinyin_input)
 
-        return final_results[:top_k]
+            seen = set()
+            lookups = self.user_dict.lookup(raw_input) + [self.kb.get_idiom(raw_input), self.kb.get_emoji(raw_input)]
+            if timing: m.lap("knowledge")
+            abbrs = self.get_abbreviations(raw_input, wait=False, session=session)
+            if timing: m.lap("abbreviation")
+            for word in itertools.chain(lookups, abbrs):
+                if word and word not in seen:
+                    seen.add(word)
+                    yield word
+
+            search = self._search_mode(search)
+            if search == "exact" and not self._is_long(pinyin_input):
+                hmm_res = self.iter_exact(pinyin_input, session)
+            else:
+                hmm_res = self._hmm_candidates(pinyin_input, self.beam_width, session, search)
+            for word in hmm_res:
+                if timing:
+                    # iter_exact 在前面记过 segment / forward，这里是反向枚举出第一个候选的时间
+                    m.lap("backward" if search == "exact" else "decode")
+                    m.end()
+                    timing = False
+                if word not in seen:
+                    seen.add(word)
+                    yield word
+            if timing:
+                m.end()
+                timing = False
+        finally:
+            # 调用方没取到 HMM 候选就丢弃了候选流，这次不计入
+            if timing: m.cancel()
+
+    def _search_mode(self, search):
+        """
+        精确 k-best 的状态是单个字，只能按二元模型打分；启用三元模型时改走 Beam Search，
+        界面 (默认 search="exact") 的候选同样用上三元模型
+        """
+        if search == "exact" and self.get_ngram() is not None: return "beam"
+        return search
+
+    def _is_long(self, pinyin_input):
+        return isinstance(pinyin_input, str) and len(pinyin_input) > self.stream_threshold
+
+    def decode_stream(self, chunks, window=STREAM_WINDOW):
+        """
+        流式转换超长拼音：chunks 为文本片段的可迭代对象 (字符串本身也可以)，逐段产出已确定的汉字
+        例如 "".join(model.decode_stream(open("long.txt")))
+        """
+        if isinstance(chunks, str): chunks = [chunks]
+        return decode_stream(self, chunks, window)
 
-    def get_associations(self, last_char, top_k=5):
-        if last_char not in self.trans_p: return []
-        next_chars = self.trans_p[last_char]
-        sorted_chars = sorted(next_chars.items(), key=lambda x: x[1], reverse=True)
-        return [char for char, prob in sorted_chars[:top_k]]
+    def iter_exact(self, pinyin_input, session=None):
+        """
+        精确 k-best：按得分从高到低惰性产出 HMM 候选
+        只计算调用方实际取到的那些路径，适合翻页时按需取用
+        """
+        if not isinstance(pinyin_input, str): pinyin_input = "'".join(pinyin_input)
+        lattice = session if session is not None else DecodeSession(self)
+        lattice.update(pinyin_input)
+        if self.metrics is not None: self.metrics.lap("segment")
+        single = lattice.single_syllable()
+        if single:
+            yield from self._single_syllable(single, self.pruning.emit_top)
+            return
+        for score, cand in kbest.iter_exact(self, lattice):
+            yield cand
+
+    def _single_syllable(self, pinyin, top_k):
+        """ 单音节：候选字已在加载时按 (初始概率 - 模糊音扣分) 排好序，直接取前 top_k 个 """
+        fuzzy = self.get_fuzzy()
+        src = fuzzy if fuzzy is not None else self.bigram
+        ids = src.emit_ids.get(pinyin)
+        if not ids: return []
+        chars = self.bigram.chars
+        return [chars[ids[k]] for k in src.emit_order[pinyin][:top_k]]
+
+    def get_associations(self, context, top_k=5):
+        """
+        联想：context 是刚上屏的字、词或光标前的若干字
+        有三元模型时先按末两字联想，再用末字的二元联想补足；后继在加载时已按概率排好，只取前 top_k 个
+        """
+        store = self.bigram
+        ids = store.char_ids
+        if not context or context[-1] not in ids: return []
+        last = ids[context[-1]]
+        result = []
+        ngram = self.get_ngram()
+        if ngram is not None and len(context) >= 2 and context[-2] in ids:
+            result = ngram.associations(ids[context[-2]], last, top_k)
+        if len(result) < top_k:
+            seen = set(result)
+            result.extend(c for c in store.associations(last, top_k + len(result)) if c not in seen)
+        return [store.chars[c] for c in result[:top_k]]
     
     # 歇后语接口
     def get_xiehouyu_answer(self, text):
-        return self.kb.get_xiehouyu(text)
\ No newline at end of file
+        """ 以 text 结尾的歇后语谜面的答案 """
+        return self.kb.get_xiehouyu(text)
+
+    def riddle_scanner(self, wait=True):
+        """
+        逐段喂入上屏文字的谜面匹配器，谜面输完时 feed() 返回 [(结束位置, 谜面, 答案)]
+        wait=False 时自动机还在后台构建就返回 None
+        """
+        return self.kb.riddle_scanner(wait)
+
+# 命令行批量转换: python main.py input.txt output.txt [-r answer.txt]
+if __name__ == "__main__":
+    import batch
+    batch.main()
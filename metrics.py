@@ -0,0 +1,226 @@
+import time
+import cProfile
+import pstats
+import threading
+from collections import deque
+
+# 热路径埋点：各阶段耗时、Beam 规模、打分次数、回退次数，可选 cProfile 采集
+# HMM_Model.metrics 默认为 None，此时热路径上只多几次 `is not None` 判断；
+# 调用 HMM_Model.enable_metrics() 后才开始记录。
+#
+# 一次调用 = get_top_candidates() 的一次执行，或 iter_candidates() 候选流从开始到产出第一个 HMM 候选
+# (界面逐键输入与模型服务的 cand 请求走这里)：begin() ... lap(阶段) ... end()
+# 阶段计时采用“分段计时”：lap(name) 把上一次打点到现在的时间记在 name 名下。
+
+
+def _beam_size(state):
+    """ 兼容两种解码器的状态：纯 Python 版为列表，NumPy 版为 (scores, ids, node) """
+    if state is None: return 0
+    if isinstance(state, tuple): return state[0].shape[0]
+    return len(state)
+
+
+def _beam_ids(state):
+    if state is None: return []
+    if isinstance(state, tuple): return state[1].tolist()
+    return [x[2] for x in state]
+
+
+class InstrumentedDecoder:
+    """ 包装 Beam 解码器，记录每步扩展的耗时、Beam 规模、打分次数与回退次数 """
+    def __init__(self, decoder, metrics):
+        self.decoder = decoder
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        # store / emit_ids / trans_block 等属性直接转给被包装的解码器
+        return getattr(self.decoder, name)
+
+    def _expanded(self, py):
+        """ 本步实际展开的候选字：剪枝档位截断后的发射表 (NumPy 版为 beam_ids，纯 Python 版的 emit_ids 已截断) """
+        decoder = self.decoder
+        emit = getattr(decoder, "beam_ids", decoder.emit_ids)
+        return emit.get(py, ())
+
+    def _fallbacks(self, state, py):
+        """ 本步 (从 state 展开) 打分的 (前驱, 候选) 对数，及其中没有二元概率、走回退的对数 """
+        store = self.decoder.store
+        cand = self._expanded(py)
+        if not len(cand): return 0, 0
+        cand = set(cand.tolist() if hasattr(cand, "tolist") else cand)
+        prev_ids = _beam_ids(state)
+        found = 0
+        for pid in prev_ids:
+            lo, hi = store.offsets[pid], store.offsets[pid + 1]
+            found += len(cand.intersection(store.succ[lo:hi]))
+        scored = len(prev_ids) * len(cand)
+        return scored, scored - found
+
+    def start_state(self, py, beam_width=30):
+        t = time.perf_counter()
+        state = self.decoder.start_state(py, beam_width)
+        self.metrics.record_step(time.perf_counter() - t, _beam_size(state), len(self._expanded(py)), 0)
+        return state
+
+    def step(self, state, py, beam_width=30):
+        t = time.perf_counter()
+        new_state = self.decoder.step(state, py, beam_width)
+        elapsed = time.perf_counter() - t
+        # 回退统计在计时之外进行，不计入步耗时；没有可展开的候选时解码器原样返回，不算打分
+        scored, fallbacks = self._fallbacks(state, py) if new_state is not state else (0, 0)
+        self.metrics.record_step(elapsed, _beam_size(new_state), scored, fallbacks)
+        return new_state
+
+    def merge(self, states, beam_width=30):
+        return self.decoder.merge(states, beam_width)
+
+    def results(self, state, top_k=5):
+        return self.decoder.results(state, top_k)
+
+    def search(self, pinyin_list, top_k=5, beam_width=30):
+        if not pinyin_list: return []
+        state = self.start_state(pinyin_list[0], beam_width)
+        for py in pinyin_list[1:]:
+            state = self.step(state, py, beam_width)
+        return self.results(state, top_k)
+
+
+class Metrics:
+    def __init__(self, log_interval=None, history=1024):
+        """
+        :param log_interval: 每隔多少秒把统计打印一次 (None 不打印)
+        :param history: 保留最近多少次调用的总耗时，用于计算分位数
+        """
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()  # GUI 主线程和解码线程各自分段计时
+        self._decoders = {}  # 解码器类型 -> 当前解码器的包装 (旧解码器重建后即被替换，不再被引用)
+        self._latencies = deque(maxlen=history)
+        self._last_log = time.perf_counter()
+        self._profiler = None
+        self._profile_left = 0
+        self._profile_path = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.total_time = 0.0
+            self.stages = {}     # 阶段 -> [次数, 累计秒]
+            self.counters = {}   # 计数器 -> 值
+            self.steps = 0
+            self.step_time = 0.0
+            self.beam_total = 0
+            self.beam_max = 0
+            self.scored = 0
+            self.fallbacks = 0
+            self._latencies.clear()
+
+    # ---------- 由 HMM_Model 调用 ----------
+    def begin(self):
+        now = time.perf_counter()
+        self._local.start = self._local.last = now
+        if self._profile_left > 0 and self._profiler is not None:
+            self._profiler.enable()
+
+    def lap(self, stage):
+        last = getattr(self._local, "last", None)
+        if last is None: return  # 不在一次计时调用之内 (例如 iter_candidates)
+        now = time.perf_counter()
+        self._local.last = now
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None: entry = self.stages[stage] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += now - last
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def end(self):
+        start = getattr(self._local, "start", None)
+        if start is None: return
+        now = time.perf_counter()
+        self._local.start = self._local.last = None
+        if self._profile_left > 0 and self._profiler is not None:
+            self._profiler.disable()
+            self._profile_left -= 1
+            if self._profile_left == 0: self._finish_profile()
+        with self._lock:
+            self.calls += 1
+            self.total_time += now - start
+            self._latencies.append(now - start)
+        if self.log_interval is not None and now - self._last_log >= self.log_interval:
+            self._last_log = now
+            self.dump()
+
+    def cancel(self):
+        """ 放弃当前线程上未结束的一次调用 (不计入统计) """
+        if getattr(self._local, "start", None) is None: return
+        self._local.start = self._local.last = None
+        if self._profile_left > 0 and self._profiler is not None: self._profiler.disable()
+
+    def record_step(self, elapsed, beam, scored, fallbacks):
+        with self._lock:
+            self.steps += 1
+            self.step_time += elapsed
+            self.beam_total += beam
+            if beam > self.beam_max: self.beam_max = beam
+            self.scored += scored
+            self.fallbacks += fallbacks
+
+    def wrap_decoder(self, decoder):
+        """ 同一解码器总是返回同一个包装对象，DecodeSession 据此判断状态是否可复用 """
+        kind = type(decoder)
+        wrapped = self._decoders.get(kind)
+        if wrapped is None or wrapped.decoder is not decoder:
+            wrapped = self._decoders[kind] = InstrumentedDecoder(decoder, self)
+        return wrapped
+
+    # ---------- 性能剖析 ----------
+    def profile_next(self, calls, path=None):
+        """
+        对接下来的 calls 次调用开启 cProfile
+        结束后写入 path (可用 pstats / snakeviz 查看)，未指定时打印耗时最多的函数
+        """
+        self._profiler = cProfile.Profile()
+        self._profile_path = path
+        self._profile_left = calls
+
+    def _finish_profile(self):
+        profiler, self._profiler = self._profiler, None
+        if self._profile_path:
+            profiler.dump_stats(self._profile_path)
+            print(f"[Metrics] 性能剖析结果已写入 {self._profile_path}")
+        else:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+    # ---------- 查询 ----------
+    def stats(self):
+        with self._lock:
+            lat = sorted(self._latencies)
+            pick = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else 0.0
+            return {
+                "calls": self.calls,
+                "avg_ms": self.total_time / self.calls * 1000 if self.calls else 0.0,
+                "p50_ms": pick(0.50),
+                "p95_ms": pick(0.95),
+                "p99_ms": pick(0.99),
+                "stages_ms": {name: total * 1000 for name, (n, total) in self.stages.items()},
+                "stage_calls": {name: n for name, (n, total) in self.stages.items()},
+                "steps": self.steps,
+                "step_ms": self.step_time * 1000,
+                "avg_beam": self.beam_total / self.steps if self.steps else 0.0,
+                "max_beam": self.beam_max,
+                "scored": self.scored,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": self.fallbacks / self.scored if self.scored else 0.0,
+                "counters": dict(self.counters),
+            }
+
+    def dump(self):
+        s = self.stats()
+        stages = " ".join(f"{name}={ms:.1f}ms" for name, ms in s["stages_ms"].items())
+        print(f"[Metrics] 调用 {s['calls']} 次 | 平均 {s['avg_ms']:.2f}ms p95 {s['p95_ms']:.2f}ms | {stages} | "
+              f"扩展 {s['steps']} 步 平均 beam {s['avg_beam']:.1f} | 打分 {s['scored']} 回退 {s['fallback_rate']:.1%}")
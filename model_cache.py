@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import marshal
+import hashlib
+from bigram_store import BigramStore
+from ngram_store import NgramStore
+from pinyin_trie import PinyinTrie
+
+# 编译缓存：把 HMM 语料和知识库词典一次性写成二进制文件，启动时直接映射读取
+# 文件布局: MAGIC | 版本号 | 头部长度 | 头部(JSON, 源文件指纹与分段表) | 数据段(marshal) | 数组段
+# 数组段保存 BigramStore (及可选的 NgramStore，名称加 "ngram." 前缀) 的原始字节 (8 字节对齐)，加载时以 memoryview 直接引用映射内存
+# 知识库各词典是共用一个字符串池的 PackedDict，池与编号数组同样成段 (名称加 "kb." 前缀)，映射后直接查询
+MAGIC = b"SIME"
+CACHE_VERSION = 7
+CACHE_NAME = "model.cache"
+
+HMM_SOURCES = ["pinyin.txt", "CharFreq.txt", "Bigram.txt", "Trigram.txt"]
+KB_SOURCES = ["idiom.json", "xiehouyu.json", "ci.json", "word.json", "emoji.json"]
+
+_HEAD = struct.Struct("<4sII")
+HEADER_SLACK = 256  # 头部预留的空白，源文件被 touch 后原地改写指纹时够用
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_fingerprint(data_dir, with_hash=True):
+    """ 记录每个源文件的大小、修改时间和哈希；不存在的文件记为 None """
+    result = {}
+    for name in HMM_SOURCES + KB_SOURCES:
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            result[name] = None
+            continue
+        st = os.stat(path)
+        result[name] = {
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "sha1": _file_hash(path) if with_hash else None,
+        }
+    return result
+
+
+def _is_fresh(saved, data_dir):
+    """
+    先比较 mtime/size，对不上时再算哈希（文件只是被 touch 过也算有效）
+    :return: (是否有效, 哈希对上但 mtime 变了的 {文件名: 新 mtime})
+    """
+    current = source_fingerprint(data_dir, with_hash=False)
+    if set(saved) != set(current): return False, None
+    touched = {}
+    for name, info in current.items():
+        old = saved[name]
+        if info is None or old is None:
+            if info is not old: return False, None
+            continue
+        if info["size"] != old["size"]: return False, None
+        if info["mtime"] != old["mtime"]:
+            if _file_hash(os.path.join(data_dir, name)) != old["sha1"]: return False, None
+            touched[name] = info["mtime"]
+    return True, touched
+
+
+def _restamp(cache_path, header, header_len, touched):
+    """ 把被 touch 过的源文件的新 mtime 原地写回头部，下次启动不必再算哈希；放不下时保持原样 """
+    for name, mtime in touched.items():
+        header["sources"][name]["mtime"] = mtime
+    raw = json.dumps(header).encode('utf-8')
+    if len(raw) > header_len: return
+    try:
+        with open(cache_path, 'r+b') as f:
+            f.seek(_HEAD.size)
+            f.write(raw + b" " * (header_len - len(raw)))
+    except OSError as e:
+        print(f"[Warn] 更新模型缓存指纹失败: {e}")
+
+
+def write_cache(model, data_dir, cache_path=None, sources=None):
+    """
+    把已加载的模型（含知识库）写入缓存文件
+    :param sources: 加载之前取的 source_fingerprint()；加载期间源文件被改动时，缓存不会被当成新的
+    """
+    cache_path = cache_path or os.path.join(data_dir, CACHE_NAME)
+    if sources is None: sources = source_fingerprint(data_dir)
+    kb = model.kb
+    bigram_meta, arrays = model.bigram.to_payload()
+    ngram_meta = None
+    if model.ngram is not None:
+        ngram_meta, ngram_arrays = model.ngram.to_payload()
+        arrays.update(("ngram." + name, arr) for name, arr in ngram_arrays.items())
+    kb_meta, kb_arrays = kb.to_payload()
+    arrays.update(("kb." + name, arr) for name, arr in kb_arrays.items())
+    payload = {
+        "emit_p": model.emit_p,
+        "start_p": model.start_p,
+        "bigram": bigram_meta,
+        "ngram": ngram_meta,
+        "kb": kb_meta,
+    }
+    body = marshal.dumps(payload)
+
+    # 分段偏移相对于数据段起点，因此头部长度不影响它们
+    sections = {}
+    blobs = []
+    pos = len(body)
+    for name, arr in arrays.items():
+        pad = -pos % 8
+        raw = arr.tobytes()
+        blobs.append(b"\0" * pad + raw)
+        pos += pad
+        sections[name] = [pos, len(raw)]
+        pos += len(raw)
+    header = json.dumps({"sources": sources, "sections": sections}).encode('utf-8')
+    header += b" " * (HEADER_SLACK + -(_HEAD.size + len(header) + HEADER_SLACK) % 8)
+
+    # 先写临时文件再替换，避免并发启动时读到半截缓存
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEAD.pack(MAGIC, CACHE_VERSION, len(header)))
+        f.write(header)
+        f.write(body)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def read_cache(model, data_dir, cache_path=None):
+    """
+    从缓存文件恢复模型
+    :return: True 表示命中；缓存缺失、版本不符或源文件已变化时返回 False
+    """
+    cache_path = cache_path or os.path.join(data_dir, CACHE_NAME)
+    if not os.path.exists(cache_path): return False
+
+    mm = view = None
+    try:
+        with open(cache_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = _HEAD.unpack_from(mm, 0)
+        if magic != MAGIC or version != CACHE_VERSION:
+            mm.close()
+            return False
+        start = _HEAD.size
+        header = json.loads(bytes(mm[start:start + header_len]).decode('utf-8'))
+        fresh, touched = _is_fresh(header["sources"], data_dir)
+        if not fresh:
+            mm.close()
+            return False
+        if touched: _restamp(cache_path, header, header_len, touched)
+
+        base = start + header_len
+        view = memoryview(mm)
+        payload = marshal.loads(view[base:])
+        buffers = {name: view[base + off:base + off + size] for name, (off, size) in header["sections"].items()}
+    except (OSError, ValueError, TypeError, EOFError, KeyError, struct.error) as e:
+        print(f"[Warn] 读取模型缓存失败: {e}")
+        # 映射不关掉的话 (Windows 上) 之后无法重写缓存文件
+        if view is not None: view.release()
+        if mm is not None: mm.close()
+        return False
+
+    model.emit_p = payload["emit_p"]
+    model.start_p = payload["start_p"]
+    model.pinyin_set = set(model.emit_p)
+    model.trie = PinyinTrie(model.pinyin_set)
+    # 数组直接引用映射内存，mmap 随模型存活
+    model.bigram = BigramStore.from_payload(payload["bigram"], buffers)
+    model.ngram = None
+    if payload["ngram"] is not None:
+        ngram_buffers = {name[6:]: buf for name, buf in buffers.items() if name.startswith("ngram.")}
+        model.ngram = NgramStore.from_payload(model.bigram, payload["ngram"], ngram_buffers)
+    model._cache_mmap = mm
+    kb_buffers = {name[3:]: buf for name, buf in buffers.items() if name.startswith("kb.")}
+    model.kb.load_payload(payload["kb"], kb_buffers)
+    return True
+
+
+# 编译命令: python model_cache.py [data目录]
+if __name__ == "__main__":
+    import time
+    from main import HMM_Model
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    t0 = time.perf_counter()
+    model = HMM_Model(kb_dir=None)
+    sources = source_fingerprint(data_dir)
+    model.load_from_dir(data_dir, use_cache=False)
+    path = write_cache(model, data_dir, sources=sources)
+    print(f"已生成 {path} ({os.path.getsize(path) / 1024:.0f} KB), 用时 {time.perf_counter() - t0:.3f}s")
@@ -0,0 +1,465 @@
+import os
+import json
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import itertools
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from session import DecodeSession
+
+# 本机共享模型服务：一个进程加载模型与知识库，GUI 和脚本经本地套接字查询，不必各自再加载一份
+#
+#   python model_server.py                 在默认地址启动 (POSIX 为 Unix 套接字，其余系统为 127.0.0.1:47321)
+#   python model_server.py -a 127.0.0.1:9000
+#   python gui.py --server                 GUI 改用服务端的模型 (连不上时退回本地加载)
+#
+# 协议：每行一个 UTF-8 JSON 数组
+#   请求 ["操作", 参数...]        响应 [0, 结果] 或 [1, "错误信息"]
+# 同一连接上的响应严格按请求顺序返回，客户端可以不等响应连续发送请求 (流水线)；
+# 服务端把一次读到的完整请求依次处理，连续的响应合并成一次写出。
+# 所有连接由一个 asyncio 事件循环服务：查表类请求 (用户词库、成语、Emoji、联想) 在循环线程上直接执行，
+# 解码类请求 (候选、释义、歇后语) 交给线程池，一个客户端的长句解码不会卡住其他连接；
+# 学习也在线程池中执行，并与解码互斥 (解码之间共享模型)。
+# 每个连接的请求仍逐个处理 (前一个完成才开始下一个)，响应顺序不变；每个连接有自己的逐键解码会话与候选流。
+
+DEFAULT_PORT = 47321
+MAX_REQUEST = 1 << 20    # 单个请求的最大字节数，超出即断开
+CAND_BATCH = 16          # 客户端候选流每次向服务端取的条数
+BACKLOG = 1024           # 监听队列长度，大量客户端同时连接时不被拒绝
+MAX_PENDING = 1024       # 单个连接已收到未处理的请求数上限，超出时暂停读取
+DECODE_WORKERS = 4       # 执行解码类请求的线程数
+# 可能耗时的操作，在线程池中执行 (首次查释义、构建谜面自动机也可能要等后台加载)
+BLOCKING_OPS = {"top", "cand", "more", "def", "xhy", "riddle"}
+# 修改模型的操作，同样在线程池中执行，且与解码互斥 (见 _ModelLock)
+EXCLUSIVE_OPS = {"learn"}
+JOB_BATCH = 16           # 一次交给线程池的连续解码类请求数上限
+
+
+def default_address():
+    if hasattr(socket, "AF_UNIX"):
+        uid = os.getuid() if hasattr(os, "getuid") else 0
+        return os.path.join(tempfile.gettempdir(), f"smartime-{uid}.sock")
+    return f"127.0.0.1:{DEFAULT_PORT}"
+
+
+def parse_address(address):
+    """ "host:port" 为 TCP，其余视为 Unix 套接字路径；返回 (family, 地址) """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and host and os.sep not in host: return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class _ModelLock:
+    """
+    解码类请求共享、学习独占：学习等正在进行的解码结束，期间新的解码先等它 (学习很快)
+    只在线程池里获取，事件循环线程不会因此阻塞
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writing or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers: self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class _Connection(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.session = DecodeSession(server.model)
+        self.stream = None     # 当前候选流 (iter_candidates)
+        self.stream_id = 0
+        self.riddles = None    # 谜面匹配器，第一次 riddle 请求时创建
+        self.transport = None
+        self.buf = b""
+        self.pending = deque()    # 已收到、尚未处理的请求行
+        self.worker = None        # 正在按顺序处理 pending 的任务
+        self.write_paused = False
+        self.read_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections += 1
+
+    def connection_lost(self, exc):
+        self.server.connections -= 1
+        self.stream = None
+        self.pending.clear()
+
+    def data_received(self, data):
+        self.buf += data
+        if b"\n" not in data:
+            if len(self.buf) > MAX_REQUEST: self.transport.close()
+            return
+        *lines, self.buf = self.buf.split(b"\n")
+        self.pending.extend(line for line in lines if line)
+        if self.worker is None and self.pending:
+            self.worker = asyncio.ensure_future(self._serve())
+        self._flow()
+
+    async def _serve(self):
+        """
+        按顺序处理请求：查表类直接执行，响应先攒着；连续的解码类请求一起交给线程池 (少切换几次线程)，
+        交出前先把攒着的响应写出，全部处理完时再写出一次
+        """
+        loop = asyncio.get_running_loop()
+        server, out, carry = self.server, [], None
+        try:
+            while (carry or self.pending) and not self.transport.is_closing():
+                blocking, job = carry or server.prepare(self, self.pending.popleft())
+                carry = None
+                if not blocking:
+                    out.append(job())
+                    continue
+                jobs = [job]
+                while self.pending and len(jobs) < JOB_BATCH:
+                    carry = server.prepare(self, self.pending.popleft())
+                    if not carry[0]: break
+                    jobs.append(carry[1])
+                    carry = None
+                self._flow()
+                if out: self.transport.write(b"".join(out))
+                out = await loop.run_in_executor(server.executor, lambda: [job() for job in jobs])
+                if self.transport.is_closing(): return
+            if out: self.transport.write(b"".join(out))
+        finally:
+            self.worker = None
+            self._flow()
+
+    def _flow(self):
+        """ 客户端不读响应、或请求积压过多时暂停读请求，服务端不会无限堆积；两者都缓解后恢复 """
+        paused = self.write_paused or len(self.pending) >= MAX_PENDING
+        if paused == self.read_paused or self.transport.is_closing(): return
+        self.read_paused = paused
+        if paused: self.transport.pause_reading()
+        else: self.transport.resume_reading()
+
+    def pause_writing(self):
+        self.write_paused = True
+        self._flow()
+
+    def resume_writing(self):
+        self.write_paused = False
+        self._flow()
+
+
+class ModelServer:
+    def __init__(self, model, workers=DECODE_WORKERS):
+        self.model = model
+        self.connections = 0
+        self.requests = 0
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="decode")
+        self.lock = _ModelLock()
+        self.ops = {
+            "top": self.op_top,
+            "cand": self.op_cand,
+            "more": self.op_more,
+            "assoc": self.op_assoc,
+            "def": self.op_def,
+            "xhy": self.op_xhy,
+            "idiom": self.op_idiom,
+            "emoji": self.op_emoji,
+            "lookup": self.op_lookup,
+            "learn": self.op_learn,
+            "riddle": self.op_riddle,
+            "riddle_reset": self.op_riddle_reset,
+            "info": self.op_info,
+        }
+
+    def prepare(self, conn, line):
+        """ 解析一行请求，返回 (是否应在线程池中执行, job)；job() 执行请求并返回响应 """
+        self.requests += 1
+        try:
+            op, *args = json.loads(line)
+        except Exception as e:
+            reply = encode([1, f"{type(e).__name__}: {e}"])
+            return False, lambda: reply
+        fn = self.ops.get(op)
+        if fn is None: return False, lambda: encode([1, f"未知操作: {op}"])
+        if op in EXCLUSIVE_OPS: return True, lambda: self._locked(self.lock.exclusive, fn, conn, args)
+        if op in BLOCKING_OPS: return True, lambda: self._locked(self.lock.shared, fn, conn, args)
+        return False, lambda: self._call(fn, conn, args)
+
+    def _locked(self, mode, fn, conn, args):
+        with mode():
+            return self._call(fn, conn, args)
+
+    @staticmethod
+    def _call(fn, conn, args):
+        try:
+            return encode([0, fn(conn, *args)])
+        except Exception as e:
+            return encode([1, f"{type(e).__name__}: {e}"])
+
+    def handle(self, conn, line):
+        """ 在当前线程处理一行请求并返回响应 (进程内直接调用，例如基准测试) """
+        return self.prepare(conn, line)[1]()
+
+    # ---------- 操作 ----------
+    def op_top(self, conn, text, top_k=5, search="beam"):
+        return self.model.get_top_candidates(text, top_k=top_k, search=search)
+
+    def op_cand(self, conn, text, count=CAND_BATCH, search="exact"):
+        """ 新开候选流 (复用本连接的逐键会话)，返回 [流号, 前 count 个] """
+        conn.stream = self.model.iter_candidates(text, session=conn.session, search=search)
+        conn.stream_id += 1
+        return [conn.stream_id, list(itertools.islice(conn.stream, count))]
+
+    def op_more(self, conn, stream_id, count=CAND_BATCH):
+        """ 从候选流里再取 count 个；流已被新输入替换时返回空 """
+        if stream_id != conn.stream_id or conn.stream is None: return []
+        return list(itertools.islice(conn.stream, count))
+
+    def op_assoc(self, conn, context, top_k=5):
+        return self.model.get_associations(context, top_k)
+
+    def op_def(self, conn, text):
+        return self.model.kb.get_definition(text)
+
+    def op_xhy(self, conn, text):
+        return self.model.get_xiehouyu_answer(text)
+
+    def op_idiom(self, conn, abbr):
+        return self.model.kb.get_idiom(abbr)
+
+    def op_emoji(self, conn, pinyin):
+        return self.model.kb.get_emoji(pinyin)
+
+    def op_lookup(self, conn, pinyin):
+        return self.model.user_dict.lookup(pinyin)
+
+    def op_learn(self, conn, pinyin, word):
+        self.model.learn(pinyin, word)
+        return None
+
+    def op_riddle(self, conn, text):
+        """ 喂入本连接上屏的文字，返回输完的谜面 [[谜面, 答案]] """
+        if conn.riddles is None: conn.riddles = self.model.riddle_scanner()
+        return conn.riddles.feed(text)
+
+    def op_riddle_reset(self, conn):
+        if conn.riddles is not None: conn.riddles.reset()
+        return None
+
+    def op_info(self, conn):
+        return {"emoji": len(self.model.kb.emoji_dict), "idiom": len(self.model.kb.idiom_dict),
+                "connections": self.connections, "requests": self.requests}
+
+    # ---------- 启动 ----------
+    async def start(self, address):
+        loop = asyncio.get_running_loop()
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(addr):
+                # 连不上是上次异常退出留下的文件；能连上说明已有服务在运行
+                try:
+                    with socket.socket(socket.AF_UNIX) as probe: probe.connect(addr)
+                except OSError:
+                    os.unlink(addr)
+                else:
+                    raise OSError(f"已有服务在 {addr} 上运行")
+            return await loop.create_unix_server(lambda: _Connection(self), addr, backlog=BACKLOG)
+        return await loop.create_server(lambda: _Connection(self), *addr, backlog=BACKLOG)
+
+    async def serve_forever(self, address, ready=None):
+        server = await self.start(address)
+        print(f"[Server] 模型服务已启动: {address}")
+        if ready is not None: ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            family, addr = parse_address(address)
+            if family == socket.AF_UNIX:
+                with contextlib.suppress(OSError): os.unlink(addr)
+
+
+class RemoteError(Exception):
+    """ 服务端处理请求出错 """
+
+
+class ModelClient:
+    """ 阻塞式客户端；多个线程共用时按请求加锁，pipeline() 一次发出多个请求再依次读回 """
+    def __init__(self, address=None, timeout=None):
+        self.address = address or default_address()
+        family, addr = parse_address(self.address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        if family == socket.AF_INET: self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        self._lock = threading.Lock()
+
+    def _read(self):
+        line = self.rfile.readline()
+        if not line: raise ConnectionError("模型服务已断开")
+        return json.loads(line)
+
+    def call(self, op, *args):
+        with self._lock:
+            self.sock.sendall(encode([op, *args]))
+            status, result = self._read()
+        if status: raise RemoteError(result)
+        return result
+
+    def pipeline(self, requests):
+        """ requests: [(操作, 参数...)]，按顺序返回结果；响应全部读回后才报告其中的错误 """
+        with self._lock:
+            self.sock.sendall(b"".join(encode(list(r)) for r in requests))
+            replies = [self._read() for _ in requests]
+        for status, result in replies:
+            if status: raise RemoteError(result)
+        return [result for status, result in replies]
+
+    def close(self):
+        with contextlib.suppress(OSError):
+            self.rfile.close()
+            self.sock.close()
+
+
+class _RemoteKB:
+    def __init__(self, client):
+        self.client = client
+
+    def get_idiom(self, abbr):
+        return self.client.call("idiom", abbr)
+
+    def get_emoji(self, pinyin):
+        return self.client.call("emoji", pinyin)
+
+    def get_definition(self, text):
+        return self.client.call("def", text)
+
+    def get_xiehouyu(self, text):
+        return self.client.call("xhy", text)
+
+
+class _RemoteUserDict:
+    def __init__(self, client):
+        self.client = client
+
+    def lookup(self, pinyin):
+        return self.client.call("lookup", pinyin)
+
+    def close(self):
+        # 用户词库由服务端持有，这里只断开连接
+        pass
+
+
+class _RemoteScanner:
+    def __init__(self, client):
+        self.client = client
+
+    def feed(self, text):
+        return [tuple(m) for m in self.client.call("riddle", text)]
+
+    def reset(self):
+        self.client.call("riddle_reset")
+
+
+class RemoteModel:
+    """
+    HMM_Model 的瘦客户端，提供 GUI 用到的接口
+    候选流单独用一条连接，界面线程上的查表请求不会排在解码后面
+    """
+    def __init__(self, address=None):
+        self.client = ModelClient(address)
+        self._decode = ModelClient(self.client.address)
+        self.kb = _RemoteKB(self.client)
+        self.user_dict = _RemoteUserDict(self.client)
+
+    def info(self):
+        return self.client.call("info")
+
+    def get_top_candidates(self, pinyin_input, top_k=5, session=None, search="beam"):
+        return self.client.call("top", pinyin_input, top_k, search)
+
+    def iter_candidates(self, pinyin_input, session=None, search="exact"):
+        """ session 由服务端按连接维护，这里的参数只为与 HMM_Model 接口一致 """
+        stream_id, batch = self._decode.call("cand", pinyin_input, CAND_BATCH, search)
+        while batch:
+            yield from batch
+            if len(batch) < CAND_BATCH: return
+            batch = self._decode.call("more", stream_id, CAND_BATCH)
+
+    def get_associations(self, context, top_k=5):
+        return self.client.call("assoc", context, top_k)
+
+    def get_xiehouyu_answer(self, text):
+        return self.client.call("xhy", text)
+
+    def learn(self, pinyin_input, word):
+        self.client.call("learn", pinyin_input, word)
+
+    def riddle_scanner(self, wait=True):
+        """ 匹配状态在服务端，按连接保存 (同一 RemoteModel 只有一个)；自动机由服务端构建，wait 不起作用 """
+        return _RemoteScanner(self.client)
+
+    def close(self):
+        self.client.close()
+        self._decode.close()
+
+
+def main(argv=None):
+    from main import HMM_Model
+
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    parser = argparse.ArgumentParser(description="本机共享模型服务")
+    parser.add_argument("-a", "--address", default=default_address(), help="Unix 套接字路径或 host:port")
+    parser.add_argument("-d", "--data", default=default_data, help="语料目录")
+    parser.add_argument("--user-dict", default=None, help="用户词库路径 (默认 语料目录/user_dict.txt)")
+    args = parser.parse_args(argv)
+
+    model = HMM_Model(kb_dir=None)
+    model.load_from_dir(args.data)
+    model.load_user_dict(args.user_dict or os.path.join(args.data, "user_dict.txt"))
+    model.preload()
+    try:
+        asyncio.run(ModelServer(model).serve_forever(args.address))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"[Server] 启动失败: {e}")
+    finally:
+        model.user_dict.close()
+        print("[Server] 已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import math
+from array import array
+from bisect import bisect_left
+
+from bigram_store import BACKOFF_PENALTY, rank_rows
+
+# 三元语言模型 (可选)：在二元表之上按上下文 (前两个字) 修正转移分数
+#
+# 估计方法：插值式绝对折扣 (Kneser-Ney 式的折扣，低阶直接用二元表)
+#   P(c|a,b) = max(n(abc) - D, 0) / n(ab·) + γ(ab) · P2(c|b)      γ(ab) = D · T(ab) / n(ab·)
+#   T(ab) 为该上下文出现过的不同后继数，D 由计数的计数估计 n1 / (n1 + 2·n2)
+# 存储按 Katz/ARPA 的形式：见过的三元组直接存插值后的对数概率，
+# 没见过的取 log γ(ab) + 二元分数；上下文本身没出现过时就是二元分数，与不加载三元表完全一致。
+#
+# 紧凑存储 (全部是定长数组，可由模型缓存直接映射)：
+#   ctx_keys[i]      上下文 a*字数+b，升序
+#   ctx_bow[i]       log γ 的量化码 (uint8)，码表 bow_book
+#   offsets[i]..[i+1] 上下文 i 的后继区间，succ 行内升序
+#   codes[...]       对数概率的量化码 (uint8)，码表 codebook (256 个 float32，按分位数分箱取均值)
+#   assoc[...]       行内后继按概率降序重排 (联想用)
+# 每个三元组 9 字节 (后继 4 + 码 1 + 联想 4)，每个上下文 13 字节。
+
+QUANT_LEVELS = 256
+MIN_DISCOUNT, MAX_DISCOUNT = 0.1, 0.9
+
+
+def quantize(values, levels=QUANT_LEVELS):
+    """ 等频分箱量化：返回 (码 array('B'), 码表 array('f')) """
+    if not values: return array('B'), array('f')
+    ranked = sorted(values)
+    n = len(ranked)
+    bins = min(levels, n)
+    # 每箱的上界；重复值较多时相邻箱会合并
+    bounds = sorted(set(ranked[min(n - 1, (k + 1) * n // bins - 1)] for k in range(bins)))
+    sums, counts = [0.0] * len(bounds), [0] * len(bounds)
+    codes = array('B', bytes(n))
+    for i, v in enumerate(values):
+        k = bisect_left(bounds, v)
+        codes[i] = k
+        sums[k] += v
+        counts[k] += 1
+    book = array('f', (s / c if c else 0.0 for s, c in zip(sums, counts)))
+    return codes, book
+
+
+def estimate_discount(counts):
+    n1 = sum(1 for c in counts if c == 1)
+    n2 = sum(1 for c in counts if c == 2)
+    if not n1: return MIN_DISCOUNT
+    return min(MAX_DISCOUNT, max(MIN_DISCOUNT, n1 / (n1 + 2 * n2)))
+
+
+def read_counts(path):
+    """ 读取与 Bigram.txt 相同格式的三字组文件 (序号 \\t 三字组 \\t 频率 ...) """
+    counts = {}
+    with open(path, 'r', encoding='gb18030') as f:
+        for line in f:
+            if line.startswith('/*') or not line.strip(): continue
+            parts = line.strip().split('\t')
+            if len(parts) < 3 or len(parts[1]) != 3: continue
+            counts[parts[1]] = counts.get(parts[1], 0) + int(parts[2])
+    return counts
+
+
+class NgramStore:
+    def __init__(self, store):
+        self.store = store          # 低阶 (二元) 模型
+        self.discount = 0.0
+        self.ctx_keys = array('q')
+        self.ctx_bow = array('B')
+        self.bow_book = array('f')
+        self.offsets = array('i', [0])
+        self.succ = array('i')
+        self.codes = array('B')
+        self.codebook = array('f')
+        self.assoc = array('i')
+
+    def __len__(self):
+        return len(self.succ)
+
+    @staticmethod
+    def _base_score(store, prev_id, curr_id):
+        """ 不含用户词库的二元分数 (训练时的低阶分布) """
+        p = store.lookup(prev_id, curr_id)
+        if p is not None: return p
+        return store.start[curr_id] - BACKOFF_PENALTY
+
+    @classmethod
+    def build(cls, store, counts, discount=None):
+        """
+        :param counts: {三字组: 次数}，含二元表以外汉字的条目被忽略
+        :param discount: 折扣 D，None 时由计数估计
+        """
+        ngram = cls(store)
+        ids = store.char_ids
+        n = len(store)
+        rows = {}
+        for word, count in counts.items():
+            if count <= 0 or not all(c in ids for c in word): continue
+            a, b, c = (ids[ch] for ch in word)
+            row = rows.setdefault(a * n + b, {})
+            row[c] = row.get(c, 0) + count
+        if discount is None: discount = estimate_discount([c for row in rows.values() for c in row.values()])
+        ngram.discount = discount
+
+        bows, logps = [], []
+        for key in sorted(rows):
+            row = rows[key]
+            total = sum(row.values())
+            gamma = discount * len(row) / total
+            b = key % n
+            ngram.ctx_keys.append(key)
+            bows.append(math.log(gamma))
+            for c in sorted(row):
+                ngram.succ.append(c)
+                lower = math.exp(cls._base_score(store, b, c))
+                logps.append(math.log(max(row[c] - discount, 0.0) / total + gamma * lower))
+            ngram.offsets.append(len(ngram.succ))
+        ngram.ctx_bow, ngram.bow_book = quantize(bows)
+        ngram.codes, ngram.codebook = quantize(logps)
+        ngram.assoc = rank_rows(ngram.offsets, ngram.succ, logps)
+        return ngram
+
+    @classmethod
+    def load(cls, path, store, discount=None):
+        return cls.build(store, read_counts(path), discount)
+
+    def nbytes(self):
+        return sum(getattr(self, name).itemsize * len(getattr(self, name)) for name, _ in self.ARRAY_FIELDS)
+
+    # ---------- 查询 ----------
+    def context(self, prev2_id, prev_id):
+        """ 上下文下标，没出现过返回 -1 """
+        key = prev2_id * len(self.store) + prev_id
+        i = bisect_left(self.ctx_keys, key)
+        if i < len(self.ctx_keys) and self.ctx_keys[i] == key: return i
+        return -1
+
+    def lookup(self, ctx, curr_id):
+        """ 上下文 ctx 下见过的三元组分数；没见过返回 None """
+        lo, hi = self.offsets[ctx], self.offsets[ctx + 1]
+        i = bisect_left(self.succ, curr_id, lo, hi)
+        if i < hi and self.succ[i] == curr_id: return float(self.codebook[self.codes[i]])
+        return None
+
+    def score(self, prev2_id, prev_id, curr_id):
+        """ 三元分数，依次回退到二元 (含用户词库) """
+        ctx = self.context(prev2_id, prev_id)
+        if ctx < 0: return self.store.score(prev_id, curr_id)
+        p = self.lookup(ctx, curr_id)
+        if p is not None: return p
+        return float(self.bow_book[self.ctx_bow[ctx]]) + self.store.score(prev_id, curr_id)
+
+    def scorer(self, prev2_id, prev_id):
+        """ 固定前两个字后的打分函数 (curr_id -> 分数)，供解码器逐候选调用 """
+        store = self.store
+        ctx = self.context(prev2_id, prev_id)
+        if ctx < 0: return lambda curr_id: store.score(prev_id, curr_id)
+        bow = float(self.bow_book[self.ctx_bow[ctx]])
+        lo, hi = self.offsets[ctx], self.offsets[ctx + 1]
+        seen = {self.succ[i]: float(self.codebook[self.codes[i]]) for i in range(lo, hi)}
+
+        def score(curr_id):
+            p = seen.get(curr_id)
+            if p is not None: return p
+            return bow + store.score(prev_id, curr_id)
+        return score
+
+    def associations(self, prev2_id, prev_id, top_k=5):
+        """ 该上下文下概率最高的 top_k 个后继 ID，上下文没出现过时为空 """
+        ctx = self.context(prev2_id, prev_id)
+        if ctx < 0: return []
+        lo = self.offsets[ctx]
+        return self.assoc[lo:min(lo + top_k, self.offsets[ctx + 1])].tolist()
+
+    # ---------- 模型缓存 ----------
+    ARRAY_FIELDS = (("ctx_keys", 'q'), ("ctx_bow", 'B'), ("bow_book", 'f'),
+                    ("offsets", 'i'), ("succ", 'i'), ("codes", 'B'), ("codebook", 'f'), ("assoc", 'i'))
+
+    def to_payload(self):
+        return {"discount": self.discount}, {name: getattr(self, name) for name, _ in self.ARRAY_FIELDS}
+
+    @classmethod
+    def from_payload(cls, store, meta, buffers):
+        ngram = cls(store)
+        ngram.discount = meta["discount"]
+        for name, code in cls.ARRAY_FIELDS:
+            raw = buffers[name]
+            if isinstance(raw, memoryview):
+                setattr(ngram, name, raw.cast(code))
+            else:
+                arr = array(code)
+                arr.frombytes(raw)
+                setattr(ngram, name, arr)
+        return ngram
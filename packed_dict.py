@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, islice
+from collections.abc import Mapping
+from zlib import crc32
+
+# 知识库词典的紧凑存储：全部文本去重后拼成一个 UTF-8 字符串池，词典只保存编号
+#   StringPool   blob 为全部文本首尾相接的 UTF-8 字节，offsets[i] .. offsets[i+1] 是第 i 条
+#   PackedDict   只读的 str -> str 映射；各项按插入顺序存放 (遍历顺序与原来的 dict 一致)
+#                key_ids[] / value_ids[] 是键和值的编号，可选的 kinds[] 为每项的格式编号，取值时才套用 formats 里的模板
+#                hashes[] 是各键 UTF-8 的 CRC32 升序排列，order[] 是对应的项下标；
+#                查找时先在 hashes 上二分 (bisect 在 C 里完成)，再逐个比较哈希相同的键
+# 用 CRC32 而不用内置 hash()：后者每个进程的随机种子不同，无法存进模型缓存。
+# 同一段文字 (例如歇后语的答案，既是谜面表的值也是释义的内容) 在池里只存一份。
+# 池和各数组都可以直接是 memoryview，模型缓存 (model_cache.py) 映射后无需解码即可查询。
+
+
+class StringPool:
+    def __init__(self, blob=b"", offsets=None):
+        self.blob = blob
+        self.offsets = offsets if offsets is not None else array('I', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, i):
+        offsets = self.offsets
+        return str(self.blob[offsets[i]:offsets[i + 1]], 'utf-8')
+
+    def nbytes(self):
+        return len(self.blob) + len(self.offsets) * self.offsets.itemsize
+
+
+class PoolBuilder:
+    """ 向字符串池追加文本，相同文本只存一份；finish() 之后新编号才可读取，去重表随构建器一起丢弃 """
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else StringPool()
+        pool = self.pool
+        self.index = {pool.get(i): i for i in range(len(pool))}
+        self.buf = bytearray()
+        self.base = pool.offsets[len(pool)]
+        self.offsets = array('I')
+
+    def add(self, texts):
+        """ 批量加入文本，返回各自的编号 (array) """
+        index = self.index
+        new = [t for t in dict.fromkeys(texts) if t not in index]
+        index.update(zip(new, range(len(index), len(index) + len(new))))
+        data = [t.encode('utf-8') for t in new]
+        self.offsets.extend(islice(accumulate(map(len, data), initial=self.base + len(self.buf)), 1, None))
+        self.buf += b"".join(data)
+        return array('I', map(index.__getitem__, texts))
+
+    def finish(self):
+        """ 把新增的文本并入池 (先接好 blob 再追加偏移，读线程不会看到越界的编号) """
+        pool = self.pool
+        if self.offsets:
+            pool.blob = bytes(pool.blob) + self.buf if len(pool.blob) else bytes(self.buf)
+            if not isinstance(pool.offsets, array): pool.offsets = array('I', pool.offsets)
+            pool.offsets.extend(self.offsets)
+        self.index, self.buf, self.offsets = {}, bytearray(), array('I')
+        return pool
+
+
+class PackedDict(Mapping):
+    def __init__(self, pool, keys, values, hashes, order, kinds=None, formats=None):
+        self.pool = pool
+        self.key_ids = keys
+        self.value_ids = values
+        self.hashes = hashes
+        self.order = order
+        self.kinds = kinds
+        self.formats = formats
+        # 各格式模板的字段数，多字段的原文以制表符分隔
+        self._fields = [f.count("{}") for f in formats] if formats else None
+
+    @classmethod
+    def build(cls, table, builder, formats=None):
+        """
+        table: {键: 值}；给出 formats 时值为 (格式编号, 原文)
+        返回的词典在 builder.finish() 之后才能查询
+        """
+        names = list(table)
+        kinds = None
+        if formats:
+            kinds = array('B', [v[0] for v in table.values()])
+            values = builder.add([v[1] for v in table.values()])
+        else:
+            values = builder.add(list(table.values()))
+        keys = builder.add(names)
+        hashes = array('I', map(crc32, map(str.encode, names)))
+        order = array('I', sorted(range(len(hashes)), key=hashes.__getitem__))
+        hashes = array('I', map(hashes.__getitem__, order))
+        return cls(builder.pool, keys, values, hashes, order, kinds, formats)
+
+    def _find(self, key):
+        """ key 的下标，没有为 -1 """
+        if not isinstance(key, str): return -1
+        data = key.encode('utf-8')
+        h = crc32(data)
+        hashes = self.hashes
+        j = bisect_left(hashes, h)
+        if j == len(hashes) or hashes[j] != h: return -1
+        # 直接比较字节，不解码
+        blob, offsets, keys, order = self.pool.blob, self.pool.offsets, self.key_ids, self.order
+        while j < len(hashes) and hashes[j] == h:
+            i = order[j]
+            k = keys[i]
+            if blob[offsets[k]:offsets[k + 1]] == data: return i
+            j += 1
+        return -1
+
+    def _value(self, i):
+        raw = self.pool.get(self.value_ids[i])
+        if self.kinds is None: return raw
+        kind = self.kinds[i]
+        n = self._fields[kind]
+        if n == 1: return self.formats[kind].format(raw)
+        return self.formats[kind].format(*raw.split("\t", n - 1))
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0: raise KeyError(key)
+        return self._value(i)
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return self._value(i) if i >= 0 else default
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return len(self.key_ids)
+
+    def __iter__(self):
+        get = self.pool.get
+        return (get(k) for k in self.key_ids)
+
+    def items(self):
+        get = self.pool.get
+        return ((get(k), self._value(i)) for i, k in enumerate(self.key_ids))
+
+    def values(self):
+        return (self._value(i) for i in range(len(self.key_ids)))
+
+    def raw_items(self):
+        """ build() 所接受的 (键, 值)：有格式编号时值为 (格式编号, 原文) """
+        get = self.pool.get
+        if self.kinds is None: return ((get(k), get(v)) for k, v in zip(self.key_ids, self.value_ids))
+        return ((get(k), (kind, get(v))) for k, v, kind in zip(self.key_ids, self.value_ids, self.kinds))
+
+    def keys_of_kind(self, kinds):
+        """ 格式编号属于 kinds 的键 (不套用格式) """
+        get = self.pool.get
+        return (get(k) for k, kind in zip(self.key_ids, self.kinds) if kind in kinds)
+
+    def nbytes(self):
+        """ 编号数组的字节数 (不含共享的字符串池) """
+        size = len(self.key_ids) * 16
+        if self.kinds is not None: size += len(self.kinds)
+        return size
+
+    # 供模型缓存使用
+    ARRAY_FIELDS = (("key_ids", 'I'), ("value_ids", 'I'), ("hashes", 'I'), ("order", 'I'), ("kinds", 'B'))
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name, _ in self.ARRAY_FIELDS if getattr(self, name) is not None}
+
+    @classmethod
+    def from_arrays(cls, pool, buffers, formats=None):
+        """ buffers: 名称 -> memoryview (直接引用) 或 bytes """
+        fields = {}
+        for name, code in cls.ARRAY_FIELDS:
+            raw = buffers.get(name)
+            if raw is None: fields[name] = None
+            elif isinstance(raw, memoryview): fields[name] = raw.cast(code)
+            else: fields[name] = array(code, raw)
+        return cls(pool, fields["key_ids"], fields["value_ids"], fields["hashes"], fields["order"], fields["kinds"], formats)
@@ -0,0 +1,74 @@
+# 拼音音节字典树：一次线性扫描给出所有合法切分 (音节 DAG)
+SEPARATORS = " '"  # 空格与隔音符号，强制音节边界
+
+
+class PinyinTrie:
+    def __init__(self, syllables=()):
+        self.root = {}
+        self.max_len = 0
+        for syllable in syllables:
+            self.add(syllable)
+
+    def add(self, syllable):
+        node = self.root
+        for ch in syllable:
+            node = node.setdefault(ch, {})
+        node[None] = syllable  # None 键标记音节结尾
+        self.max_len = max(self.max_len, len(syllable))
+
+    def __contains__(self, syllable):
+        node = self.root
+        for ch in syllable:
+            node = node.get(ch)
+            if node is None: return False
+        return None in node
+
+    def match(self, text, i):
+        """ 从位置 i 开始能匹配到的所有音节 [(终点, 音节)]，长的在前 """
+        node = self.root
+        out = []
+        for j in range(i, len(text)):
+            node = node.get(text[j])
+            if node is None: break
+            if None in node: out.append((j + 1, node[None]))
+        out.reverse()
+        return out
+
+    def covers(self, text):
+        """ text 能否完整切分为音节 (分隔符不计) """
+        n = len(text)
+        ok = [False] * (n + 1)
+        ok[0] = True
+        for i in range(n):
+            if not ok[i]: continue
+            if text[i] in SEPARATORS:
+                ok[i + 1] = True
+                continue
+            for end, syllable in self.match(text, i):
+                ok[end] = True
+        return ok[n]
+
+    def build_dag(self, text, start=0):
+        """
+        dag[i] 为从位置 i 出发的边 [(终点, 音节)]，长的在前
+        分隔符或无法匹配任何音节的字母给出一条跳过边 (i+1, None)
+        """
+        root = self.root
+        length = len(text)
+        dag = []
+        for i in range(start, length):
+            edges = []
+            node = root
+            j = i
+            while j < length:
+                node = node.get(text[j])
+                if node is None: break
+                j += 1
+                syllable = node.get(None)
+                if syllable is not None: edges.append((j, syllable))
+            if edges:
+                edges.reverse()
+            else:
+                edges.append((i + 1, None))
+            dag.append(edges)
+        return dag
@@ -0,0 +1,52 @@
+from array import array
+
+# Beam Search 的剪枝档位：速度与准确率的取舍
+#   beam_width  直方图剪枝：每步最多保留的路径数
+#   threshold   阈值剪枝：比当前最优路径低 threshold (对数概率) 以上的路径直接丢弃，None 为不限
+#                 候选区分度高的位置 beam 自动收窄，歧义多的位置仍保留到 beam_width
+#   min_keep    阈值剪枝至少保留的路径数，候选栏不会因此只剩一两个候选
+#   emit_top    每个音节只展开初始概率最高的 emit_top 个字，None 为全部展开
+# exact 与不剪枝时的结果完全一致。
+# 精确 k-best (search="exact"，界面的候选流) 同样按 emit_top 与 threshold/min_keep 剪枝 (见 kbest.py)，
+# 它不维护定宽的 Beam，beam_width 只作用于 Beam Search。
+
+
+class PruneProfile:
+    __slots__ = ("name", "beam_width", "threshold", "emit_top", "min_keep")
+
+    def __init__(self, name, beam_width=30, threshold=None, emit_top=None, min_keep=5):
+        self.name = name
+        self.beam_width = beam_width
+        self.threshold = threshold
+        self.emit_top = emit_top
+        self.min_keep = min_keep
+
+    def __repr__(self):
+        return (f"PruneProfile({self.name!r}, beam_width={self.beam_width}, threshold={self.threshold}, "
+                f"emit_top={self.emit_top}, min_keep={self.min_keep})")
+
+
+PROFILES = {
+    "fast": PruneProfile("fast", beam_width=16, threshold=8.0, emit_top=24),
+    "balanced": PruneProfile("balanced", beam_width=30, threshold=10.0, emit_top=32),
+    "exact": PruneProfile("exact"),
+}
+DEFAULT_PROFILE = "exact"
+
+
+def rank_emissions(emit_ids, scores, emit_pen=None):
+    """ 拼音 -> 候选字在 emit_ids 中的下标，按 (初始概率 - 扣分) 降序 (同分保持原顺序)，加载时算一次 """
+    order = {}
+    for py, ids in emit_ids.items():
+        pen = emit_pen.get(py) if emit_pen else None
+        if pen:
+            key = lambda k: pen[k] - scores[ids[k]]
+        else:
+            key = lambda k: -scores[ids[k]]
+        order[py] = array('i', sorted(range(len(ids)), key=key))
+    return order
+
+
+def cap_emissions(emit_ids, emit_order, top):
+    """ 每个音节只留排名前 top 的下标，按原顺序排列 (同分时的先后与不剪枝时一致)；不需要截断的音节不出现在结果里 """
+    return {py: sorted(emit_order[py][:top]) for py, ids in emit_ids.items() if len(ids) > top}
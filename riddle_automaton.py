@@ -0,0 +1,147 @@
+import sys
+from array import array
+from collections import deque
+
+# 歇后语谜面的 Aho-Corasick 自动机：上屏的字逐个喂入，谜面一输完就报告
+# 谜面可以分几次上屏、也可以嵌在更长的句子里；每个字均摊 O(1)，与谜面条数无关。
+#
+# 存储：
+#   goto     {状态 << 21 | 字符码: 下一状态}，全部转移放在一个 dict 里 (不为每个状态建 dict)
+#   fail[s]  失败指针：s 所代表字符串的最长真后缀所在的状态
+#   out[s]   恰好在 s 结束的谜面下标，没有为 -1
+#   link[s]  沿失败指针遇到的下一个有谜面结束的状态 (输出链)，没有为 0
+# 谜面与答案按下标存放在两个列表里。
+
+_SHIFT = 21                 # Unicode 码位不超过 21 位
+IGNORED = frozenset("，,")  # 谜面去掉了逗号，上屏文本中的逗号同样跳过
+
+
+class RiddleAutomaton:
+    def __init__(self):
+        self.goto = {}
+        self.fail = array('i', [0])
+        self.out = array('i', [-1])
+        self.link = array('i', [0])
+        self.patterns = []
+        self.values = []
+        self.max_len = 0
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @classmethod
+    def build(cls, table):
+        """ table: {谜面: 答案}，谜面中的逗号应已去掉 """
+        ac = cls()
+        goto, fail, out, link = ac.goto, ac.fail, ac.out, ac.link
+        children = [[]]  # 建表时用：每个状态的 (字符码, 子状态)，求失败指针后丢弃
+        for pattern, value in table.items():
+            if not pattern: continue
+            s = 0
+            for ch in pattern:
+                key = s << _SHIFT | ord(ch)
+                nxt = goto.get(key)
+                if nxt is None:
+                    nxt = goto[key] = len(fail)
+                    fail.append(0)
+                    out.append(-1)
+                    link.append(0)
+                    children.append([])
+                    children[s].append((ord(ch), nxt))
+                s = nxt
+            if out[s] < 0:
+                out[s] = len(ac.patterns)
+                ac.patterns.append(pattern)
+                ac.values.append(value)
+                ac.max_len = max(ac.max_len, len(pattern))
+
+        # 按层 (BFS) 求失败指针与输出链
+        queue = deque(child for c, child in children[0])
+        while queue:
+            s = queue.popleft()
+            for c, child in children[s]:
+                f = fail[s]
+                while True:
+                    nxt = goto.get(f << _SHIFT | c)
+                    if nxt is not None and nxt != child:
+                        fail[child] = nxt
+                        break
+                    if f == 0: break
+                    f = fail[f]
+                g = fail[child]
+                link[child] = g if out[g] >= 0 else link[g]
+                queue.append(child)
+        return ac
+
+    def nbytes(self):
+        """ 估算内存 (dict 按 CPython 的实际大小) """
+        size = sys.getsizeof(self.goto) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.goto.items())
+        size += sum(a.itemsize * len(a) for a in (self.fail, self.out, self.link))
+        size += sys.getsizeof(self.patterns) + sys.getsizeof(self.values)
+        return size
+
+    def step(self, state, ch):
+        """ 从 state 读入一个字后的状态 """
+        c = ord(ch)
+        goto, fail = self.goto, self.fail
+        while True:
+            nxt = goto.get(state << _SHIFT | c)
+            if nxt is not None: return nxt
+            if state == 0: return 0
+            state = fail[state]
+
+    def matches_at(self, state):
+        """ 在 state 结束的全部谜面下标，长的在前 """
+        found = []
+        s = state if self.out[state] >= 0 else self.link[state]
+        while s:
+            found.append(self.out[s])
+            s = self.link[s]
+        return found
+
+    def find_all(self, text):
+        """ 一次性扫描整段文本，返回 [(结束位置, 谜面, 答案)] """
+        result = []
+        state = 0
+        for i, ch in enumerate(text):
+            if ch in IGNORED: continue
+            state = self.step(state, ch)
+            for k in self.matches_at(state):
+                result.append((i + 1, self.patterns[k], self.values[k]))
+        return result
+
+    def scanner(self):
+        return RiddleScanner(self)
+
+
+class RiddleScanner:
+    """ 增量匹配：保存当前状态，逐段喂入上屏的文字 """
+    def __init__(self, automaton):
+        self.automaton = automaton
+        self.state = 0
+
+    def reset(self):
+        self.state = 0
+
+    def feed(self, text):
+        """
+        返回本段文字中输完的谜面 [(结束位置, 谜面, 答案)]，结束位置是在 text 中的下标 (同 find_all)，
+        按完成先后，同一位置长的在前；要给出一个答案时用 last_match()
+        """
+        ac = self.automaton
+        state = self.state
+        result = []
+        for i, ch in enumerate(text):
+            if ch in IGNORED: continue
+            state = ac.step(state, ch)
+            if ac.out[state] >= 0 or ac.link[state]:
+                result.extend((i + 1, ac.patterns[k], ac.values[k]) for k in ac.matches_at(state))
+        self.state = state
+        return result
+
+
+def last_match(matches):
+    """ feed() / find_all() 的结果中最后输完的谜面 (同一位置取最长的)，返回 (谜面, 答案)，没有时为 None """
+    if not matches: return None
+    end, pattern, answer = max(matches, key=lambda m: (m[0], len(m[1])))
+    return pattern, answer
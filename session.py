@@ -0,0 +1,146 @@
+from pinyin_trie import SEPARATORS
+
+# 增量解码会话：在音节 DAG 上联合解码，并随用户逐键输入复用已解码的前缀
+#
+# states[j] 是覆盖 text[:j] 的所有切分方式合并后的 Beam 状态。
+# 从 i 出发的边只取决于 text[i : i+最长音节]，因此新输入到来时，
+# 公共前缀内足够靠前的边和状态都可以保留，只重建尾部；
+# 退格时公共前缀变短，直接回退到缓存的较早状态。
+#
+# 无法匹配的字母会被跳过，但每个位置只保留跳过字母最少的那些切分，
+# 所以只要存在完整切分，跳过字母的路径就不会进入候选。
+
+_INITIAL = object()  # 位置 0：尚未输出任何汉字
+
+
+def normalize(text):
+    """ 连续的空格/隔音符号合并为一个 '，并去掉首尾分隔符 """
+    out = []
+    for ch in text:
+        if ch in SEPARATORS:
+            if out and out[-1] != "'": out.append("'")
+        else:
+            out.append(ch)
+    if out and out[-1] == "'": out.pop()
+    return "".join(out)
+
+
+class DecodeSession:
+    INITIAL = _INITIAL
+
+    def __init__(self, model):
+        self.model = model
+        self._decoder = None
+        self._width = None
+        self._trie = None
+        self._user_version = None
+        self.stream = None    # 超长输入的逐键流式解码 (stream.StreamSession)，由 HMM_Model 创建
+        self.abbr = None      # 缩写查询的续接状态 (abbr_index.AbbrLookup)，由 HMM_Model 创建
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.dag = []         # dag[i]: 从位置 i 出发的边
+        self.incoming = [[]]  # incoming[j]: 到达 j 且跳过字母最少的边 [(起点, 音节)]
+        self.skips = [0]      # 到达 j 时跳过的最少字母数，不可达为 None
+        self.paths = [1]      # 跳过字母最少的切分方式数
+        self.states = [_INITIAL]
+        self.viterbi = [_INITIAL]  # 精确解码 (kbest.py) 的前向结果，同样按位置缓存
+
+    def update(self, text):
+        """
+        输入新的拼音串，返回规整后的文本
+        只重建与上一次不同的尾部，解码推迟到 candidates() 调用时
+        """
+        decoder = self.model.get_decoder()
+        width = self.model.beam_width
+        trie = self.model.lattice_trie()
+        user_version = self.model.bigram.user_version
+        if (decoder is not self._decoder or width != self._width or trie is not self._trie
+                or user_version != self._user_version):
+            # 解码后端、模型、Beam 宽度或用户词库变化后，缓存的状态不再可用
+            self._decoder = decoder
+            self._width = width
+            self._trie = trie
+            self._user_version = user_version
+            self.reset()
+
+        text = normalize(text)
+        old = self.text
+        common = 0
+        limit = min(len(old), len(text))
+        while common < limit and old[common] == text[common]:
+            common += 1
+
+        # 起点 i 满足 i + 最长音节 <= common 的边不受影响；位置 j 只依赖起点小于 j 的边
+        keep = max(0, min(len(self.dag), common - trie.max_len + 1))
+        del self.dag[keep:]
+        self.dag.extend(trie.build_dag(text, keep))
+        for seq in (self.incoming, self.skips, self.paths):
+            del seq[keep + 1:]
+        del self.states[keep + 1:]
+        del self.viterbi[keep + 1:]
+
+        self.text = text
+        self._link(keep + 1)
+        return text
+
+    def _link(self, start):
+        """ 为位置 start..n 计算跳过最少的入边与切分数 (只看图，不解码) """
+        text, dag = self.text, self.dag
+        span = max(self._trie.max_len, 1)
+        for j in range(start, len(text) + 1):
+            best, edges, count = None, [], 0
+            for i in range(max(0, j - span), j):
+                if self.skips[i] is None: continue
+                for end, py in dag[i]:
+                    if end != j: continue
+                    cost = self.skips[i] + (1 if py is None and text[i] not in SEPARATORS else 0)
+                    if best is None or cost < best:
+                        best, edges, count = cost, [], 0
+                    elif cost > best:
+                        continue
+                    edges.append((i, py))
+                    count += self.paths[i]
+            self.incoming.append(edges)
+            self.skips.append(best)
+            self.paths.append(count)
+
+    def _decode(self):
+        decoder, width = self._decoder, self._width
+        for j in range(len(self.states), len(self.text) + 1):
+            if self.skips[j] is None:
+                self.states.append(None)
+                continue
+            parts = []
+            for i, py in self.incoming[j]:
+                prev = self.states[i]
+                if py is None:
+                    parts.append(prev)
+                elif prev is _INITIAL:
+                    parts.append(decoder.start_state(py, width))
+                else:
+                    parts.append(decoder.step(prev, py, width))
+            if any(p is _INITIAL for p in parts):
+                # 只有开头一直被跳过时才会出现，此时不存在其他切分
+                self.states.append(_INITIAL)
+            else:
+                self.states.append(decoder.merge(parts, width))
+
+    @property
+    def unmatched(self):
+        """ 当前输入中无法切分、被跳过的字母数 """
+        return self.skips[len(self.text)] or 0
+
+    def single_syllable(self):
+        """ 输入只有唯一一种切分且恰好是一个音节时返回该音节 """
+        if self.paths[len(self.text)] == 1 and self.text in self._trie:
+            return self.text
+        return None
+
+    def candidates(self, top_k=5):
+        """ 当前输入的 HMM 候选，从最后一个缓存状态继续扩展 """
+        self._decode()
+        state = self.states[len(self.text)]
+        if state is None or state is _INITIAL: return []
+        return self._decoder.results(state, top_k)
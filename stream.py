@@ -0,0 +1,211 @@
+import os
+
+from pinyin_trie import SEPARATORS
+from session import DecodeSession
+
+# 流式解码：超长输入 (整段粘贴的拼音) 从左到右推进，边读边输出已确定的汉字
+#
+# 与 DecodeSession 一样在音节 DAG 上联合解码，但只保留最近 max_len 个位置的状态：
+# 到达同一位置的各切分方式在此之后就不会再被回看。
+# 最终的最优路径必然由某条存活路径扩展而来，而末两字相同的路径之后的得分增量完全相同，
+# 所以只需看每组末两字中得分最高的那条：这些路径的公共前缀不会再变，随即输出并从状态中去掉，
+# 所以内存与未确定部分的长度有关，与输入总长无关，耗时与输入长度线性相关。
+# 路径迟迟不收敛时 (未确定部分超过 window 个字母)，强制输出当前最优路径中较早的部分，
+# 并丢弃与之不符的路径——只有这种情况下结果可能与整句解码不同。
+# 输入框里的超长输入 (粘贴整段后继续打字) 由 StreamSession 逐键推进：只喂入新追加的字母，
+# 剩余部分的最优结果用 peek() 试算，不改变解码状态。
+
+STREAM_WINDOW = 120   # 未确定部分最多容纳的输入字母数
+FORCE_KEEP = 8        # 强制输出时，最优路径末尾保留不输出的字数
+CHECK_INTERVAL = 16   # 两次公共前缀检查之间至少间隔的字母数 (检查要回溯整个 beam)
+CONTEXT_KEEP = 2      # 输出后路径里仍保留的字数，供三元模型作上下文
+
+_INITIAL = DecodeSession.INITIAL
+
+
+class StreamDecoder:
+    def __init__(self, model, window=STREAM_WINDOW):
+        self.model = model
+        self.decoder = model.get_decoder()
+        self.width = model.beam_width
+        self.trie = model.lattice_trie()
+        self.user_version = model.bigram.user_version
+        self.span = max(self.trie.max_len, 1)
+        self.window = window
+        self.buf = ""       # 输入缓冲，buf[0] 对应绝对位置 base
+        self.base = 0
+        self.length = 0     # 已读入的总字母数
+        self.edges = {}     # 位置 -> 出边 (只建到出边已确定的位置)
+        self.next_edge = 0
+        self.skips = {0: 0}
+        self.states = {0: _INITIAL}
+        self.pos = 0        # 已解码到的位置
+        self.lead = 0       # 路径开头已输出过的字数 (为三元上下文保留)
+        self.committed_at = 0
+        self.checked_at = 0
+        self.output_len = 0
+
+    # ---------- 对外接口 ----------
+    def feed(self, text):
+        """ 读入一段拼音，返回这一次新确定的汉字 """
+        self.buf += text
+        self.length += len(text)
+        # 位置 i 的出边要看到 i+max_len 为止的输入才能确定
+        return self._advance(self.length - self.span)
+
+    def finish(self):
+        """ 输入结束，返回剩余部分的最优结果 """
+        out = self._advance(self.length)
+        state = self.states.get(self.length)
+        if state is None or state is _INITIAL: return out
+        best = self.decoder.results(state, 1)
+        rest = best[0][self.lead:] if best else ""
+        self.output_len += len(rest)
+        return out + rest
+
+    def peek(self):
+        """ 输入若到此结束，finish() 会返回的内容；解码状态保持不变，之后仍可继续 feed() """
+        saved = dict(self.__dict__)
+        # 状态对象本身不会被原地修改 (step / rebase / prune 都返回新对象)，复制各位置的表即可
+        self.edges, self.skips, self.states = dict(self.edges), dict(self.skips), dict(self.states)
+        try:
+            return self.finish()
+        finally:
+            self.__dict__.update(saved)
+
+    # ---------- 内部 ----------
+    def _advance(self, last_edge):
+        """ 建立到 last_edge 为止的出边，并解码所有入边已齐全的位置 """
+        if last_edge >= self.next_edge:
+            dag = self.trie.build_dag(self.buf, self.next_edge - self.base)
+            for i, edges in enumerate(dag[:last_edge - self.next_edge + 1], self.next_edge):
+                # build_dag 给出的终点是缓冲区内的下标
+                self.edges[i] = [(end + self.base, py) for end, py in edges]
+            self.next_edge = last_edge + 1
+        out = []
+        # 位置 j 的入边来自 j 之前的位置，这些位置的出边都已确定即可解码
+        for j in range(self.pos + 1, min(self.next_edge, self.length) + 1):
+            self._decode(j)
+            self.pos = j
+            text = self._commit(j)
+            if text: out.append(text)
+        self._trim()
+        return "".join(out)
+
+    def _decode(self, j):
+        best, incoming = None, []
+        for i in range(max(0, j - self.span), j):
+            if self.skips.get(i) is None: continue
+            for end, py in self.edges[i]:
+                if end != j: continue
+                cost = self.skips[i] + (1 if py is None and self.buf[i - self.base] not in SEPARATORS else 0)
+                if best is None or cost < best:
+                    best, incoming = cost, []
+                elif cost > best:
+                    continue
+                incoming.append((i, py))
+        self.skips[j] = best
+        if best is None:
+            self.states[j] = None
+            return
+        decoder, width = self.decoder, self.width
+        parts = []
+        for i, py in incoming:
+            prev = self.states[i]
+            if py is None:
+                parts.append(prev)
+            elif prev is _INITIAL:
+                parts.append(decoder.start_state(py, width))
+            else:
+                parts.append(decoder.step(prev, py, width))
+        if any(p is _INITIAL for p in parts):
+            self.states[j] = _INITIAL
+        else:
+            self.states[j] = decoder.merge(parts, width)
+
+    def _live(self, j):
+        """ 之后还可能被扩展的状态所在位置：j 本身，以及有出边越过 j 的更早位置 """
+        live = []
+        for i in range(max(0, j - self.span + 1), j + 1):
+            if self.states.get(i) is None: continue
+            if i == j or any(end > j for end, py in self.edges.get(i, ())): live.append(i)
+        return live
+
+    def _commit(self, j):
+        live = self._live(j)
+        # 句首 (尚无汉字) 的状态还可能被更长的音节扩展，这时没有公共前缀
+        if not live or any(self.states[i] is _INITIAL for i in live): return ""
+        forced = j - self.committed_at > self.window
+        # 只在所有切分汇合到一个状态的位置上检查，且隔一段才检查一次；超出窗口时每个位置都检查
+        if not forced and (len(live) > 1 or j - self.checked_at < CHECK_INTERVAL): return ""
+        self.checked_at = j
+        decoder = self.decoder
+        # 末两字相同的路径以后的得分增量相同，其中得分较低的永远不会成为最优路径，不必等它们收敛
+        paths = {i: decoder.survivors(self.states[i]) for i in live}
+        prefix = os.path.commonprefix([p for ps in paths.values() for p in ps])
+        if forced:
+            best = decoder.results(self.states[j] if j in live else self.states[live[-1]], 1)[0]
+            if len(best) - FORCE_KEEP > len(prefix):
+                prefix = best[:len(best) - FORCE_KEEP]
+                for i in live:
+                    self.states[i] = decoder.prune(self.states[i], prefix)
+                    if self.states[i] is None: self.skips[i] = None  # 整体被丢弃
+        if len(prefix) <= self.lead: return ""
+        keep = min(CONTEXT_KEEP, len(prefix))
+        # 不在公共前缀上的只有被压制的路径，照样截掉开头，保留它们以免改变之后 beam 的裁剪
+        for i in live:
+            self.states[i] = decoder.rebase(self.states[i], len(prefix) - keep, keep)
+        text = prefix[self.lead:]
+        self.lead = keep
+        self.committed_at = j
+        self.output_len += len(text)
+        return text
+
+    def _trim(self):
+        """ 丢弃不会再被用到的位置与输入 """
+        low = self.pos - self.span
+        for table in (self.states, self.skips, self.edges):
+            for i in [i for i in table if i < low]:
+                del table[i]
+        cut = min(low, self.next_edge) - self.base
+        if cut > 0:
+            self.buf = self.buf[cut:]
+            self.base += cut
+
+
+class StreamSession:
+    """
+    逐键输入的超长文本：新输入以上一次的输入开头时只把追加的部分喂给 StreamDecoder，
+    退格、中间修改等其他编辑，以及模型、解码器或用户词库变化后，从头开始
+    """
+    def __init__(self, model, window=STREAM_WINDOW):
+        self.model = model
+        self.window = window
+        self.stream = None
+        self.text = ""
+        self.done = ""   # 已确定的汉字
+
+    def update(self, text):
+        """ 返回整段输入当前的最优结果 """
+        model, stream = self.model, self.stream
+        if (stream is None or not text.startswith(self.text) or stream.decoder is not model.get_decoder()
+                or stream.width != model.beam_width or stream.trie is not model.lattice_trie()
+                or stream.user_version != model.bigram.user_version):
+            stream = self.stream = StreamDecoder(model, self.window)
+            self.text, self.done = "", ""
+        self.done += stream.feed(text[len(self.text):])
+        self.text = text
+        return self.done + stream.peek()
+
+
+def decode_stream(model, chunks, window=STREAM_WINDOW):
+    """
+    流式转换：chunks 是拼音文本片段的可迭代对象 (例如逐行读取的文件)
+    每读入一段就产出其中已确定的汉字，全部产出拼接起来就是整段的结果
+    """
+    stream = StreamDecoder(model, window)
+    for chunk in chunks:
+        out = stream.feed(chunk)
+        if out: yield out
+    out = stream.finish()
+    if out: yield out
@@ -0,0 +1,398 @@
+import os
+import re
+import sys
+import math
+import time
+import heapq
+import shutil
+import argparse
+import itertools
+import tempfile
+from queue import Empty, Full
+from collections import Counter
+from multiprocessing import Process, Queue
+
+# 训练：从原始语料统计 CharFreq.txt / Bigram.txt (可选 Trigram.txt)，格式与 HMM_Model.load_data 读取的一致
+#
+#   python train.py corpus/ news.txt -o out/                 统计字频与二元组
+#   python train.py corpus/ -o out/ --order 3 --compile      同时统计三字组，并直接生成 model.cache
+#
+# 主进程按块 (在换行处切开) 读文件，经有界队列分给工作进程，读得再快也只有固定几块在途。
+# 每个工作进程在自己的计数表里累加，表的键数超过上限时按键排序写成临时文件 (溢写)，
+# 最后主进程把所有临时文件多路归并、同键相加；过滤后的条目再按频率外部排序 (同样分批排序、溢写、归并)
+# 后写出，内存占用与语料大小、n 元组种数都无关。
+# 只统计连续汉字串内部的 n 元组，标点、字母、换行都会切断上下文。
+
+CHUNK_BYTES = 4 << 20
+MAX_KEYS = 1000000   # 所有工作进程合计在内存中保留的 n 元组键数
+MIN_COUNT = 2        # 二元/三元组的最低频次
+POLL_S = 1.0         # 主进程等待队列时检查工作进程是否还活着的间隔
+SEP = "\n"
+
+_HAN = re.compile(r'[一-鿿]+')
+
+
+def _detect_encoding(path):
+    """
+    从第一个非 ASCII 字节起取一段，能按 UTF-8 解码就当 UTF-8，否则按 gb18030
+    开头是纯 ASCII (英文标题、代码、空行) 的文件不会因此被误判为 UTF-8
+    """
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block or not block.isascii(): break
+        if not block: return 'utf-8-sig'  # 纯 ASCII，两种编码相同
+        start = next(i for i, b in enumerate(block) if b >= 0x80)
+        head = block[start:start + (1 << 16)]
+        if len(head) < 1 << 16: head += f.read((1 << 16) - len(head))
+    # 末尾可能截断了一个多字节字符
+    for cut in range(4):
+        try:
+            head[:len(head) - cut].decode('utf-8')
+            return 'utf-8-sig'
+        except UnicodeDecodeError:
+            continue
+    return 'gb18030'
+
+
+def _expand(paths):
+    """ 目录展开为其下所有文件 (按路径排序，保证结果可复现) """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in sorted(os.walk(path)):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_chunks(paths, chunk_bytes=CHUNK_BYTES, encoding="auto"):
+    """
+    产出 (字节块, 编码)，块在换行处切开
+    两种编码里 0x0A 都不会出现在多字节字符中间；没有换行的超长行按块大小硬切，最多丢掉切口处一个字
+    """
+    for path in _expand(paths):
+        enc = _detect_encoding(path) if encoding == "auto" else encoding
+        with open(path, 'rb') as f:
+            rest = b""
+            while True:
+                block = f.read(chunk_bytes)
+                if not block:
+                    if rest: yield rest, enc
+                    break
+                block = rest + block
+                cut = block.rfind(b"\n") + 1
+                if cut == 0:
+                    if len(block) < chunk_bytes * 4:
+                        rest = block
+                        continue
+                    cut = len(block)
+                yield block[:cut], enc
+                rest = block[cut:]
+
+
+class _Shard:
+    """ 一个工作进程的计数：n 元组表超过 max_keys 时按键排序溢写为临时文件 """
+    def __init__(self, tmpdir, order=2, max_keys=MAX_KEYS):
+        self.tmpdir = tmpdir
+        self.order = order
+        self.max_keys = max_keys
+        self.unigrams = Counter()
+        self.tables = [Counter() for _ in range(order - 1)]  # [二元, 三元]
+        self.runs = [[] for _ in range(order - 1)]
+        self.tokens = 0
+        self.bytes = 0
+        self.errors = 0   # 无法按编码解码、被替换掉的字符数
+
+    def feed(self, block, encoding):
+        self.bytes += len(block)
+        try:
+            text = block.decode(encoding)
+        except UnicodeDecodeError:
+            # 坏字节替换为 U+FFFD 后照常统计 (它不是汉字，会切断上下文)，次数最后报告给调用方
+            text = block.decode(encoding, errors='replace')
+            self.errors += text.count('\ufffd')
+        # 各汉字串用换行连接后整体计数 (在 C 层完成)，跨串的组合在溢写时丢弃
+        text = SEP.join(_HAN.findall(text))
+        if not text: return
+        self.unigrams.update(text)
+        for k, table in enumerate(self.tables):
+            # 用迭代器逐个生成，不把整块的 n 元组串同时留在内存里
+            grams = text
+            for i in range(1, k + 2):
+                grams = map(str.__add__, grams, text[i:])
+            table.update(grams)
+            if len(table) > self.max_keys: self._spill(k)
+
+    def _spill(self, k):
+        table = self.tables[k]
+        fd, path = tempfile.mkstemp(suffix=f".{k + 2}gram", dir=self.tmpdir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(f"{key}\t{count}\n" for key, count in sorted(table.items()) if SEP not in key)
+        self.runs[k].append(path)
+        table.clear()
+
+    def finish(self):
+        for k, table in enumerate(self.tables):
+            if table: self._spill(k)
+        self.unigrams.pop(SEP, None)
+        self.tokens = sum(self.unigrams.values())
+        return self.unigrams, self.runs, self.tokens, self.bytes, self.errors
+
+
+def _worker(tasks, results, tmpdir, order, max_keys):
+    try:
+        shard = _Shard(tmpdir, order, max_keys)
+        for block, encoding in iter(tasks.get, None):
+            shard.feed(block, encoding)
+        results.put(shard.finish())
+    except Exception as e:
+        # 溢写时磁盘满之类的错误交给主进程报告；以非零状态退出，主进程不会再往队列里塞块
+        results.put(e)
+        sys.exit(1)
+
+
+def _check_workers(workers, results):
+    """ 有工作进程异常退出 (出错，或被 OOM 杀掉来不及报告) 时抛出，避免主进程在队列上永远阻塞 """
+    for w in workers:
+        if w.exitcode in (None, 0): continue
+        reason = f"exitcode={w.exitcode}"
+        try:
+            while True:
+                item = results.get_nowait()
+                if isinstance(item, Exception):
+                    reason = repr(item)
+                    break
+        except Empty:
+            pass
+        raise RuntimeError(f"统计进程 {w.pid} 异常退出: {reason}")
+
+
+def _put(tasks, item, workers, results):
+    while True:
+        try:
+            return tasks.put(item, timeout=POLL_S)
+        except Full:
+            _check_workers(workers, results)
+
+
+def _get(results, workers):
+    while True:
+        try:
+            item = results.get(timeout=POLL_S)
+            break
+        except Empty:
+            _check_workers(workers, results)
+            if any(w.is_alive() for w in workers): continue
+            # 都已正常退出：交出的结果此时一定已在管道里，再取一次仍取不到就是丢了
+            try:
+                item = results.get(timeout=POLL_S)
+                break
+            except Empty:
+                raise RuntimeError("统计进程未返回结果就退出了") from None
+    if isinstance(item, Exception): raise RuntimeError(f"统计进程出错: {item!r}")
+    return item
+
+
+def count_corpus(paths, tmpdir, jobs=None, order=2, encoding="auto", chunk_bytes=CHUNK_BYTES, max_keys=MAX_KEYS):
+    """
+    并行统计
+    :return: (一元计数 Counter, 各阶溢写文件 [[二元...], [三元...]], 字数, 字节数, 解码错误数)
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = read_chunks(paths, chunk_bytes, encoding)
+    if jobs == 1:
+        shard = _Shard(tmpdir, order, max_keys)
+        for block, enc in chunks:
+            shard.feed(block, enc)
+        return shard.finish()
+
+    tasks, results = Queue(maxsize=jobs * 2), Queue()
+    workers = [Process(target=_worker, args=(tasks, results, tmpdir, order, max(1, max_keys // jobs)), daemon=True)
+               for _ in range(jobs)]
+    for w in workers:
+        w.start()
+    try:
+        for chunk in chunks:
+            _put(tasks, chunk, workers, results)
+        for _ in workers:
+            _put(tasks, None, workers, results)
+        unigrams, runs, tokens, nbytes, errors = Counter(), [[] for _ in range(order - 1)], 0, 0, 0
+        for _ in workers:
+            uni, shard_runs, shard_tokens, shard_bytes, shard_errors = _get(results, workers)
+            unigrams.update(uni)
+            for k, paths_k in enumerate(shard_runs):
+                runs[k].extend(paths_k)
+            tokens += shard_tokens
+            nbytes += shard_bytes
+            errors += shard_errors
+    finally:
+        for w in workers:
+            w.join(timeout=1)
+            if w.is_alive(): w.terminate()
+        # 出错时队列里可能还有没人取的块，不等它们写完，否则主进程退出时卡在队列的后台线程上
+        tasks.cancel_join_thread()
+    return unigrams, runs, tokens, nbytes, errors
+
+
+def _read_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, count = line.rstrip('\n').split('\t')
+            yield key, int(count)
+
+
+def _by_count(item):
+    return -item[1], item[0]
+
+
+def sort_by_count(items, tmpdir, max_keys=MAX_KEYS):
+    """
+    按 (频率降序, 键) 外部排序：每 max_keys 条排好后写成临时文件，最后多路归并
+    :return: (有序的 (键, 次数) 迭代器, 总次数)；迭代器读完前临时文件不能删除
+    """
+    paths, total = [], 0
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, max_keys))
+        if not batch: break
+        total += sum(count for _, count in batch)
+        batch.sort(key=_by_count)
+        fd, path = tempfile.mkstemp(suffix=".sorted", dir=tmpdir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(f"{key}\t{count}\n" for key, count in batch)
+        paths.append(path)
+        del batch
+    return heapq.merge(*(_read_run(p) for p in paths), key=_by_count), total
+
+
+def merge_runs(paths):
+    """ 多路归并若干按键有序的临时文件，同键计数相加，按键序产出 (键, 次数) """
+    merged = heapq.merge(*(_read_run(p) for p in paths))
+    for key, group in itertools.groupby(merged, key=lambda x: x[0]):
+        yield key, sum(count for _, count in group)
+
+
+# ---------- 输出 ----------
+HEADER = "/* Columns are tab delimited. 行间分隔符为Tab键。*/\n"
+
+
+def _readings(data_dir):
+    """ 汉字 -> 读音列 ('/' 分隔)：优先沿用现有 CharFreq.txt 第 5 列，其余由 pinyin.txt 反查 """
+    read = {}
+    path = os.path.join(data_dir, "pinyin.txt") if data_dir else None
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='gb18030') as f:
+            for line in f:
+                line = line.strip()
+                if ':' not in line: continue
+                pinyin, chars = line.split(':')
+                for c in chars:
+                    read.setdefault(c, []).append(pinyin)
+        read = {c: "/".join(pys) for c, pys in read.items()}
+    path = os.path.join(data_dir, "CharFreq.txt") if data_dir else None
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='gb18030') as f:
+            for line in f:
+                if line.startswith('/*'): continue
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) >= 5 and parts[4]: read[parts[1]] = parts[4]
+    return read
+
+
+def write_charfreq(path, unigrams, readings=None):
+    readings = readings or {}
+    total = sum(unigrams.values())
+    cum = 0
+    with open(path, 'w', encoding='gb18030') as f:
+        f.write(f"/* 由 train.py 统计，共 {total} 字 */\n")
+        f.write(HEADER)
+        f.write("/* 序号\t汉字\t频率\t累计频率(%)\t拼音 */\n")
+        for i, (char, count) in enumerate(sorted(unigrams.items(), key=lambda x: (-x[1], x[0])), 1):
+            cum += count
+            f.write(f"{i}\t{char}\t{count}\t{cum * 100.0 / total:.12g}\t{readings.get(char, '')}\n")
+
+
+def write_ngrams(path, items, unigrams, title, total=None):
+    """
+    写出 序号/n元组/频率/相互信息/累计频率 五列 (与 Bigram.txt 相同)
+    相互信息 = log2( P(词) / ΠP(字) )
+    给出 total (全部条目的总次数) 时 items 应已按频率降序排好，逐条写出，不在内存中排序
+    """
+    if total is None:
+        items = sorted(items, key=_by_count)
+        total = sum(count for _, count in items)
+    total = total or 1
+    total_chars = sum(unigrams.values())
+    cum = 0
+    n = 0
+    with open(path, 'w', encoding='gb18030') as f:
+        f.write(HEADER)
+        f.write(f"/* 序列号\t{title}\t频率\t相互信息分值*/\n")
+        for n, (gram, count) in enumerate(items, 1):
+            cum += count
+            indep = sum(math.log2(unigrams[c] / total_chars) for c in gram)
+            f.write(f"{n}\t{gram}\t{count}\t{math.log2(count / total) - indep:.12g}\t{cum}\n")
+    return n
+
+
+def train(paths, out_dir, jobs=None, order=2, min_count=MIN_COUNT, encoding="auto",
+          chunk_bytes=CHUNK_BYTES, max_keys=MAX_KEYS, data_dir=None):
+    """ 统计并写出语料文件，返回统计信息 """
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    tmpdir = tempfile.mkdtemp(prefix="train_", dir=out_dir)
+    try:
+        unigrams, runs, tokens, nbytes, errors = count_corpus(paths, tmpdir, jobs, order, encoding, chunk_bytes, max_keys)
+        count_s = time.perf_counter() - t0
+        write_charfreq(os.path.join(out_dir, "CharFreq.txt"), unigrams, _readings(data_dir))
+        stats = {"tokens": tokens, "bytes": nbytes, "chars": len(unigrams), "decode_errors": errors,
+                 "spill_files": sum(len(r) for r in runs), "count_s": count_s}
+        for k, (name, title) in enumerate((("Bigram.txt", "双字组"), ("Trigram.txt", "三字组"))[:order - 1]):
+            # 归并结果边过滤边按频率外部排序，同一时刻最多 max_keys 条在内存里
+            kept = ((gram, c) for gram, c in merge_runs(runs[k]) if c >= min_count)
+            ordered, total = sort_by_count(kept, tmpdir, max_keys)
+            stats[name] = write_ngrams(os.path.join(out_dir, name), ordered, unigrams, title, total)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    stats["total_s"] = time.perf_counter() - t0
+    return stats
+
+
+def main(argv=None):
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    parser = argparse.ArgumentParser(description="由原始语料统计 CharFreq.txt / Bigram.txt")
+    parser.add_argument("corpus", nargs="+", help="语料文件或目录 (UTF-8 或 gb18030 纯文本)")
+    parser.add_argument("-o", "--output", required=True, help="输出目录")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="工作进程数 (默认 CPU 核数)")
+    parser.add_argument("-d", "--data", default=default_data, help="现有语料目录，用于读音列与 pinyin.txt")
+    parser.add_argument("--order", type=int, choices=[2, 3], default=2, help="3 表示同时生成 Trigram.txt")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT, help="二元/三元组的最低频次")
+    parser.add_argument("--encoding", default="auto", help="语料编码 (默认按文件自动判断)")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / (1 << 20), help="每块大小 (MB)")
+    parser.add_argument("--max-keys", type=int, default=MAX_KEYS, help="内存中最多保留的 n 元组键数，超过即溢写")
+    parser.add_argument("--compile", action="store_true", help="同时生成 model.cache (缺 pinyin.txt 时从 -d 复制)")
+    args = parser.parse_args(argv)
+
+    stats = train(args.corpus, args.output, args.jobs, args.order, args.min_count, args.encoding,
+                  int(args.chunk_mb * (1 << 20)), args.max_keys, args.data)
+    tokens, count_s, total_s = stats["tokens"], stats["count_s"], stats["total_s"]
+    print(f"共 {tokens} 字 ({stats['bytes'] / (1 << 20):.1f} MB), 统计用时 {count_s:.2f}s, "
+          f"{tokens / count_s if count_s else 0:,.0f} 字/秒 | 溢写文件 {stats['spill_files']} 个 | 总用时 {total_s:.2f}s")
+    if stats["decode_errors"]:
+        print(f"[Warn] 有 {stats['decode_errors']} 处字节无法按所判断的编码解码，已跳过；"
+              f"结果可能缺少部分文本，请检查语料编码或用 --encoding 指定")
+    print(f"输出: 汉字 {stats['chars']} | " + " | ".join(f"{name} {stats[name]} 条"
+                                                      for name in ("Bigram.txt", "Trigram.txt") if name in stats))
+
+    if args.compile:
+        from main import HMM_Model
+        target = os.path.join(args.output, "pinyin.txt")
+        if not os.path.exists(target): shutil.copy(os.path.join(args.data, "pinyin.txt"), target)
+        HMM_Model(kb_dir=None).load_from_dir(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
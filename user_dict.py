@@ -0,0 +1,236 @@
+import os
+import math
+import queue
+import threading
+
+from session import normalize
+
+# 用户词库：记录用户上屏的候选，在线学习
+#   phrases  拼音 (去掉分隔符) -> {词: 次数}，输入完全相同时直接命中，排在 HMM 候选之前
+#   pairs    (前字, 后字) -> 次数，叠加到二元转移分数上，长句中也能用上学到的搭配
+#   starts   首字 -> 次数，叠加到初始概率上 (加 log(1+次数)，但不超过语料中最常见首字的初始概率)
+#
+# 持久化：快照文件 + 追加日志 (path 与 path.log)
+#   learn() 只改内存并把一行放进队列，由后台线程追加写入日志，输入不会等磁盘
+#   日志行数超过词库条数 (至少 COMPACT_MIN_LINES)，或大小超过 COMPACT_MAX_BYTES 时，由同一后台线程合并为新快照并清空日志；
+#   启动时读到的日志已超限的，加载完立即合并。两个文件首行记录代数，
+#   合并到一半中断时 (快照已替换、日志未清空) 代数不一致，旧日志被忽略而不会重复计数
+
+USER_PRIOR = 2.0       # 学到的转移概率 = 次数 / (次数 + USER_PRIOR)
+COMPACT_MIN_LINES = 1000
+COMPACT_MAX_BYTES = 1 << 20   # 词库很大时按行数要很久才合并，日志大小另设上限
+
+
+def phrase_key(pinyin):
+    return normalize(pinyin).replace("'", "")
+
+
+class UserDict:
+    def __init__(self, path=None):
+        self.path = path
+        self.phrases = {}
+        self.pairs = {}
+        self.starts = {}
+        self.store = None
+        self._start_cap = 0.0   # 学到的初始概率上限，bind() 时取该 store 的最大初始概率
+        self.generation = 0
+        self._log_lines = 0
+        self._log_bytes = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = None
+        if path: self.load()
+
+    def __len__(self):
+        return sum(len(words) for words in self.phrases.values())
+
+    # ---------- 学习与查询 ----------
+    def _apply(self, key, word, count):
+        words = self.phrases.get(key)
+        if words is None: words = self.phrases[key] = {}
+        words[word] = words.get(word, 0) + count
+        self.starts[word[0]] = self.starts.get(word[0], 0) + count
+        for pair in zip(word, word[1:]):
+            self.pairs[pair] = self.pairs.get(pair, 0) + count
+
+    def learn(self, pinyin, word):
+        """ 记录一次选择；返回 False 表示输入无效未学习 """
+        key = phrase_key(pinyin)
+        if not key or not word or '\t' in word or '\n' in word: return False
+        with self._lock:
+            self._apply(key, word, 1)
+            if self.path: self._enqueue(f"{key}\t{word}\n")
+        if self.store is not None: self._overlay(self.store, word)
+        return True
+
+    def lookup(self, pinyin):
+        """ 该拼音学过的词，按选择次数从多到少 """
+        key = phrase_key(pinyin)
+        with self._lock:  # learn() 可能在别的线程里同时改这张表
+            words = self.phrases.get(key)
+            if not words: return []
+            return sorted(words, key=words.get, reverse=True)
+
+    # ---------- 叠加到 BigramStore ----------
+    def _pair_score(self, store, prev_id, curr_id, count):
+        user = math.log(count / (count + USER_PRIOR))
+        base = store.lookup(prev_id, curr_id)
+        return user if base is None or user > base else base
+
+    def _start_score(self, store, cid, count):
+        return min(self._start_cap, store.start[cid] + math.log1p(count))
+
+    def _overlay(self, store, word):
+        """ 只更新 word 涉及的那几项 """
+        ids = store.char_ids
+        n = len(store)
+        first = ids.get(word[0])
+        if first is not None:
+            store.user_start[first] = self._start_score(store, first, self.starts[word[0]])
+            store.user_log.append(('s', first))
+        for a, b in zip(word, word[1:]):
+            if a in ids and b in ids:
+                pid, cid = ids[a], ids[b]
+                key = pid * n + cid
+                store.user_trans[key] = self._pair_score(store, pid, cid, self.pairs[(a, b)])
+                store.user_log.append(('t', key))
+        store.user_version += 1
+
+    def bind(self, store):
+        """ 模型 (重新) 加载后把全部学习结果换算成该 store 的 ID 并挂上 """
+        self.store = store
+        self._start_cap = max(store.start, default=0.0)
+        ids = store.char_ids
+        n = len(store)
+        user_trans, user_start = {}, {}
+        for (a, b), count in self.pairs.items():
+            if a in ids and b in ids:
+                user_trans[ids[a] * n + ids[b]] = self._pair_score(store, ids[a], ids[b], count)
+        for c, count in self.starts.items():
+            if c in ids: user_start[ids[c]] = self._start_score(store, ids[c], count)
+        store.user_trans = user_trans
+        store.user_start = user_start
+        store.user_log = []
+        store.user_version += 1
+
+    # ---------- 持久化 ----------
+    @property
+    def log_path(self):
+        return self.path + ".log"
+
+    @staticmethod
+    def _read_generation(f):
+        head = f.readline()
+        if head.startswith("# gen ") and head[6:].strip().isdigit(): return int(head[6:])
+        f.seek(0)
+        return 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.generation = self._read_generation(f)
+                for line in f:
+                    # 损坏的行 (写到一半、被手工改坏) 跳过，不影响其余条目
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 3 and parts[0] and parts[1] and parts[2].isdigit():
+                        self._apply(parts[0], parts[1], int(parts[2]))
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                stale = self._read_generation(f) != self.generation
+                if not stale:
+                    for line in f:
+                        parts = line.rstrip('\n').split('\t')
+                        if len(parts) == 2 and parts[0] and parts[1]:
+                            self._apply(parts[0], parts[1], 1)
+                            self._log_lines += 1
+            # 上次合并中断留下的旧日志，内容已在快照里
+            if stale: os.remove(self.log_path)
+            else: self._log_bytes = os.path.getsize(self.log_path)
+        if self._needs_compact():
+            try:
+                self._compact()
+            except OSError as e:
+                print(f"[Warn] 合并用户词库失败: {e}")
+
+    def _needs_compact(self):
+        return self._log_lines >= max(COMPACT_MIN_LINES, len(self.phrases)) or self._log_bytes >= COMPACT_MAX_BYTES
+
+    def _enqueue(self, line):
+        if self._writer is None:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        self._queue.put(line)
+
+    def _write_loop(self):
+        q = self._queue
+        f = None
+        running = True
+        while running:
+            lines = [q.get()]
+            while True:
+                try:
+                    lines.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                running = False
+                lines = lines[:lines.index(None)]
+            if not lines: continue
+            try:
+                if f is None:
+                    new = not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0
+                    f = open(self.log_path, 'a', encoding='utf-8')
+                    if new: f.write(f"# gen {self.generation}\n")
+                f.writelines(lines)
+                f.flush()
+                self._log_lines += len(lines)
+                self._log_bytes = f.tell()
+                if self._needs_compact():
+                    f.close()
+                    f = None
+                    self._compact()
+            except OSError as e:
+                print(f"[Warn] 写入用户词库失败: {e}")
+        if f is not None: f.close()
+
+    def _compact(self):
+        """ 写出新快照并清空日志 (在后台线程中执行) """
+        with self._lock:
+            snapshot = [(key, dict(words)) for key, words in self.phrases.items()]
+            # 已排队但未写入的行都包含在快照中，丢弃以免重复计数
+            pending = []
+            while self._queue is not None:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            generation = self.generation + 1
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f"# gen {generation}\n")
+            for key, words in snapshot:
+                for word, count in words.items():
+                    f.write(f"{key}\t{word}\t{count}\n")
+        os.replace(tmp, self.path)
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            f.write(f"# gen {generation}\n")
+            self._log_bytes = f.tell()
+        self.generation = generation
+        self._log_lines = 0
+        if None in pending: self._queue.put(None)
+
+    def compact(self):
+        """ 立即合并 (等待已排队的写入完成) """
+        if not self.path: return
+        self.close()
+        self._compact()
+
+    def close(self):
+        """ 等待日志写完；之后的 learn() 会重新启动写线程 """
+        writer = self._writer
+        if writer is None: return
+        self._queue.put(None)
+        writer.join()
+        self._writer = None
+        self._queue = None
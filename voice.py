@@ -1,26 +1,265 @@
-import speech_recognition as sr
+import os
+import sys
+import time
+import wave
+import queue
+import argparse
+import tempfile
+import threading
 
+try:
+    import speech_recognition as sr
+    SR_AVAILABLE = True
+except ImportError:
+    sr = None
+    SR_AVAILABLE = False
+
+# 语音输入流水线：录音与识别分开，说话不会因为上一句还在识别而丢失
+#
+#   采集线程 (AudioSource)  ->  有界队列  ->  识别线程池 (RecognizerBackend × N)  ->  按顺序输出
+#
+# 采集线程只在开始时校准一次环境噪音，之后持续切分语音段放入队列；队列满时采集线程等待，内存有上限。
+# 识别是网络请求，多个线程同时进行；结果按语音段的先后顺序交付，不会因为后一句先识别完而乱序。
+# 后端是可替换的：GoogleBackend 调用在线识别，WavBackend 读取 WAV 旁的文本并模拟识别耗时，
+# 配合 WavSource 可在没有麦克风和网络的环境下测吞吐与端到端延迟 (python voice.py --bench)。
+
+CALIBRATION_S = 0.5     # 环境噪音校准时长 (只做一次)
+LISTEN_TIMEOUT_S = 5    # 多久没听到声音算一次静音超时 (继续监听，不报错)
+PHRASE_LIMIT_S = 10     # 单段语音的最长时长
+QUEUE_SIZE = 8          # 等待识别的语音段上限
+WORKERS = 3             # 同时进行的识别请求数
+
+
+class Segment:
+    """ 一段待识别的语音 """
+    __slots__ = ("seq", "audio", "duration", "captured_at", "label")
+
+    def __init__(self, seq, audio, duration, captured_at, label=None):
+        self.seq = seq                  # 采集顺序
+        self.audio = audio              # 后端能识别的音频对象 (sr.AudioData 或 WAV 路径)
+        self.duration = duration        # 秒
+        self.captured_at = captured_at  # 这段话说完 (采集完成) 的时刻，perf_counter
+        self.label = label              # WAV 旁的参考文本 (WavBackend 用)
+
+
+class VoiceResult:
+    __slots__ = ("seq", "success", "text", "latency")
+
+    def __init__(self, seq, success, text, latency):
+        self.seq = seq
+        self.success = success
+        self.text = text
+        self.latency = latency  # 从说完到结果交付的秒数
+
+
+# ---------- 音频来源 ----------
+class AudioSource:
+    """ segments(stop) 逐个产出 Segment，stop 是 threading.Event，置位后应尽快结束 """
+    def segments(self, stop):
+        raise NotImplementedError
+
+
+class MicrophoneSource(AudioSource):
+    def __init__(self, timeout=LISTEN_TIMEOUT_S, phrase_limit=PHRASE_LIMIT_S, calibration=CALIBRATION_S):
+        self.timeout = timeout
+        self.phrase_limit = phrase_limit
+        self.calibration = calibration
+
+    def segments(self, stop):
+        recognizer = sr.Recognizer()
+        with sr.Microphone() as source:
+            # 只在开始时校准一次环境噪音
+            recognizer.adjust_for_ambient_noise(source, duration=self.calibration)
+            seq = 0
+            while not stop.is_set():
+                try:
+                    audio = recognizer.listen(source, timeout=self.timeout, phrase_time_limit=self.phrase_limit)
+                except sr.WaitTimeoutError:
+                    continue  # 静音超时，继续听
+                duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+                yield Segment(seq, audio, duration, time.perf_counter())
+                seq += 1
+
+
+class WavSource(AudioSource):
+    """
+    逐个读取 WAV 文件作为语音段 (每个文件一段话)，同名 .txt 为参考文本
+    realtime 为 True 时按音频时长等待，模拟有人在连续说话；speed 为时间加速倍数
+    """
+    def __init__(self, paths, realtime=True, gap=0.3, speed=1.0):
+        self.paths = list(paths)
+        self.realtime = realtime
+        self.gap = gap
+        self.speed = speed
+
+    def segments(self, stop):
+        for seq, path in enumerate(self.paths):
+            if stop.is_set(): return
+            with wave.open(path, 'rb') as w:
+                duration = w.getnframes() / w.getframerate()
+            if self.realtime: time.sleep((duration + self.gap) / self.speed)
+            label = None
+            txt = os.path.splitext(path)[0] + ".txt"
+            if os.path.exists(txt):
+                with open(txt, 'r', encoding='utf-8') as f:
+                    label = f.read().strip()
+            yield Segment(seq, path, duration, time.perf_counter(), label)
+
+
+# ---------- 识别后端 ----------
+class RecognizerBackend:
+    """ recognize(segment) -> (success, text)；每个识别线程各自创建一个后端实例 """
+    def recognize(self, segment):
+        raise NotImplementedError
+
+
+class GoogleBackend(RecognizerBackend):
+    def __init__(self, language='zh-CN'):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, segment):
+        audio = segment.audio
+        if isinstance(audio, str):  # WAV 文件
+            with sr.AudioFile(audio) as source:
+                audio = self.recognizer.record(source)
+        try:
+            # 调用 Google 免费 API (需联网)
+            return True, self.recognizer.recognize_google(audio, language=self.language)
+        except sr.UnknownValueError:
+            return False, "无法识别 (没听清)"
+        except sr.RequestError as e:
+            return False, f"网络请求失败: {e}"
+
+
+class WavBackend(RecognizerBackend):
+    """ 离线替身：返回 WAV 旁的参考文本，按 固定延迟 + 音频时长 × 系数 等待，模拟在线识别的耗时 """
+    def __init__(self, delay=0.8, per_second=0.1, speed=1.0):
+        self.delay = delay
+        self.per_second = per_second
+        self.speed = speed
+
+    def recognize(self, segment):
+        time.sleep((self.delay + segment.duration * self.per_second) / self.speed)
+        if segment.label is None: return False, "无法识别 (没听清)"
+        return True, segment.label
+
+
+# ---------- 流水线 ----------
+class VoicePipeline:
+    def __init__(self, source, backend_factory, workers=WORKERS, queue_size=QUEUE_SIZE):
+        """
+        :param source: AudioSource
+        :param backend_factory: 无参函数，返回 RecognizerBackend (每个识别线程调用一次)
+        """
+        self.source = source
+        self.backend_factory = backend_factory
+        self.workers = workers
+        self._segments = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._pending = {}    # 已识别、等待前面的段先交付的结果 seq -> VoiceResult
+        self._next = 0        # 下一个应交付的 seq
+        self._lock = threading.Lock()
+        self._running = 0     # 尚未退出的识别线程数
+        self._threads = []
+
+    def start(self):
+        self._running = self.workers
+        capture = threading.Thread(target=self._capture, daemon=True)
+        self._threads = [capture] + [threading.Thread(target=self._recognize, daemon=True)
+                                     for _ in range(self.workers)]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        """ 设置停止标记后立即返回；采集线程在当前这段录完后结束 """
+        self._stop.set()
+
+    def results(self, timeout=None):
+        """ 按采集顺序产出 VoiceResult；来源结束且全部交付后 (或 stop() 后) 停止 """
+        while True:
+            try:
+                item = self._results.get(timeout=timeout)
+            except queue.Empty:
+                if self._stop.is_set(): return
+                continue
+            if item is None: return
+            yield item
+
+    def _capture(self):
+        try:
+            for segment in self.source.segments(self._stop):
+                # 队列满时等待 (期间仍检查停止标记)
+                while not self._stop.is_set():
+                    try:
+                        self._segments.put(segment, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if self._stop.is_set(): break
+        except Exception as e:
+            self._results.put(VoiceResult(-1, False, f"麦克风错误: {e}", 0.0))
+        finally:
+            for _ in range(self.workers):
+                self._segments.put(None)
+
+    def _recognize(self):
+        try:
+            try:
+                backend = self.backend_factory()
+            except Exception as e:
+                # 各线程用同一个工厂，建不起来多半是配置问题：报告后停止整条流水线，
+                # 本线程仍照常取段直到结束标记，采集线程不会卡在队列上
+                with self._lock:
+                    if not self._stop.is_set(): self._results.put(VoiceResult(-1, False, f"识别后端错误: {e}", 0.0))
+                    self._stop.set()
+                backend = None
+            while True:
+                segment = self._segments.get()
+                if segment is None: break
+                if self._stop.is_set(): continue
+                try:
+                    success, text = backend.recognize(segment)
+                except Exception as e:
+                    success, text = False, f"识别错误: {e}"
+                self._deliver(VoiceResult(segment.seq, success, text, 0.0), segment)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if self._running == 0: self._results.put(None)
+
+    def _deliver(self, result, segment):
+        """ 结果按 seq 顺序放入输出队列；前面的段还没识别完时先暂存 """
+        with self._lock:
+            self._pending[result.seq] = (result, segment)
+            while self._next in self._pending:
+                result, segment = self._pending.pop(self._next)
+                result.latency = time.perf_counter() - segment.captured_at
+                self._results.put(result)
+                self._next += 1
+
+
+# ---------- 兼容旧接口 ----------
 class VoiceRecognizer:
     def __init__(self):
         self.recognizer = sr.Recognizer()
-        
+
     def listen_and_convert(self):
         """
-        监听麦克风并转换为文字
+        监听麦克风并转换为文字 (单次，每次都重新校准)；持续识别请用 VoicePipeline
         :return: (success: bool, content: str)
         """
         try:
             with sr.Microphone() as source:
                 # 调整环境噪音 (防止一开始就录入杂音)
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                
+                self.recognizer.adjust_for_ambient_noise(source, duration=CALIBRATION_S)
+
                 print(">>> 正在聆听...")
-                # 开始录音 (timeout=5 表示如果5秒没说话就超时)
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-                
+                audio = self.recognizer.listen(source, timeout=LISTEN_TIMEOUT_S, phrase_time_limit=PHRASE_LIMIT_S)
+
                 print(">>> 正在识别...")
-                # 调用 Google 免费 API (需联网)
-                # language='zh-CN'，指定识别中文
                 text = self.recognizer.recognize_google(audio, language='zh-CN')
                 return True, text
 
@@ -33,9 +272,94 @@ class VoiceRecognizer:
         except Exception as e:
             return False, f"麦克风错误: {e}"
 
-# 测试代码
+
+# ---------- 离线基准 ----------
+def make_test_wavs(directory, count=20, min_s=1.0, max_s=4.0, rate=16000):
+    """ 生成 count 段静音 WAV 与参考文本，供 WavSource / WavBackend 使用 """
+    import random
+    rnd = random.Random(20240101)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"seg{i:03d}.wav")
+        frames = int(rnd.uniform(min_s, max_s) * rate)
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(b"\0\0" * frames)
+        with open(os.path.splitext(path)[0] + ".txt", 'w', encoding='utf-8') as f:
+            f.write(f"第{i}句")
+        paths.append(path)
+    return paths
+
+
+def simulate_sequential(durations, gap, calibration, recognize_s):
+    """
+    旧的串行循环 (每句校准 → 录音 → 识别，识别期间不录音) 在连续说话时的表现，按时间线推算
+    :return: (听到的句数, 平均端到端延迟)
+    """
+    starts, t = [], 0.0
+    for d in durations:
+        starts.append(t)
+        t += d + gap
+    free, heard, latency = 0.0, 0, 0.0
+    for start, d in zip(starts, durations):
+        # 这句开始时还在校准或识别上一句，就听不到 (开头被截断的句子也算丢失)
+        if start < free + calibration: continue
+        end = start + d
+        done = end + recognize_s(d)
+        heard += 1
+        latency += done - end
+        free = done
+    return heard, latency / heard if heard else 0.0
+
+
+def bench(paths, workers_list=(1, 2, 4), delay=0.8, per_second=0.1, gap=0.3, speed=10.0):
+    durations = []
+    for path in paths:
+        with wave.open(path, 'rb') as w:
+            durations.append(w.getnframes() / w.getframerate())
+    speech = sum(durations) + gap * len(durations)
+    heard, lat = simulate_sequential(durations, gap, CALIBRATION_S, lambda d: delay + d * per_second)
+    print(f"{len(paths)} 段, 连续说话 {speech:.1f} s | 识别耗时 {delay:.2f} s + {per_second:.2f} × 时长 | 时间加速 {speed:g} 倍")
+    print(f"旧串行循环 (推算): 听到 {heard}/{len(paths)} 段, 平均延迟 {lat * 1000:.0f} ms")
+    for n in workers_list:
+        pipeline = VoicePipeline(WavSource(paths, realtime=True, gap=gap, speed=speed),
+                                 lambda: WavBackend(delay, per_second, speed), workers=n).start()
+        t0 = time.perf_counter()
+        got = list(pipeline.results())
+        elapsed = (time.perf_counter() - t0) * speed
+        ordered = [r.seq for r in got] == list(range(len(paths)))
+        lats = sorted(r.latency * speed for r in got)
+        p50 = lats[len(lats) // 2] if lats else 0.0
+        print(f"流水线 {n} 个识别线程: 识别 {sum(r.success for r in got)}/{len(paths)} 段, 有序 {ordered}, "
+              f"用时 {elapsed:.1f} s, 延迟 p50 {p50 * 1000:.0f} ms / 最大 {(lats[-1] if lats else 0) * 1000:.0f} ms")
+
+
+# 测试代码: python voice.py (麦克风)；python voice.py --bench [WAV目录] (离线基准)
 if __name__ == "__main__":
-    vr = VoiceRecognizer()
-    print("请说话...")
-    success, res = vr.listen_and_convert()
-    print(f"结果: {res}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="语音输入")
+    parser.add_argument("--bench", nargs="?", const="", default=None, help="离线基准，可指定 WAV 目录 (默认生成测试音频)")
+    parser.add_argument("-w", "--workers", default="1,2,4", help="识别线程数，逗号分隔")
+    parser.add_argument("--delay", type=float, default=0.8, help="模拟的识别固定耗时 (秒)")
+    parser.add_argument("--speed", type=float, default=10.0, help="时间加速倍数")
+    args = parser.parse_args()
+
+    if args.bench is not None:
+        if args.bench:
+            paths = sorted(os.path.join(args.bench, f) for f in os.listdir(args.bench) if f.endswith(".wav"))
+        else:
+            paths = make_test_wavs(tempfile.mkdtemp())
+        bench(paths, [int(x) for x in args.workers.split(",")], args.delay, speed=args.speed)
+        sys.exit(0)
+
+    if not SR_AVAILABLE:
+        print("未安装 SpeechRecognition: pip install SpeechRecognition pyaudio")
+        sys.exit(1)
+    pipeline = VoicePipeline(MicrophoneSource(), GoogleBackend).start()
+    print("请说话... (Ctrl+C 结束)")
+    try:
+        for result in pipeline.results():
+            print(f"结果: {result.text}")
+    except KeyboardInterrupt:
+        pipeline.stop()